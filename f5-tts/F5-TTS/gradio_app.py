@@ -1,23 +1,12 @@
 import re
 import torch
-import torchaudio
 import gradio as gr
 import numpy as np
 import tempfile
-from einops import rearrange
-from vocos import Vocos
-from pydub import AudioSegment, silence
-from model import CFM, UNetT, DiT, MMDiT
-from cached_path import cached_path
-from model.utils import (
-    load_checkpoint,
-    get_tokenizer,
-    convert_char_to_pinyin,
-    save_spectrogram,
-)
-from transformers import pipeline
+from model.utils import save_spectrogram
+from model.utils_infer import chunk_text, get_asr_pipe, get_model, get_vocoder, infer_batch_process, infer_stream_process, VoiceCache
+from model.utils_infer import remove_silence as remove_silence_from_wave
 import click
-import soundfile as sf
 
 try:
     import spaces
@@ -39,13 +28,8 @@ device = (
 
 print(f"Using {device} device")
 
-pipe = pipeline(
-    "automatic-speech-recognition",
-    model="openai/whisper-large-v3-turbo",
-    torch_dtype=torch.float16,
-    device=device,
-)
-vocos = Vocos.from_pretrained("charactr/vocos-mel-24khz")
+pipe = get_asr_pipe(device)
+vocos = get_vocoder()
 
 # --------------------- Settings -------------------- #
 
@@ -55,77 +39,23 @@ hop_length = 256
 target_rms = 0.1
 nfe_step = 32  # 16, 32
 cfg_strength = 2.0
+batched_cfg = True  # run cond & null cfg branches in one transformer forward
+infer_batch_size = 8  # max text chunks per sample() call, length-bucketed
+decode_queue_depth = 2  # sampled chunks waiting for vocoder decode while next is sampled, 0 to decode inline
+lean_ode = True  # trajectory not needed, keep only current ode state
+cross_fade_curve = "linear"  # linear | equal_power
 ode_method = "euler"
 sway_sampling_coef = -1.0
 speed = 1.0
 fix_duration = None
 
+# reference voices preprocessed once, keyed by audio content, e.g. both podcast speakers across all blocks
+voice_cache = VoiceCache(max_size=32, target_rms=target_rms)
 
-def load_model(repo_name, exp_name, model_cls, model_cfg, ckpt_step):
-    ckpt_path = str(cached_path(f"hf://SWivid/{repo_name}/{exp_name}/model_{ckpt_step}.safetensors"))
-    # ckpt_path = f"ckpts/{exp_name}/model_{ckpt_step}.pt"  # .pt | .safetensors
-    vocab_char_map, vocab_size = get_tokenizer("Emilia_ZH_EN", "pinyin")
-    model = CFM(
-        transformer=model_cls(
-            **model_cfg, text_num_embeds=vocab_size, mel_dim=n_mel_channels
-        ),
-        mel_spec_kwargs=dict(
-            target_sample_rate=target_sample_rate,
-            n_mel_channels=n_mel_channels,
-            hop_length=hop_length,
-        ),
-        odeint_kwargs=dict(
-            method=ode_method,
-        ),
-        vocab_char_map=vocab_char_map,
-    ).to(device)
-
-    model = load_checkpoint(model, ckpt_path, device, use_ema = True)
-
-    return model
-
-
-# load models
-F5TTS_model_cfg = dict(
-    dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4
-)
-E2TTS_model_cfg = dict(dim=1024, depth=24, heads=16, ff_mult=4)
-
-F5TTS_ema_model = load_model(
-    "F5-TTS", "F5TTS_Base", DiT, F5TTS_model_cfg, 1200000
-)
-E2TTS_ema_model = load_model(
-    "E2-TTS", "E2TTS_Base", UNetT, E2TTS_model_cfg, 1200000
-)
-
-def chunk_text(text, max_chars=135):
-    """
-    Splits the input text into chunks, each with a maximum number of characters.
-
-    Args:
-        text (str): The text to be split.
-        max_chars (int): The maximum number of characters per chunk.
-
-    Returns:
-        List[str]: A list of text chunks.
-    """
-    chunks = []
-    current_chunk = ""
-    # Split the text into sentences based on punctuation followed by whitespace
-    sentences = re.split(r'(?<=[;:,.!?])\s+|(?<=[；：，。！？])', text)
-
-    for sentence in sentences:
-        if len(current_chunk.encode('utf-8')) + len(sentence.encode('utf-8')) <= max_chars:
-            current_chunk += sentence + " " if sentence and len(sentence[-1].encode('utf-8')) == 1 else sentence
-        else:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = sentence + " " if sentence and len(sentence[-1].encode('utf-8')) == 1 else sentence
-
-    if current_chunk:
-        chunks.append(current_chunk.strip())
 
-    return chunks
+# load models, kept warm in the process level pool
+F5TTS_ema_model = get_model("F5-TTS", device=device)
+E2TTS_ema_model = get_model("E2-TTS", device=device)
 
 @gpu_decorator
 def infer_batch(ref_audio, ref_text, gen_text_batches, exp_name, remove_silence, cross_fade_duration=0.15, progress=gr.Progress()):
@@ -134,153 +64,90 @@ def infer_batch(ref_audio, ref_text, gen_text_batches, exp_name, remove_silence,
     elif exp_name == "E2-TTS":
         ema_model = E2TTS_ema_model
 
-    audio, sr = ref_audio
-    if audio.shape[0] > 1:
-        audio = torch.mean(audio, dim=0, keepdim=True)
-
-    rms = torch.sqrt(torch.mean(torch.square(audio)))
-    if rms < target_rms:
-        audio = audio * target_rms / rms
-    if sr != target_sample_rate:
-        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-        audio = resampler(audio)
-    audio = audio.to(device)
-
-    generated_waves = []
-    spectrograms = []
-
-    for i, gen_text in enumerate(progress.tqdm(gen_text_batches)):
-        # Prepare the text
-        if len(ref_text[-1].encode('utf-8')) == 1:
-            ref_text = ref_text + " "
-        text_list = [ref_text + gen_text]
-        final_text_list = convert_char_to_pinyin(text_list)
-
-        # Calculate duration
-        ref_audio_len = audio.shape[-1] // hop_length
-        zh_pause_punc = r"。，、；：？！"
-        ref_text_len = len(ref_text.encode('utf-8')) + 3 * len(re.findall(zh_pause_punc, ref_text))
-        gen_text_len = len(gen_text.encode('utf-8')) + 3 * len(re.findall(zh_pause_punc, gen_text))
-        duration = ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / speed)
-
-        # inference
-        with torch.inference_mode():
-            generated, _ = ema_model.sample(
-                cond=audio,
-                text=final_text_list,
-                duration=duration,
-                steps=nfe_step,
-                cfg_strength=cfg_strength,
-                sway_sampling_coef=sway_sampling_coef,
-            )
-
-        generated = generated[:, ref_audio_len:, :]
-        generated_mel_spec = rearrange(generated, "1 n d -> 1 d n")
-        generated_wave = vocos.decode(generated_mel_spec.cpu())
-        if rms < target_rms:
-            generated_wave = generated_wave * rms / target_rms
-
-        # wav -> numpy
-        generated_wave = generated_wave.squeeze().cpu().numpy()
-        
-        generated_waves.append(generated_wave)
-        spectrograms.append(generated_mel_spec[0].cpu().numpy())
-
-    # Combine all generated waves with cross-fading
-    if cross_fade_duration <= 0:
-        # Simply concatenate
-        final_wave = np.concatenate(generated_waves)
-    else:
-        final_wave = generated_waves[0]
-        for i in range(1, len(generated_waves)):
-            prev_wave = final_wave
-            next_wave = generated_waves[i]
-
-            # Calculate cross-fade samples, ensuring it does not exceed wave lengths
-            cross_fade_samples = int(cross_fade_duration * target_sample_rate)
-            cross_fade_samples = min(cross_fade_samples, len(prev_wave), len(next_wave))
-
-            if cross_fade_samples <= 0:
-                # No overlap possible, concatenate
-                final_wave = np.concatenate([prev_wave, next_wave])
-                continue
-
-            # Overlapping parts
-            prev_overlap = prev_wave[-cross_fade_samples:]
-            next_overlap = next_wave[:cross_fade_samples]
-
-            # Fade out and fade in
-            fade_out = np.linspace(1, 0, cross_fade_samples)
-            fade_in = np.linspace(0, 1, cross_fade_samples)
-
-            # Cross-faded overlap
-            cross_faded_overlap = prev_overlap * fade_out + next_overlap * fade_in
-
-            # Combine
-            new_wave = np.concatenate([
-                prev_wave[:-cross_fade_samples],
-                cross_faded_overlap,
-                next_wave[cross_fade_samples:]
-            ])
-
-            final_wave = new_wave
+    final_wave, combined_spectrogram = infer_batch_process(
+        ref_audio,
+        ref_text,
+        gen_text_batches,
+        ema_model,
+        vocos,
+        cross_fade_duration=cross_fade_duration,
+        cross_fade_curve=cross_fade_curve,
+        nfe_step=nfe_step,
+        cfg_strength=cfg_strength,
+        sway_sampling_coef=sway_sampling_coef,
+        speed=speed,
+        target_rms=target_rms,
+        decode_queue_depth=decode_queue_depth,
+        max_batch_size=infer_batch_size,
+        progress=progress.tqdm,
+        device=device,
+        batched_cfg=batched_cfg,
+        lean_ode=lean_ode,
+    )
 
     # Remove silence
     if remove_silence:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-            sf.write(f.name, final_wave, target_sample_rate)
-            aseg = AudioSegment.from_file(f.name)
-            non_silent_segs = silence.split_on_silence(aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=500)
-            non_silent_wave = AudioSegment.silent(duration=0)
-            for non_silent_seg in non_silent_segs:
-                non_silent_wave += non_silent_seg
-            aseg = non_silent_wave
-            aseg.export(f.name, format="wav")
-            final_wave, _ = torchaudio.load(f.name)
-        final_wave = final_wave.squeeze().cpu().numpy()
-
-    # Create a combined spectrogram
-    combined_spectrogram = np.concatenate(spectrograms, axis=1)
-    
+        final_wave = remove_silence_from_wave(final_wave, target_sample_rate, min_silence_len=1000, silence_thresh=-50, keep_silence=500)
+
     with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_spectrogram:
         spectrogram_path = tmp_spectrogram.name
         save_spectrogram(combined_spectrogram, spectrogram_path)
 
     return (target_sample_rate, final_wave), spectrogram_path
 
+@gpu_decorator
+def infer_stream(ref_audio_orig, ref_text, gen_text, exp_name, cross_fade_duration=0.15):
+    # yield cross-faded audio blocks as each chunk finishes, for a streaming audio output
+    ref_audio, ref_text, gen_text_batches = prepare_infer(ref_audio_orig, ref_text, gen_text)
+    if exp_name == "F5-TTS":
+        ema_model = F5TTS_ema_model
+    elif exp_name == "E2-TTS":
+        ema_model = E2TTS_ema_model
+
+    gr.Info(f"Streaming audio using {exp_name} in {len(gen_text_batches)} batches")
+    for wave_block, _ in infer_stream_process(
+        ref_audio,
+        ref_text,
+        gen_text_batches,
+        ema_model,
+        vocos,
+        cross_fade_duration=cross_fade_duration,
+        cross_fade_curve=cross_fade_curve,
+        nfe_step=nfe_step,
+        cfg_strength=cfg_strength,
+        sway_sampling_coef=sway_sampling_coef,
+        speed=speed,
+        target_rms=target_rms,
+        decode_queue_depth=decode_queue_depth,
+        device=device,
+        batched_cfg=batched_cfg,
+        lean_ode=lean_ode,
+    ):
+        if len(wave_block):
+            yield target_sample_rate, wave_block.astype(np.float32)
+
+
 @gpu_decorator
 def infer(ref_audio_orig, ref_text, gen_text, exp_name, remove_silence, cross_fade_duration=0.15):
+    ref_audio, ref_text, gen_text_batches = prepare_infer(ref_audio_orig, ref_text, gen_text)
+    gr.Info(f"Generating audio using {exp_name} in {len(gen_text_batches)} batches")
+    return infer_batch(ref_audio, ref_text, gen_text_batches, exp_name, remove_silence, cross_fade_duration)
 
-    print(gen_text)
 
-    gr.Info("Converting audio...")
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-        aseg = AudioSegment.from_file(ref_audio_orig)
+def prepare_infer(ref_audio_orig, ref_text, gen_text):
 
-        non_silent_segs = silence.split_on_silence(
-            aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=1000
-        )
-        non_silent_wave = AudioSegment.silent(duration=0)
-        for non_silent_seg in non_silent_segs:
-            non_silent_wave += non_silent_seg
-        aseg = non_silent_wave
-
-        audio_duration = len(aseg)
-        if audio_duration > 15000:
-            gr.Warning("Audio is over 15s, clipping to only first 15s.")
-            aseg = aseg[:15000]
-        aseg.export(f.name, format="wav")
-        ref_audio = f.name
+    print(gen_text)
 
+    gr.Info("Converting audio...")
     if not ref_text.strip():
         gr.Info("No reference text provided, transcribing reference audio...")
-        ref_text = pipe(
-            ref_audio,
-            chunk_length_s=30,
-            batch_size=128,
-            generate_kwargs={"task": "transcribe"},
-            return_timestamps=False,
-        )["text"].strip()
+    # decoded, trimmed, clipped & transcribed only on first use of this audio
+    voice = voice_cache.get(ref_audio_orig, get_asr=None if ref_text.strip() else lambda: pipe)
+    if voice.clipped:
+        gr.Warning("Audio is over 15s, clipping to only first 15s.")
+
+    if not ref_text.strip():
+        ref_text = voice.transcript
         gr.Info("Finished transcription")
     else:
         gr.Info("Using custom reference text...")
@@ -292,17 +159,14 @@ def infer(ref_audio_orig, ref_text, gen_text, exp_name, remove_silence, cross_fa
         else:
             ref_text += ". "
 
-    audio, sr = torchaudio.load(ref_audio)
-
     # Use the new chunk_text function to split gen_text
-    max_chars = int(len(ref_text.encode('utf-8')) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
+    max_chars = int(len(ref_text.encode('utf-8')) / voice.duration * (25 - voice.duration))
     gen_text_batches = chunk_text(gen_text, max_chars=max_chars)
     print('ref_text', ref_text)
     for i, batch_text in enumerate(gen_text_batches):
         print(f'gen_text {i}', batch_text)
-    
-    gr.Info(f"Generating audio using {exp_name} in {len(gen_text_batches)} batches")
-    return infer_batch((audio, sr), ref_text, gen_text_batches, exp_name, remove_silence, cross_fade_duration)
+
+    return voice, ref_text, gen_text_batches
 
 
 @gpu_decorator
@@ -332,27 +196,19 @@ def generate_podcast(script, speaker1_name, ref_audio1, ref_text1, speaker2_name
         
         # Convert the generated audio to a numpy array
         sr, audio_data = audio
-        
-        # Save the audio data as a WAV file
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-            sf.write(temp_file.name, audio_data, sr)
-            audio_segment = AudioSegment.from_wav(temp_file.name)
-        
-        generated_audio_segments.append(audio_segment)
-        
+        generated_audio_segments.append(audio_data)
+
         # Add a short pause between speakers
-        pause = AudioSegment.silent(duration=500)  # 500ms pause
+        pause = np.zeros(int(0.5 * sr), dtype=audio_data.dtype)  # 500ms pause
         generated_audio_segments.append(pause)
-    
+
     # Concatenate all audio segments
-    final_podcast = sum(generated_audio_segments)
-    
-    # Export the final podcast
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as temp_file:
-        podcast_path = temp_file.name
-        final_podcast.export(podcast_path, format="wav")
-    
-    return podcast_path
+    if not generated_audio_segments:
+        gr.Warning("No audio generated.")
+        return None
+    final_podcast = np.concatenate(generated_audio_segments)
+
+    return sr, final_podcast
 
 def parse_speechtypes_text(gen_text):
     # Pattern to find (Emotion)
@@ -399,6 +255,7 @@ with gr.Blocks() as app_tts:
         choices=["F5-TTS", "E2-TTS"], label="Choose TTS Model", value="F5-TTS"
     )
     generate_btn = gr.Button("Synthesize", variant="primary")
+    stream_btn = gr.Button("Stream", variant="secondary")
     with gr.Accordion("Advanced Settings", open=False):
         ref_text_input = gr.Textbox(
             label="Reference Text",
@@ -429,6 +286,7 @@ with gr.Blocks() as app_tts:
     speed_slider.change(update_speed, inputs=speed_slider)
 
     audio_output = gr.Audio(label="Synthesized Audio")
+    audio_stream_output = gr.Audio(label="Streamed Audio", streaming=True, autoplay=True)
     spectrogram_output = gr.Image(label="Spectrogram")
 
     generate_btn.click(
@@ -443,6 +301,17 @@ with gr.Blocks() as app_tts:
         ],
         outputs=[audio_output, spectrogram_output],
     )
+    stream_btn.click(
+        infer_stream,
+        inputs=[
+            ref_audio_input,
+            ref_text_input,
+            gen_text_input,
+            model_choice,
+            cross_fade_duration_slider,
+        ],
+        outputs=audio_stream_output,
+    )
     
 with gr.Blocks() as app_podcast:
     gr.Markdown("# Podcast Generation")
@@ -779,8 +648,15 @@ If you're having issues, try converting your reference audio to WAV or MP3, clip
     help="Share the app via Gradio share link",
 )
 @click.option("--api", "-a", default=True, is_flag=True, help="Allow API access")
-def main(port, host, share, api):
+@click.option("--voice_cache_dir", default=None, help="Folder keeping preprocessed reference voices across restarts")
+@click.option("--batched_cfg/--no-batched_cfg", default=batched_cfg, help="Run the cond & null CFG branches in one transformer forward")
+@click.option("--infer_batch_size", default=infer_batch_size, type=int, help="Max text chunks per sampling call, 1 for chunk by chunk")
+@click.option("--decode_queue_depth", default=decode_queue_depth, type=int, help="Chunks waiting for vocoder decode, 0 to decode inline")
+@click.option("--lean_ode/--no-lean_ode", default=lean_ode, help="Integrate the ODE keeping only the current state")
+def main(port, host, share, api, voice_cache_dir, **settings):
     global app
+    voice_cache.cache_dir = voice_cache_dir
+    globals().update(settings)  # batched_cfg, infer_batch_size, decode_queue_depth, lean_ode read by the infer functions
     print(f"Starting app...")
     app.queue(api_open=api).launch(
         server_name=host, server_port=port, share=share, show_api=api
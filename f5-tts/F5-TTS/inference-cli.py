@@ -1,24 +1,19 @@
 import argparse
 import codecs
-import re
-import tempfile
+import sys
 from pathlib import Path
 
 import numpy as np
 import soundfile as sf
 import tomli
 import torch
-import torchaudio
 import tqdm
-from cached_path import cached_path
-from einops import rearrange
-from pydub import AudioSegment, silence
-from transformers import pipeline
-from vocos import Vocos
 
-from model import CFM, DiT, MMDiT, UNetT
-from model.utils import (convert_char_to_pinyin, get_tokenizer,
-                         load_checkpoint, save_spectrogram)
+from model.utils import save_spectrogram
+from model.utils_infer import (chunk_text, get_asr_pipe, get_model, get_vocoder,
+                               infer_batch_process, infer_stream_process,
+                               preload_model, VoiceCache)
+from model.utils_infer import remove_silence as remove_silence_from_wave
 
 parser = argparse.ArgumentParser(
     prog="python3 inference-cli.py",
@@ -67,10 +62,31 @@ parser.add_argument(
     type=str,
     help="Path to output folder..",
 )
+parser.add_argument(
+    "-b",
+    "--batch_file",
+    type=str,
+    help="File listing one gen_file per line, each job written to output_dir/<gen_file stem>.wav. Models are loaded once for all jobs.",
+)
+parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="Write audio progressively as each chunk finishes. Remove silence is not applied.",
+)
+parser.add_argument(
+    "--stream_sink",
+    type=str,
+    help="Stream sink: .wav file (default output_dir/out.wav), .raw/.pcm file or - for stdout, as 16-bit PCM.",
+)
 parser.add_argument(
     "--remove_silence",
     help="Remove silence.",
 )
+parser.add_argument(
+    "--voice_cache_dir",
+    type=str,
+    help="Folder keeping preprocessed reference voices (mel, rms, transcript, tokens) across runs.",
+)
 parser.add_argument(
     "--load_vocoder_from_local",
     action="store_true",
@@ -89,9 +105,22 @@ if gen_file:
 output_dir = args.output_dir if args.output_dir else config["output_dir"]
 model = args.model if args.model else config["model"]
 remove_silence = args.remove_silence if args.remove_silence else config["remove_silence"]
+batched_cfg = config.get("batched_cfg", True)
+infer_batch_size = config.get("infer_batch_size", 8)
+decode_queue_depth = config.get("decode_queue_depth", 2)
+lean_ode = config.get("lean_ode", True)
+block_cache_shallow = config.get("block_cache_shallow", 0) if model == "F5-TTS" else 0
+block_cache_refresh = config.get("block_cache_refresh", 4)
+voice_cache_dir = args.voice_cache_dir if args.voice_cache_dir else config.get("voice_cache_dir") or None
 wave_path = Path(output_dir)/"out.wav"
 spectrogram_path = Path(output_dir)/"out.png"
 vocos_local_path = "../checkpoints/charactr/vocos-mel-24khz"
+stream_sink = args.stream_sink if args.stream_sink else wave_path
+
+# raw audio to stdout, thus all logs to stderr
+stdout_buffer = sys.stdout.buffer
+if args.stream and str(stream_sink) == "-":
+    sys.stdout = sys.stderr
 
 device = (
     "cuda"
@@ -99,15 +128,7 @@ device = (
     else "mps" if torch.backends.mps.is_available() else "cpu"
 )
 
-if args.load_vocoder_from_local:
-    print(f"Load vocos from local path {vocos_local_path}")
-    vocos = Vocos.from_hparams(f"{vocos_local_path}/config.yaml")
-    state_dict = torch.load(f"{vocos_local_path}/pytorch_model.bin", map_location=device)
-    vocos.load_state_dict(state_dict)
-    vocos.eval()
-else:
-    print("Donwload Vocos from huggingface charactr/vocos-mel-24khz")
-    vocos = Vocos.from_pretrained("charactr/vocos-mel-24khz")
+vocos = get_vocoder(vocos_local_path if args.load_vocoder_from_local else None)
 
 print(f"Using {device} device")
 
@@ -119,224 +140,117 @@ hop_length = 256
 target_rms = 0.1
 nfe_step = 32  # 16, 32
 cfg_strength = 2.0
+# batched_cfg, infer_batch_size, decode_queue_depth & lean_ode from config
+cross_fade_curve = "linear"  # linear | equal_power
 ode_method = "euler"
 sway_sampling_coef = -1.0
 speed = 1.0
 # fix_duration = 27  # None or float (duration in seconds)
 fix_duration = None
 
-def load_model(repo_name, exp_name, model_cls, model_cfg, ckpt_step):
-    ckpt_path = f"ckpts/{exp_name}/model_{ckpt_step}.pt" # .pt | .safetensors
-    if not Path(ckpt_path).exists():
-        ckpt_path = str(cached_path(f"hf://SWivid/{repo_name}/{exp_name}/model_{ckpt_step}.safetensors"))
-    vocab_char_map, vocab_size = get_tokenizer("Emilia_ZH_EN", "pinyin")
-    model = CFM(
-        transformer=model_cls(
-            **model_cfg, text_num_embeds=vocab_size, mel_dim=n_mel_channels
-        ),
-        mel_spec_kwargs=dict(
-            target_sample_rate=target_sample_rate,
-            n_mel_channels=n_mel_channels,
-            hop_length=hop_length,
-        ),
-        odeint_kwargs=dict(
-            method=ode_method,
-        ),
-        vocab_char_map=vocab_char_map,
-    ).to(device)
-
-    model = load_checkpoint(model, ckpt_path, device, use_ema = True)
-
-    return model
-
-
-# load models
-F5TTS_model_cfg = dict(
-    dim=1024, depth=22, heads=16, ff_mult=2, text_dim=512, conv_layers=4
-)
-E2TTS_model_cfg = dict(dim=1024, depth=24, heads=16, ff_mult=4)
-
-
-def chunk_text(text, max_chars=135):
-    """
-    Splits the input text into chunks, each with a maximum number of characters.
-    Args:
-        text (str): The text to be split.
-        max_chars (int): The maximum number of characters per chunk.
-    Returns:
-        List[str]: A list of text chunks.
-    """
-    chunks = []
-    current_chunk = ""
-    # Split the text into sentences based on punctuation followed by whitespace
-    sentences = re.split(r'(?<=[;:,.!?])\s+|(?<=[；：，。！？])', text)
-
-    for sentence in sentences:
-        if len(current_chunk.encode('utf-8')) + len(sentence.encode('utf-8')) <= max_chars:
-            current_chunk += sentence + " " if sentence and len(sentence[-1].encode('utf-8')) == 1 else sentence
-        else:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = sentence + " " if sentence and len(sentence[-1].encode('utf-8')) == 1 else sentence
-
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-
-    return chunks
-
-
-def infer_batch(ref_audio, ref_text, gen_text_batches, model, remove_silence, cross_fade_duration=0.15):
-    if model == "F5-TTS":
-        ema_model = load_model(model, "F5TTS_Base", DiT, F5TTS_model_cfg, 1200000)
-    elif model == "E2-TTS":
-        ema_model = load_model(model, "E2TTS_Base", UNetT, E2TTS_model_cfg, 1200000)
-
-    audio, sr = ref_audio
-    if audio.shape[0] > 1:
-        audio = torch.mean(audio, dim=0, keepdim=True)
-
-    rms = torch.sqrt(torch.mean(torch.square(audio)))
-    if rms < target_rms:
-        audio = audio * target_rms / rms
-    if sr != target_sample_rate:
-        resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-        audio = resampler(audio)
-    audio = audio.to(device)
+# reference voices preprocessed once, keyed by audio content, reused by all jobs
+voice_cache = VoiceCache(max_size=32, cache_dir=voice_cache_dir, target_rms=target_rms)
+
+def infer_batch(ref_audio, ref_text, gen_text_batches, model, remove_silence, cross_fade_duration=0.15, wave_path=wave_path, spectrogram_path=spectrogram_path):
+    ema_model = get_model(model, device=device)  # warm from pool after first job
+
+    final_wave, combined_spectrogram = infer_batch_process(
+        ref_audio,
+        ref_text,
+        gen_text_batches,
+        ema_model,
+        vocos,
+        cross_fade_duration=cross_fade_duration,
+        cross_fade_curve=cross_fade_curve,
+        nfe_step=nfe_step,
+        cfg_strength=cfg_strength,
+        sway_sampling_coef=sway_sampling_coef,
+        speed=speed,
+        target_rms=target_rms,
+        decode_queue_depth=decode_queue_depth,
+        max_batch_size=infer_batch_size,
+        progress=tqdm.tqdm,
+        device=device,
+        batched_cfg=batched_cfg,
+        lean_ode=lean_ode,
+        block_cache_shallow=block_cache_shallow,
+        block_cache_refresh=block_cache_refresh,
+    )
+
+    # Remove silence
+    if remove_silence:
+        final_wave = remove_silence_from_wave(final_wave, target_sample_rate, min_silence_len=1000, silence_thresh=-50, keep_silence=500)
+
+    sf.write(wave_path, final_wave, target_sample_rate)
+    print(wave_path)
 
-    generated_waves = []
-    spectrograms = []
-
-    for i, gen_text in enumerate(tqdm.tqdm(gen_text_batches)):
-        # Prepare the text
-        if len(ref_text[-1].encode('utf-8')) == 1:
-            ref_text = ref_text + " "
-        text_list = [ref_text + gen_text]
-        final_text_list = convert_char_to_pinyin(text_list)
-
-        # Calculate duration
-        ref_audio_len = audio.shape[-1] // hop_length
-        zh_pause_punc = r"。，、；：？！"
-        ref_text_len = len(ref_text.encode('utf-8')) + 3 * len(re.findall(zh_pause_punc, ref_text))
-        gen_text_len = len(gen_text.encode('utf-8')) + 3 * len(re.findall(zh_pause_punc, gen_text))
-        duration = ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / speed)
-
-        # inference
-        with torch.inference_mode():
-            generated, _ = ema_model.sample(
-                cond=audio,
-                text=final_text_list,
-                duration=duration,
-                steps=nfe_step,
-                cfg_strength=cfg_strength,
-                sway_sampling_coef=sway_sampling_coef,
-            )
+    save_spectrogram(combined_spectrogram, spectrogram_path)
+    print(spectrogram_path)
 
-        generated = generated[:, ref_audio_len:, :]
-        generated_mel_spec = rearrange(generated, "1 n d -> 1 d n")
-        generated_wave = vocos.decode(generated_mel_spec.cpu())
-        if rms < target_rms:
-            generated_wave = generated_wave * rms / target_rms
 
-        # wav -> numpy
-        generated_wave = generated_wave.squeeze().cpu().numpy()
-        
-        generated_waves.append(generated_wave)
-        spectrograms.append(generated_mel_spec[0].cpu().numpy())
+def infer_stream(ref_audio, ref_text, gen_text_batches, model, cross_fade_duration=0.15, sink=stream_sink, spectrogram_path=spectrogram_path):
+    ema_model = get_model(model, device=device)  # warm from pool after first job
 
-    # Combine all generated waves with cross-fading
-    if cross_fade_duration <= 0:
-        # Simply concatenate
-        final_wave = np.concatenate(generated_waves)
+    raw = str(sink) == "-" or Path(sink).suffix in (".raw", ".pcm")
+    if str(sink) == "-":
+        f = stdout_buffer
+    elif raw:
+        f = open(sink, "wb")
     else:
-        final_wave = generated_waves[0]
-        for i in range(1, len(generated_waves)):
-            prev_wave = final_wave
-            next_wave = generated_waves[i]
-
-            # Calculate cross-fade samples, ensuring it does not exceed wave lengths
-            cross_fade_samples = int(cross_fade_duration * target_sample_rate)
-            cross_fade_samples = min(cross_fade_samples, len(prev_wave), len(next_wave))
-
-            if cross_fade_samples <= 0:
-                # No overlap possible, concatenate
-                final_wave = np.concatenate([prev_wave, next_wave])
-                continue
-
-            # Overlapping parts
-            prev_overlap = prev_wave[-cross_fade_samples:]
-            next_overlap = next_wave[:cross_fade_samples]
-
-            # Fade out and fade in
-            fade_out = np.linspace(1, 0, cross_fade_samples)
-            fade_in = np.linspace(0, 1, cross_fade_samples)
-
-            # Cross-faded overlap
-            cross_faded_overlap = prev_overlap * fade_out + next_overlap * fade_in
-
-            # Combine
-            new_wave = np.concatenate([
-                prev_wave[:-cross_fade_samples],
-                cross_faded_overlap,
-                next_wave[cross_fade_samples:]
-            ])
-
-            final_wave = new_wave
-
-    with open(wave_path, "wb") as f:
-        sf.write(f.name, final_wave, target_sample_rate)
-        # Remove silence
-        if remove_silence:
-            aseg = AudioSegment.from_file(f.name)
-            non_silent_segs = silence.split_on_silence(aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=500)
-            non_silent_wave = AudioSegment.silent(duration=0)
-            for non_silent_seg in non_silent_segs:
-                non_silent_wave += non_silent_seg
-            aseg = non_silent_wave
-            aseg.export(f.name, format="wav")
-        print(f.name)
+        f = sf.SoundFile(sink, "w", samplerate=target_sample_rate, channels=1, subtype="PCM_16")
 
-    # Create a combined spectrogram
-    combined_spectrogram = np.concatenate(spectrograms, axis=1)
-    save_spectrogram(combined_spectrogram, spectrogram_path)
+    spectrograms = []
+    try:
+        for wave_block, mel in tqdm.tqdm(infer_stream_process(
+            ref_audio,
+            ref_text,
+            gen_text_batches,
+            ema_model,
+            vocos,
+            cross_fade_duration=cross_fade_duration,
+            cross_fade_curve=cross_fade_curve,
+            nfe_step=nfe_step,
+            cfg_strength=cfg_strength,
+            sway_sampling_coef=sway_sampling_coef,
+            speed=speed,
+            target_rms=target_rms,
+            decode_queue_depth=decode_queue_depth,
+            device=device,
+            batched_cfg=batched_cfg,
+            lean_ode=lean_ode,
+            block_cache_shallow=block_cache_shallow,
+            block_cache_refresh=block_cache_refresh,
+        ), total=len(gen_text_batches) + 1):
+            if raw:
+                f.write((np.clip(wave_block, -1, 1) * 32767).astype("<i2").tobytes())
+            else:
+                f.write(wave_block)
+            f.flush()  # wav header updated, readable while still being written
+            if mel is not None:
+                spectrograms.append(mel)
+    finally:
+        if f is not stdout_buffer:
+            f.close()
+    print(sink)
+
+    save_spectrogram(np.concatenate(spectrograms, axis=1), spectrogram_path)
     print(spectrogram_path)
 
 
-def infer(ref_audio_orig, ref_text, gen_text, model, remove_silence, cross_fade_duration=0.15):
+def infer(ref_audio_orig, ref_text, gen_text, model, remove_silence, cross_fade_duration=0.15, wave_path=wave_path, spectrogram_path=spectrogram_path):
 
     print(gen_text)
 
     print("Converting audio...")
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
-        aseg = AudioSegment.from_file(ref_audio_orig)
-
-        non_silent_segs = silence.split_on_silence(aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=1000)
-        non_silent_wave = AudioSegment.silent(duration=0)
-        for non_silent_seg in non_silent_segs:
-            non_silent_wave += non_silent_seg
-        aseg = non_silent_wave
-
-        audio_duration = len(aseg)
-        if audio_duration > 15000:
-            print("Audio is over 15s, clipping to only first 15s.")
-            aseg = aseg[:15000]
-        aseg.export(f.name, format="wav")
-        ref_audio = f.name
-
     if not ref_text.strip():
         print("No reference text provided, transcribing reference audio...")
-        pipe = pipeline(
-            "automatic-speech-recognition",
-            model="openai/whisper-large-v3-turbo",
-            torch_dtype=torch.float16,
-            device=device,
-        )
-        ref_text = pipe(
-            ref_audio,
-            chunk_length_s=30,
-            batch_size=128,
-            generate_kwargs={"task": "transcribe"},
-            return_timestamps=False,
-        )["text"].strip()
+    # decoded, trimmed, clipped & transcribed only on first use of this audio
+    voice = voice_cache.get(ref_audio_orig, get_asr=None if ref_text.strip() else lambda: get_asr_pipe(device))
+    if voice.clipped:
+        print("Audio is over 15s, clipping to only first 15s.")
+
+    if not ref_text.strip():
+        ref_text = voice.transcript
         print("Finished transcription")
     else:
         print("Using custom reference text...")
@@ -349,15 +263,29 @@ def infer(ref_audio_orig, ref_text, gen_text, model, remove_silence, cross_fade_
             ref_text += ". "
 
     # Split the input text into batches
-    audio, sr = torchaudio.load(ref_audio)
-    max_chars = int(len(ref_text.encode('utf-8')) / (audio.shape[-1] / sr) * (25 - audio.shape[-1] / sr))
+    max_chars = int(len(ref_text.encode('utf-8')) / voice.duration * (25 - voice.duration))
     gen_text_batches = chunk_text(gen_text, max_chars=max_chars)
     print('ref_text', ref_text)
     for i, gen_text in enumerate(gen_text_batches):
         print(f'gen_text {i}', gen_text)
     
-    print(f"Generating audio using {model} in {len(gen_text_batches)} batches, loading models...")
-    return infer_batch((audio, sr), ref_text, gen_text_batches, model, remove_silence, cross_fade_duration)
+    print(f"Generating audio using {model} in {len(gen_text_batches)} batches")
+    if args.stream:
+        if remove_silence:
+            print("Remove silence needs the whole output, skipped when streaming.")
+        return infer_stream(voice, ref_text, gen_text_batches, model, cross_fade_duration, wave_path if args.batch_file else stream_sink, spectrogram_path)
+    return infer_batch(voice, ref_text, gen_text_batches, model, remove_silence, cross_fade_duration, wave_path, spectrogram_path)
     
 
-infer(ref_audio, ref_text, gen_text, model, remove_silence)
+preload_model(model, device=device)
+
+if args.batch_file:
+    jobs = [line.strip() for line in codecs.open(args.batch_file, "r", "utf-8") if line.strip()]
+    for i, job_file in enumerate(jobs):
+        print(f"Job {i + 1}/{len(jobs)}: {job_file}")
+        job_text = codecs.open(job_file, "r", "utf-8").read()
+        stem = Path(job_file).stem
+        infer(ref_audio, ref_text, job_text, model, remove_silence,
+              wave_path=Path(output_dir)/f"{stem}.wav", spectrogram_path=Path(output_dir)/f"{stem}.png")
+else:
+    infer(ref_audio, ref_text, gen_text, model, remove_silence)
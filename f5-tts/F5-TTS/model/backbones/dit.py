@@ -72,16 +72,29 @@ class TextEmbedding(nn.Module):
 class InputEmbedding(nn.Module):
     def __init__(self, mel_dim, text_dim, out_dim):
         super().__init__()
+        self.mel_dim = mel_dim
         self.proj = nn.Linear(mel_dim * 2 + text_dim, out_dim)
         self.conv_pos_embed = ConvPositionEmbedding(dim = out_dim)
 
-    def forward(self, x: float['b n d'], cond: float['b n d'], text_embed: float['b n d'], drop_audio_cond = False):
+    def forward(self, x: float['b n d'], cond: float['b n d'], text_embed: float['b n d'], drop_audio_cond = False, cond_embed: float['b n d'] | None = None):
+        if cond_embed is not None:  # cond & text part of proj precomputed with embed_cond()
+            x = F.linear(x, self.proj.weight[:, :self.mel_dim]) + cond_embed
+            x = self.conv_pos_embed(x) + x
+            return x
+
         if drop_audio_cond:  # cfg for cond audio
             cond = torch.zeros_like(cond)
 
         x = self.proj(torch.cat((x, cond, text_embed), dim = -1))
         x = self.conv_pos_embed(x) + x
         return x
+
+    def embed_cond(self, cond: float['b n d'], text_embed: float['b n d'], drop_audio_cond = False):
+        # step-invariant part of proj, i.e. masked cond audio & embedded text (bias included)
+        if drop_audio_cond:  # cfg for cond audio
+            cond = torch.zeros_like(cond)
+
+        return F.linear(torch.cat((cond, text_embed), dim = -1), self.proj.weight[:, self.mel_dim:], self.proj.bias)
     
 
 # Transformer backbone using DiT blocks
@@ -122,6 +135,34 @@ class DiT(nn.Module):
         self.norm_out = AdaLayerNormZero_Final(dim)  # final modulation
         self.proj_out = nn.Linear(dim, mel_dim)
 
+    def get_input_embed(self, x, cond, text, seq_len, drop_audio_cond = False, drop_text = False):
+        text_embed = self.text_embed(text, seq_len, drop_text = drop_text)
+        return self.input_embed(x, cond, text_embed, drop_audio_cond = drop_audio_cond)
+
+    def prepare_cond(
+        self,
+        cond: float['b n d'],  # masked cond audio
+        text: int['b nt'],     # text
+        drop_audio_cond = False,  # cfg for cond audio
+        drop_text = False,        # cfg for text
+    ) -> float['b n d']:
+        # step-invariant conditioning, i.e. text embed (with convnextv2 blocks) & its share of the input proj
+        # compute once per sampling, then pass to forward() as cond_embed at every ode step
+        seq_len = cond.shape[1]
+        text_embed = self.text_embed(text, seq_len, drop_text = drop_text)
+        return self.input_embed.embed_cond(cond, text_embed, drop_audio_cond = drop_audio_cond)
+
+    def prepare_time(self, time: float['s']) -> dict:
+        # time embed & modulations of all blocks for every scheduled time step, in one batched pass
+        # compute once per sampling, then pass to forward() as time_table, which picks the row of current step
+        t = self.time_embed(time)
+        return dict(
+            time = time,
+            t = t,
+            block_mods = torch.stack([block.attn_norm.modulation(t) for block in self.transformer_blocks], dim = 1),
+            out_mod = self.norm_out.modulation(t),
+        )
+
     def forward(
         self,
         x: float['b n d'],     # nosied input audio
@@ -131,28 +172,68 @@ class DiT(nn.Module):
         drop_audio_cond,  # cfg for cond audio
         drop_text,        # cfg for text
         mask: bool['b n'] | None = None,
+        cfg_infer = False,  # cfg inference, pack cond & null branches along batch, b -> 2b
+        cond_embed: float['b n d'] | None = None,  # from prepare_cond(), 2b stacked (cond, null) if cfg_infer
+        time_table: dict | None = None,  # from prepare_time(), needs scalar time
+        block_cache: dict | None = None,  # dict(shallow, refresh, residual), reuse deep blocks residual if not refresh
     ):
         batch, seq_len = x.shape[0], x.shape[1]
-        if time.ndim == 0:
-            time = repeat(time, ' -> b', b = batch)
-        
+
         # t: conditioning time, c: context (text + masked cond audio), x: noised input audio
-        t = self.time_embed(time)
-        text_embed = self.text_embed(text, seq_len, drop_text = drop_text)
-        x = self.input_embed(x, cond, text_embed, drop_audio_cond = drop_audio_cond)
+        if time_table is not None:
+            idx = (time_table['time'] - time).abs().argmin().view(1)  # nearest scheduled step, no host sync
+            t = time_table['t'].index_select(0, idx).expand(batch, -1)
+            block_mods, out_mod = time_table['block_mods'].index_select(0, idx), time_table['out_mod'].index_select(0, idx)
+        else:
+            if time.ndim == 0:
+                time = repeat(time, ' -> b', b = batch)
+            t = self.time_embed(time)
+            block_mods, out_mod = None, None
+
+        if cond_embed is not None:  # only noised input dependent work left
+            if cfg_infer:
+                x = torch.cat((x, x), dim = 0)
+                t = torch.cat((t, t), dim = 0)
+                mask = torch.cat((mask, mask), dim = 0) if mask is not None else None
+            x = self.input_embed(x, None, None, cond_embed = cond_embed)
+        elif cfg_infer:
+            x_cond = self.get_input_embed(x, cond, text, seq_len, drop_audio_cond = False, drop_text = False)
+            x_null = self.get_input_embed(x, cond, text, seq_len, drop_audio_cond = True, drop_text = True)
+            x = torch.cat((x_cond, x_null), dim = 0)
+            t = torch.cat((t, t), dim = 0)
+            mask = torch.cat((mask, mask), dim = 0) if mask is not None else None
+        else:
+            x = self.get_input_embed(x, cond, text, seq_len, drop_audio_cond = drop_audio_cond, drop_text = drop_text)
         
         rope = self.rotary_embed.forward_from_seq_len(seq_len)
 
         if self.long_skip_connection is not None:
             residual = x
 
-        for block in self.transformer_blocks:
-            x = block(x, t, mask = mask, rope = rope)
+        # block cache, deep blocks change little between adjacent ode steps, thus only shallow blocks are recomputed
+        # and the residual the deep ones added at last refresh is reused. refresh & residual kept by caller per branch
+        if block_cache is not None:
+            reuse = not block_cache['refresh'] and block_cache['residual'] is not None
+            depth = block_cache['shallow'] if reuse else self.depth
+            shallow = x
+        else:
+            depth = self.depth
+
+        for i, block in enumerate(self.transformer_blocks[:depth]):
+            x = block(x, t, mask = mask, rope = rope, mod = block_mods[:, i] if block_mods is not None else None)
+            if block_cache is not None and i + 1 == block_cache['shallow']:
+                shallow = x
+
+        if block_cache is not None:
+            if reuse:
+                x = x + block_cache['residual']
+            else:
+                block_cache['residual'] = x - shallow
 
         if self.long_skip_connection is not None:
             x = self.long_skip_connection(torch.cat((x, residual), dim = -1))
 
-        x = self.norm_out(x, t)
+        x = self.norm_out(x, t, mod = out_mod)
         output = self.proj_out(x)
 
         return output
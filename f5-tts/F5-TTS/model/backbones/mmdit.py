@@ -11,6 +11,7 @@ from __future__ import annotations
 
 import torch
 from torch import nn
+import torch.nn.functional as F
 
 from einops import repeat
 
@@ -57,16 +58,28 @@ class TextEmbedding(nn.Module):
 class AudioEmbedding(nn.Module):
     def __init__(self, in_dim, out_dim):
         super().__init__()
+        self.in_dim = in_dim
         self.linear = nn.Linear(2 * in_dim, out_dim)
         self.conv_pos_embed = ConvPositionEmbedding(out_dim)
 
-    def forward(self, x: float['b n d'], cond: float['b n d'], drop_audio_cond = False):
+    def forward(self, x: float['b n d'], cond: float['b n d'], drop_audio_cond = False, cond_embed: float['b n d'] | None = None):
+        if cond_embed is not None:  # cond part of linear precomputed with embed_cond()
+            x = F.linear(x, self.linear.weight[:, :self.in_dim]) + cond_embed
+            x = self.conv_pos_embed(x) + x
+            return x
+
         if drop_audio_cond:
             cond = torch.zeros_like(cond)
         x = torch.cat((x, cond), dim = -1)
         x = self.linear(x)
         x = self.conv_pos_embed(x) + x
         return x
+
+    def embed_cond(self, cond: float['b n d'], drop_audio_cond = False):
+        # step-invariant part of linear, i.e. masked cond audio (bias included)
+        if drop_audio_cond:
+            cond = torch.zeros_like(cond)
+        return F.linear(cond, self.linear.weight[:, self.in_dim:], self.linear.bias)
     
 
 # Transformer backbone using MM-DiT blocks
@@ -103,6 +116,31 @@ class MMDiT(nn.Module):
         self.norm_out = AdaLayerNormZero_Final(dim)  # final modulation
         self.proj_out = nn.Linear(dim, mel_dim)
 
+    def prepare_cond(
+        self,
+        cond: float['b n d'],  # masked cond audio
+        text: int['b nt'],     # text
+        drop_audio_cond = False,  # cfg for cond audio
+        drop_text = False,        # cfg for text
+    ) -> float['b nt+n d']:
+        # step-invariant conditioning, i.e. embedded text & the cond audio share of the audio embed linear
+        # packed along sequence, compute once per sampling, then pass to forward() as cond_embed at every ode step
+        c = self.text_embed(text, drop_text = drop_text)
+        audio_cond = self.audio_embed.embed_cond(cond, drop_audio_cond = drop_audio_cond)
+        return torch.cat((c, audio_cond), dim = 1)
+
+    def prepare_time(self, time: float['s']) -> dict:
+        # time embed & modulations of all blocks for every scheduled time step, in one batched pass
+        # compute once per sampling, then pass to forward() as time_table, which picks the row of current step
+        t = self.time_embed(time)
+        return dict(
+            time = time,
+            t = t,
+            x_mods = torch.stack([block.attn_norm_x.modulation(t) for block in self.transformer_blocks], dim = 1),
+            c_mods = [block.attn_norm_c.modulation(t) for block in self.transformer_blocks],  # last one is of final norm
+            out_mod = self.norm_out.modulation(t),
+        )
+
     def forward(
         self,
         x: float['b n d'],     # nosied input audio
@@ -112,25 +150,50 @@ class MMDiT(nn.Module):
         drop_audio_cond,  # cfg for cond audio
         drop_text,        # cfg for text
         mask: bool['b n'] | None = None,
+        cfg_infer = False,  # cfg inference, pack cond & null branches along batch, b -> 2b
+        cond_embed: float['b nt+n d'] | None = None,  # from prepare_cond(), 2b stacked (cond, null) if cfg_infer
+        time_table: dict | None = None,  # from prepare_time(), needs scalar time
     ):
         batch = x.shape[0]
-        if time.ndim == 0:
-            time = repeat(time, ' -> b', b = batch)
 
         # t: conditioning (time), c: context (text + masked cond audio), x: noised input audio
-        t = self.time_embed(time)
-        c = self.text_embed(text, drop_text = drop_text)
-        x = self.audio_embed(x, cond, drop_audio_cond = drop_audio_cond)
+        if time_table is not None:
+            idx = (time_table['time'] - time).abs().argmin().view(1)  # nearest scheduled step, no host sync
+            t = time_table['t'].index_select(0, idx).expand(batch, -1)
+            x_mods, out_mod = time_table['x_mods'].index_select(0, idx), time_table['out_mod'].index_select(0, idx)
+            c_mods = [mod.index_select(0, idx) for mod in time_table['c_mods']]
+        else:
+            if time.ndim == 0:
+                time = repeat(time, ' -> b', b = batch)
+            t = self.time_embed(time)
+            x_mods, c_mods, out_mod = None, None, None
+
+        if cond_embed is not None:  # only noised input dependent work left
+            if cfg_infer:
+                x = torch.cat((x, x), dim = 0)
+                t = torch.cat((t, t), dim = 0)
+                mask = torch.cat((mask, mask), dim = 0) if mask is not None else None
+            c, audio_cond = cond_embed[:, :text.shape[1]], cond_embed[:, text.shape[1]:]
+            x = self.audio_embed(x, None, cond_embed = audio_cond)
+        elif cfg_infer:
+            c = torch.cat((self.text_embed(text, drop_text = False), self.text_embed(text, drop_text = True)), dim = 0)
+            x = torch.cat((self.audio_embed(x, cond, drop_audio_cond = False), self.audio_embed(x, cond, drop_audio_cond = True)), dim = 0)
+            t = torch.cat((t, t), dim = 0)
+            mask = torch.cat((mask, mask), dim = 0) if mask is not None else None
+        else:
+            c = self.text_embed(text, drop_text = drop_text)
+            x = self.audio_embed(x, cond, drop_audio_cond = drop_audio_cond)
 
         seq_len = x.shape[1]
         text_len = text.shape[1]
         rope_audio = self.rotary_embed.forward_from_seq_len(seq_len)
         rope_text = self.rotary_embed.forward_from_seq_len(text_len)
         
-        for block in self.transformer_blocks:
-            c, x = block(x, c, t, mask = mask, rope = rope_audio, c_rope = rope_text)
+        for i, block in enumerate(self.transformer_blocks):
+            mod_x, mod_c = (x_mods[:, i], c_mods[i]) if x_mods is not None else (None, None)
+            c, x = block(x, c, t, mask = mask, rope = rope_audio, c_rope = rope_text, mod_x = mod_x, mod_c = mod_c)
 
-        x = self.norm_out(x, t)
+        x = self.norm_out(x, t, mod = out_mod)
         output = self.proj_out(x)
 
         return output
@@ -75,10 +75,16 @@ class TextEmbedding(nn.Module):
 class InputEmbedding(nn.Module):
     def __init__(self, mel_dim, text_dim, out_dim):
         super().__init__()
+        self.mel_dim = mel_dim
         self.proj = nn.Linear(mel_dim * 2 + text_dim, out_dim)
         self.conv_pos_embed = ConvPositionEmbedding(dim = out_dim)
 
-    def forward(self, x: float['b n d'], cond: float['b n d'], text_embed: float['b n d'], drop_audio_cond = False):
+    def forward(self, x: float['b n d'], cond: float['b n d'], text_embed: float['b n d'], drop_audio_cond = False, cond_embed: float['b n d'] | None = None):
+        if cond_embed is not None:  # cond & text part of proj precomputed with embed_cond()
+            x = F.linear(x, self.proj.weight[:, :self.mel_dim]) + cond_embed
+            x = self.conv_pos_embed(x) + x
+            return x
+
         if drop_audio_cond:  # cfg for cond audio
             cond = torch.zeros_like(cond)
 
@@ -86,6 +92,13 @@ class InputEmbedding(nn.Module):
         x = self.conv_pos_embed(x) + x
         return x
 
+    def embed_cond(self, cond: float['b n d'], text_embed: float['b n d'], drop_audio_cond = False):
+        # step-invariant part of proj, i.e. masked cond audio & embedded text (bias included)
+        if drop_audio_cond:  # cfg for cond audio
+            cond = torch.zeros_like(cond)
+
+        return F.linear(torch.cat((cond, text_embed), dim = -1), self.proj.weight[:, self.mel_dim:], self.proj.bias)
+
 
 # Flat UNet Transformer backbone
 
@@ -143,6 +156,31 @@ class UNetT(nn.Module):
         self.norm_out = RMSNorm(dim)
         self.proj_out = nn.Linear(dim, mel_dim)
 
+    def get_input_embed(self, x, cond, text, seq_len, drop_audio_cond = False, drop_text = False):
+        text_embed = self.text_embed(text, seq_len, drop_text = drop_text)
+        return self.input_embed(x, cond, text_embed, drop_audio_cond = drop_audio_cond)
+
+    def prepare_cond(
+        self,
+        cond: float['b n d'],  # masked cond audio
+        text: int['b nt'],     # text
+        drop_audio_cond = False,  # cfg for cond audio
+        drop_text = False,        # cfg for text
+    ) -> float['b n d']:
+        # step-invariant conditioning, i.e. text embed (with convnextv2 blocks) & its share of the input proj
+        # compute once per sampling, then pass to forward() as cond_embed at every ode step
+        seq_len = cond.shape[1]
+        text_embed = self.text_embed(text, seq_len, drop_text = drop_text)
+        return self.input_embed.embed_cond(cond, text_embed, drop_audio_cond = drop_audio_cond)
+
+    def prepare_time(self, time: float['s']) -> dict:
+        # time embed for every scheduled time step, in one batched pass
+        # compute once per sampling, then pass to forward() as time_table, which picks the row of current step
+        return dict(
+            time = time,
+            t = self.time_embed(time),
+        )
+
     def forward(
         self,
         x: float['b n d'],     # nosied input audio
@@ -152,15 +190,35 @@ class UNetT(nn.Module):
         drop_audio_cond,  # cfg for cond audio
         drop_text,        # cfg for text
         mask: bool['b n'] | None = None,
+        cfg_infer = False,  # cfg inference, pack cond & null branches along batch, b -> 2b
+        cond_embed: float['b n d'] | None = None,  # from prepare_cond(), 2b stacked (cond, null) if cfg_infer
+        time_table: dict | None = None,  # from prepare_time(), needs scalar time
     ):
         batch, seq_len = x.shape[0], x.shape[1]
-        if time.ndim == 0:
-            time = repeat(time, ' -> b', b = batch)
-        
+
         # t: conditioning time, c: context (text + masked cond audio), x: noised input audio
-        t = self.time_embed(time)
-        text_embed = self.text_embed(text, seq_len, drop_text = drop_text)
-        x = self.input_embed(x, cond, text_embed, drop_audio_cond = drop_audio_cond)
+        if time_table is not None:
+            idx = (time_table['time'] - time).abs().argmin().view(1)  # nearest scheduled step, no host sync
+            t = time_table['t'].index_select(0, idx).expand(batch, -1)
+        else:
+            if time.ndim == 0:
+                time = repeat(time, ' -> b', b = batch)
+            t = self.time_embed(time)
+
+        if cond_embed is not None:  # only noised input dependent work left
+            if cfg_infer:
+                x = torch.cat((x, x), dim = 0)
+                t = torch.cat((t, t), dim = 0)
+                mask = torch.cat((mask, mask), dim = 0) if mask is not None else None
+            x = self.input_embed(x, None, None, cond_embed = cond_embed)
+        elif cfg_infer:
+            x_cond = self.get_input_embed(x, cond, text, seq_len, drop_audio_cond = False, drop_text = False)
+            x_null = self.get_input_embed(x, cond, text, seq_len, drop_audio_cond = True, drop_text = True)
+            x = torch.cat((x_cond, x_null), dim = 0)
+            t = torch.cat((t, t), dim = 0)
+            mask = torch.cat((mask, mask), dim = 0) if mask is not None else None
+        else:
+            x = self.get_input_embed(x, cond, text, seq_len, drop_audio_cond = drop_audio_cond, drop_text = drop_text)
 
         # postfix time t to input x, [b n d] -> [b n+1 d]
         x, ps = pack((t, x), 'b * d')
@@ -21,14 +21,59 @@ from torchdiffeq import odeint
 from einops import rearrange
 
 from model.modules import MelSpec
+from model.backbones.dit import DiT
 
 from model.utils import (
     default, exists, 
-    list_str_to_idx, list_str_to_tensor, 
+    VocabTokenizer, 
     lens_to_mask, mask_from_frac_lengths,
 ) 
 
 
+# fixed grid ode solver only holding the current state, no per step bookkeeping as torchdiffeq
+
+def odeint_fixed(
+    fn: Callable[[float[''], float['b n d']], float['b n d']],
+    y0: float['b n d'],
+    t: float['s'],
+    method = 'euler',
+    keep_every = 0,
+) -> tuple[float['b n d'], float['k b n d'] | None]:
+    '''
+    method      - "euler" | "midpoint", same steps as torchdiffeq fixed grid solvers
+    keep_every  - 0 to keep no trajectory, otherwise keep every k-th state along t (final state always included)
+    '''
+    if method not in ('euler', 'midpoint'):
+        raise ValueError(f"odeint_fixed supports only 'euler' and 'midpoint', but received {method}")
+
+    y = y0
+    snapshots = [y0] if keep_every > 0 else None
+
+    for i in range(len(t) - 1):
+        t0, dt = t[i], t[i + 1] - t[i]
+        if method == 'euler':
+            y = y + dt * fn(t0, y)
+        else:
+            half_dt = 0.5 * dt
+            y_mid = y + fn(t0, y) * half_dt
+            y = y + dt * fn(t0 + half_dt, y_mid)
+
+        if keep_every > 0 and ((i + 1) % keep_every == 0 or i + 1 == len(t) - 1):
+            snapshots.append(y)
+
+    trajectory = torch.stack(snapshots) if keep_every > 0 else None
+    return y, trajectory
+
+
+# frames CFM.sample generates for a requested duration, one past the reference / text lengths at least, so something is generated
+# lens = max(cond frames, text tokens), ints or long tensors [b]
+
+def sample_duration(duration, lens, max_duration = 4096):
+    if torch.is_tensor(duration) or torch.is_tensor(lens):
+        return torch.maximum(lens + 1, duration).clamp(max = max_duration)
+    return min(max(lens + 1, duration), max_duration)
+
+
 class CFM(nn.Module):
     def __init__(
         self,
@@ -73,6 +118,7 @@ class CFM(nn.Module):
 
         # vocab map for tokenization
         self.vocab_char_map = vocab_char_map
+        self.tokenizer = VocabTokenizer(vocab_char_map)  # utf-8 bytes if no vocab map
 
     @property
     def device(self):
@@ -96,9 +142,30 @@ class CFM(nn.Module):
         duplicate_test = False,
         t_inter = 0.1,
         edit_mask = None,
+        batched_cfg = False,
+        lean_ode = False,
+        keep_every = 0,
+        cfg_interval: tuple[float, float] | None = None,
+        cfg_every = 1,
+        block_cache_shallow = 0,
+        block_cache_refresh = 4,
+        block_cache_start = 0.,
     ):
+        '''
+        lean_ode        - integrate with odeint_fixed() holding only the current state instead of torchdiffeq,
+                          for "euler" | "midpoint" methods. trajectory then is None, or every keep_every-th state
+        cfg_interval    - (t_min, t_max), run the null branch only for flow evaluations at t within, else reuse last guidance delta
+        cfg_every       - run the null branch only on every k-th flow evaluation, else reuse last guidance delta
+        block_cache_shallow - DiT only, if > 0 recompute only this many shallow blocks and reuse the deep blocks residual
+                              of last full pass, 0 to disable
+        block_cache_refresh - full pass of all blocks every k-th flow evaluation of a branch
+        block_cache_start   - always full pass for flow evaluations at t below
+        '''
         self.eval()
 
+        if block_cache_shallow > 0 and not isinstance(self.transformer, DiT):
+            raise ValueError(f"block_cache_shallow is only supported with DiT, but transformer is {type(self.transformer).__name__}")
+
         # raw wave
 
         if cond.ndim == 2:
@@ -113,10 +180,7 @@ class CFM(nn.Module):
         # text
 
         if isinstance(text, list):
-            if exists(self.vocab_char_map):
-                text = list_str_to_idx(text, self.vocab_char_map).to(device)
-            else:
-                text = list_str_to_tensor(text).to(device)
+            text = self.tokenizer(text).to(device)
             assert text.shape[0] == batch
 
         if exists(text):
@@ -132,8 +196,7 @@ class CFM(nn.Module):
         if isinstance(duration, int):
             duration = torch.full((batch,), duration, device = device, dtype = torch.long)
 
-        duration = torch.maximum(lens + 1, duration) # just add one token so something is generated
-        duration = duration.clamp(max = max_duration)
+        duration = sample_duration(duration, lens, max_duration = max_duration)  # just add one token so something is generated
         max_duration = duration.amax()
         
         # duplicate test corner for inner time step oberservation
@@ -156,17 +219,54 @@ class CFM(nn.Module):
 
         # neural ode
 
-        def fn(t, x):
-            # at each step, conditioning is fixed
-            # step_cond = torch.where(cond_mask, cond, torch.zeros_like(cond))
+        # at each step, conditioning is fixed, thus embed text & masked cond audio once for all steps
+        cond_embed = self.transformer.prepare_cond(step_cond, text, drop_audio_cond = False, drop_text = False)
+        if cfg_strength >= 1e-5:
+            null_embed = self.transformer.prepare_cond(step_cond, text, drop_audio_cond = True, drop_text = True)
+            if batched_cfg:
+                cfg_embed = torch.cat((cond_embed, null_embed), dim = 0)
+
+        # guidance interval, the guidance delta (pred - null_pred) * cfg_strength drifts slowly along t,
+        # thus outside the interval (or between every k-th evaluation) only cond branch runs and last delta is reused
+        cfg_state = dict(calls = 0, delta = None)
+
+        def full_cfg(t):
+            call = cfg_state['calls']
+            cfg_state['calls'] += 1
+            if cfg_state['delta'] is None:  # nothing to reuse yet
+                return True
+            if exists(cfg_interval) and not (cfg_interval[0] <= float(t) <= cfg_interval[1]):
+                return False
+            return call % cfg_every == 0
+
+        # block cache, one per transformer call kind as residuals are of its batch (cond, null, or both stacked)
+        block_caches = dict()
+
+        def block_cache(branch, t):
+            if block_cache_shallow <= 0:
+                return dict()
+            cache = block_caches.setdefault(branch, dict(shallow = block_cache_shallow, calls = 0, residual = None))
+            cache['refresh'] = cache['calls'] % block_cache_refresh == 0 or float(t) < block_cache_start
+            cache['calls'] += 1
+            return dict(block_cache = cache)
 
+        def fn(t, x):
             # predict flow
-            pred = self.transformer(x = x, cond = step_cond, text = text, time = t, mask = mask, drop_audio_cond = False, drop_text = False)
+            if cfg_strength >= 1e-5 and full_cfg(t):
+                if batched_cfg:
+                    # cond & null branches stacked along batch and run in a single transformer forward
+                    pred_cfg = self.transformer(x = x, cond = step_cond, text = text, time = t, mask = mask, drop_audio_cond = False, drop_text = False, cfg_infer = True, cond_embed = cfg_embed, time_table = time_table, **block_cache('cfg', t))
+                    pred, null_pred = torch.chunk(pred_cfg, 2, dim = 0)
+                else:
+                    pred = self.transformer(x = x, cond = step_cond, text = text, time = t, mask = mask, drop_audio_cond = False, drop_text = False, cond_embed = cond_embed, time_table = time_table, **block_cache('cond', t))
+                    null_pred = self.transformer(x = x, cond = step_cond, text = text, time = t, mask = mask, drop_audio_cond = True, drop_text = True, cond_embed = null_embed, time_table = time_table, **block_cache('null', t))
+                cfg_state['delta'] = (pred - null_pred) * cfg_strength
+                return pred + cfg_state['delta']
+
+            pred = self.transformer(x = x, cond = step_cond, text = text, time = t, mask = mask, drop_audio_cond = False, drop_text = False, cond_embed = cond_embed, time_table = time_table, **block_cache('cond', t))
             if cfg_strength < 1e-5:
                 return pred
-            
-            null_pred = self.transformer(x = x, cond = step_cond, text = text, time = t, mask = mask, drop_audio_cond = True, drop_text = True)
-            return pred + (pred - null_pred) * cfg_strength
+            return pred + cfg_state['delta']
 
         # noise input
         # to make sure batch inference result is same with different batch size, and for sure single inference
@@ -190,9 +290,21 @@ class CFM(nn.Module):
         if sway_sampling_coef is not None:
             t = t + sway_sampling_coef * (torch.cos(torch.pi / 2 * t) - 1 + t)
 
-        trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
-        
-        sampled = trajectory[-1]
+        # time embed & modulations only depend on t, thus precompute for all steps a fixed grid solver evaluates
+        # (only on the grid t itself, torchdiffeq options e.g. step_size or grid_constructor evaluate other times)
+        time_table = None
+        if self.odeint_kwargs.get('method') in ('euler', 'midpoint') and (lean_ode or not self.odeint_kwargs.get('options')):
+            t_eval = t[:-1]
+            if self.odeint_kwargs['method'] == 'midpoint':
+                t_eval = torch.cat((t_eval, t[:-1] + 0.5 * (t[1:] - t[:-1])))
+            time_table = self.transformer.prepare_time(t_eval)
+
+        if lean_ode:
+            sampled, trajectory = odeint_fixed(fn, y0, t, method = self.odeint_kwargs.get('method'), keep_every = keep_every)
+        else:
+            trajectory = odeint(fn, y0, t, **self.odeint_kwargs)
+            sampled = trajectory[-1]
+
         out = sampled
         out = torch.where(cond_mask, cond, out)
 
@@ -208,6 +320,7 @@ class CFM(nn.Module):
         text: int['b nt'] | list[str],
         *,
         lens: int['b'] | None = None,
+        mask: bool['b n'] | None = None,
         noise_scheduler: str | None = None,
     ):
         # handle raw wave
@@ -220,17 +333,17 @@ class CFM(nn.Module):
 
         # handle text as string
         if isinstance(text, list):
-            if exists(self.vocab_char_map):
-                text = list_str_to_idx(text, self.vocab_char_map).to(device)
-            else:
-                text = list_str_to_tensor(text).to(device)
+            text = self.tokenizer(text).to(device)
             assert text.shape[0] == batch
 
-        # lens and mask
-        if not exists(lens):
-            lens = torch.full((batch,), seq_len, device = device)
-        
-        mask = lens_to_mask(lens, length = seq_len)  # useless here, as collate_fn will pad to max length in batch
+        # lens and mask, a padding mask from collate_fn also masks the padding out of attention
+        attn_mask = mask
+        if exists(mask):
+            lens = default(lens, mask.sum(dim = -1))
+        else:
+            if not exists(lens):
+                lens = torch.full((batch,), seq_len, device = device)
+            mask = lens_to_mask(lens, length = seq_len)
 
         # get a random span to mask out for training conditionally
         frac_lengths = torch.zeros((batch,), device = self.device).float().uniform_(*self.frac_lengths_mask)
@@ -268,9 +381,9 @@ class CFM(nn.Module):
         else:
             drop_text = False
             
-        # if want rigourously mask out padding, record in collate_fn in dataset.py, and pass in here
+        # padding rigourously masked out only if mask passed in, from collate_fn in dataset.py
         # adding mask will use more memory, thus also need to adjust batchsampler with scaled down threshold for long sequences
-        pred = self.transformer(x = φ, cond = cond, text = text, time = time, drop_audio_cond = drop_audio_cond, drop_text = drop_text)
+        pred = self.transformer(x = φ, cond = cond, text = text, time = time, drop_audio_cond = drop_audio_cond, drop_text = drop_text, mask = attn_mask)
 
         # flow matching loss
         loss = F.mse_loss(pred, flow, reduction = 'none')
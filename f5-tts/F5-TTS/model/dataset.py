@@ -1,17 +1,44 @@
+import io
+import os
 import json
 import random
 from tqdm import tqdm
 
+import numpy as np
 import torch
-import torch.nn.functional as F
-from torch.utils.data import Dataset, Sampler
+from torch.utils.data import Dataset, Sampler, SequentialSampler
 import torchaudio
+import soundfile as sf
 from datasets import load_dataset, load_from_disk
-from datasets import Dataset as Dataset_
+from datasets import Audio, Dataset as Dataset_
 
 from einops import rearrange
 
-from model.modules import MelSpec
+from model.modules import MelSpec, resample
+from model.utils import str_to_idx
+
+
+def audio_header_durations(batch):
+    # seconds of each undecoded audio, from the file header, no audio bytes decoded
+    durations = []
+    for audio in batch["audio"]:
+        info = sf.info(io.BytesIO(audio["bytes"]) if audio["bytes"] is not None else audio["path"])
+        durations.append(info.frames / info.samplerate)
+    return dict(duration = durations)
+
+
+def get_hf_durations(hf_dataset, num_proc = None):
+    '''
+    duration in seconds of each row of a huggingface audio dataset
+    an arrow backed dataset is indexed once with a parallel map over the audio headers, which datasets caches next to the
+    dataset files by fingerprint, so later runs load it without touching audio; anything else, e.g. a list of decoded rows, is read as is
+    '''
+    if isinstance(hf_dataset, Dataset_) and isinstance(hf_dataset.features.get("audio"), Audio):
+        undecoded = hf_dataset.cast_column("audio", Audio(decode = False))
+        durations = undecoded.map(audio_header_durations, batched = True, num_proc = num_proc, remove_columns = undecoded.column_names,
+                                  desc = "Indexing audio durations")
+        return np.asarray(durations["duration"], dtype = np.float64)
+    return np.asarray([row['audio']['array'].shape[-1] / row['audio']['sampling_rate'] for row in hf_dataset], dtype = np.float64)
 
 
 class HFDataset(Dataset):
@@ -21,38 +48,38 @@ class HFDataset(Dataset):
         target_sample_rate = 24_000,
         n_mel_channels = 100,
         hop_length = 256,
+        num_proc = None,
     ):
         self.data = hf_dataset
         self.target_sample_rate = target_sample_rate
         self.hop_length = hop_length
         self.mel_spectrogram = MelSpec(target_sample_rate=target_sample_rate, n_mel_channels=n_mel_channels, hop_length=hop_length)
-        
+
+        # rows out of 0.3-30s filtered from the index once, never decoded
+        self.durations = get_hf_durations(hf_dataset, num_proc = num_proc)
+        self.indices = np.flatnonzero((self.durations >= 0.3) & (self.durations <= 30))
+
     def get_frame_len(self, index):
-        row = self.data[index]
-        audio = row['audio']['array']
-        sample_rate = row['audio']['sampling_rate']
-        return audio.shape[-1] / sample_rate * self.target_sample_rate / self.hop_length
+        return self.durations[self.indices[index]] * self.target_sample_rate / self.hop_length
+
+    def get_frame_lens(self):
+        # all frame lengths at once, for DynamicBatchSampler
+        return self.durations[self.indices] * self.target_sample_rate / self.hop_length
 
     def __len__(self):
-        return len(self.data)
+        return len(self.indices)
     
     def __getitem__(self, index):
-        row = self.data[index]
+        row = self.data[int(self.indices[index])]
         audio = row['audio']['array']
 
         # logger.info(f"Audio shape: {audio.shape}")
 
         sample_rate = row['audio']['sampling_rate']
-        duration = audio.shape[-1] / sample_rate
-
-        if duration > 30 or duration < 0.3:
-            return self.__getitem__((index + 1) % len(self.data))
         
         audio_tensor = torch.from_numpy(audio).float()
         
-        if sample_rate != self.target_sample_rate:
-            resampler = torchaudio.transforms.Resample(sample_rate, self.target_sample_rate)
-            audio_tensor = resampler(audio_tensor)
+        audio_tensor = resample(audio_tensor, sample_rate, self.target_sample_rate)
         
         audio_tensor = rearrange(audio_tensor, 't -> 1 t')
         
@@ -68,53 +95,173 @@ class HFDataset(Dataset):
         )
 
 
+# precomputed mel features, written by scripts/prepare_mel.py
+
+class MelStore:
+    '''
+    mel.bin         - float16 mel [d n] of each row of raw.arrow, back to back
+    mel_offsets.npy - int64 [num_rows + 1], row i spans frames offsets[i] to offsets[i+1], 0 frames if filtered out
+    mel_info.json   - n_mel_channels, hop_length, target_sample_rate the features were computed with
+    rows are zero-copy views of the memory map, shared by all dataloader workers through the page cache
+    '''
+    def __init__(self, path):
+        with open(f"{path}/mel_info.json", 'r', encoding='utf-8') as f:
+            self.info = json.load(f)
+        self.n_mel_channels = self.info["n_mel_channels"]
+        self.offsets = np.load(f"{path}/mel_offsets.npy")
+        self.mels = np.memmap(f"{path}/mel.bin", dtype = np.float16, mode = "c")  # copy on write, so torch views are writable
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def frame_len(self, index):
+        return int(self.offsets[index + 1] - self.offsets[index])
+
+    def __getitem__(self, index):
+        start, end = self.offsets[index] * self.n_mel_channels, self.offsets[index + 1] * self.n_mel_channels
+        return torch.from_numpy(self.mels[start:end]).view(self.n_mel_channels, -1)
+
+
+# duration index, written by the prepare scripts or scripts/convert_duration_index.py
+
+def save_duration_index(path, durations, text_lengths = None):
+    '''
+    duration.npy    - float64 [num_rows] seconds of each row of raw.arrow
+    text_length.npy - int32 [num_rows] len(text) of each row, optional
+    '''
+    arrays = dict(duration = np.asarray(durations, dtype = np.float64))
+    if text_lengths is not None:
+        arrays["text_length"] = np.asarray(text_lengths, dtype = np.int32)
+    for name, array in arrays.items():
+        with open(f"{path}/{name}.npy.tmp", "wb") as f:
+            np.save(f, array)
+        os.replace(f"{path}/{name}.npy.tmp", f"{path}/{name}.npy")
+
+
+def load_duration_index(path):
+    # memory-mapped, read zero-copy & shared by dataloader workers; parsed from duration.json if not converted yet
+    if os.path.exists(f"{path}/duration.npy"):
+        durations = np.load(f"{path}/duration.npy", mmap_mode = "r")
+        text_lengths = np.load(f"{path}/text_length.npy", mmap_mode = "r") if os.path.exists(f"{path}/text_length.npy") else None
+        return durations, text_lengths
+    with open(f"{path}/duration.json", 'r', encoding='utf-8') as f:
+        data_dict = json.load(f)
+    return data_dict["duration"], None
+
+
+# pre-tokenized text, token_ids & token_len columns of raw.arrow, written by the prepare scripts or scripts/convert_token_ids.py,
+# with token_vocab.txt the ids map to
+
+def token_id_dtype(vocab_size):
+    return np.int16 if vocab_size <= np.iinfo(np.int16).max + 1 else np.int32
+
+
+def text_to_token_ids(text, vocab_char_map):
+    # compact ids of a text (str or list of pinyin / chars) for the token_ids column, 0 for unknown as list_str_to_idx
+    return np.fromiter((vocab_char_map.get(c, 0) for c in text), dtype = token_id_dtype(len(vocab_char_map)), count = len(text))
+
+
+def save_token_vocab(path, vocab_char_map):
+    with open(f"{path}/token_vocab.txt", "w", encoding="utf-8") as f:
+        for char in sorted(vocab_char_map, key = vocab_char_map.get):
+            f.write(char + "\n")
+
+
+def load_token_vocab(path):
+    if not os.path.exists(f"{path}/token_vocab.txt"):
+        return None
+    with open(f"{path}/token_vocab.txt", "r", encoding="utf-8") as f:
+        return {char[:-1]: i for i, char in enumerate(f)}
+
+
 class CustomDataset(Dataset):
     def __init__(
         self,
         custom_dataset: Dataset,
         durations = None,
+        text_lengths = None,
         target_sample_rate = 24_000,
         hop_length = 256,
         n_mel_channels = 100,
         preprocessed_mel = False,
+        mel_store: MelStore | None = None,
+        tokenize = False,
+        vocab_char_map: dict[str, int] | None = None,
+        pretokenized = False,
     ):
+        '''
+        tokenize        - emit text as int token ids (vocab_char_map indices, utf-8 bytes if None), tokenized in the dataloader workers
+                          and padded by collate_fn, so CFM.forward takes them as is instead of mapping strings each step
+        pretokenized    - with tokenize, read the ids from the token_ids column, computed with the same vocab_char_map,
+                          as zero-copy numpy views of the arrow buffers, text never materialized as python lists
+        '''
         self.data = custom_dataset
         self.durations = durations
+        self.text_lengths = text_lengths
         self.target_sample_rate = target_sample_rate
         self.hop_length = hop_length
-        self.preprocessed_mel = preprocessed_mel
-        if not preprocessed_mel:
+        self.mel_store = mel_store
+        self.tokenize = tokenize
+        self.vocab_char_map = vocab_char_map
+        self.token_ids = None
+        self.rows = custom_dataset
+        if tokenize and pretokenized:
+            self.token_ids = custom_dataset.data.column("token_ids")
+            self.rows = custom_dataset.remove_columns(["text", "token_ids"])  # same arrow table, other columns only
+        self.preprocessed_mel = preprocessed_mel or mel_store is not None
+        if mel_store is not None:
+            assert len(mel_store) == len(custom_dataset), f"mel store has {len(mel_store)} rows, dataset {len(custom_dataset)}"
+            for key, value in dict(target_sample_rate = target_sample_rate, hop_length = hop_length, n_mel_channels = n_mel_channels).items():
+                assert mel_store.info[key] == value, f"mel store computed with {key} {mel_store.info[key]}, but received {value}"
+        if not self.preprocessed_mel:
             self.mel_spectrogram = MelSpec(target_sample_rate=target_sample_rate, hop_length=hop_length, n_mel_channels=n_mel_channels)
 
+        # rows out of 0.3-30s filtered from the index once, never opened; dataset indices are positions in self.indices
+        all_durations = np.asarray(durations if durations is not None else custom_dataset["duration"], dtype = np.float64)
+        self.indices = np.flatnonzero((all_durations >= 0.3) & (all_durations <= 30))
+
     def get_frame_len(self, index):
         if self.durations is not None:  # Please make sure the separately provided durations are correct, otherwise 99.99% OOM
-            return self.durations[index] * self.target_sample_rate / self.hop_length
-        return self.data[index]["duration"] * self.target_sample_rate / self.hop_length
+            return self.durations[self.indices[index]] * self.target_sample_rate / self.hop_length
+        return self.data[int(self.indices[index])]["duration"] * self.target_sample_rate / self.hop_length
     
+    def get_text_len(self, index):
+        if self.text_lengths is not None:
+            return int(self.text_lengths[self.indices[index]])
+        return len(self.data[int(self.indices[index])]["text"])
+
+    def get_frame_lens(self):
+        # all frame lengths at once, for DynamicBatchSampler
+        durations = self.durations if self.durations is not None else self.data["duration"]
+        return np.asarray(durations, dtype = np.float64)[self.indices] * self.target_sample_rate / self.hop_length
+
     def __len__(self):
-        return len(self.data)
+        return len(self.indices)
     
     def __getitem__(self, index):
-        row = self.data[index]
+        index = int(self.indices[index])
+        row = self.rows[index]
         audio_path = row["audio_path"]
-        text = row["text"]
-        duration = row["duration"]
 
-        if self.preprocessed_mel:
+        if self.mel_store is not None:
+            mel_spec = self.mel_store[index]
+
+        elif self.preprocessed_mel:
             mel_spec = torch.tensor(row["mel_spec"])
 
         else:
             audio, source_sample_rate = torchaudio.load(audio_path)
-
-            if duration > 30 or duration < 0.3:
-                return self.__getitem__((index + 1) % len(self.data))
-            
-            if source_sample_rate != self.target_sample_rate:
-                resampler = torchaudio.transforms.Resample(source_sample_rate, self.target_sample_rate)
-                audio = resampler(audio)
+            audio = resample(audio, source_sample_rate, self.target_sample_rate)
             
             mel_spec = self.mel_spectrogram(audio)
             mel_spec = rearrange(mel_spec, '1 d t -> d t')
+
+        if self.token_ids is not None:
+            text = self.token_ids[index].values.to_numpy(zero_copy_only = True)
+        elif self.tokenize:
+            text = str_to_idx(row["text"], self.vocab_char_map)
+        else:
+            text = row["text"]
         
         return dict(
             mel_spec = mel_spec,
@@ -130,51 +277,111 @@ class DynamicBatchSampler(Sampler[list[int]]):
             in a batch to ensure that the total number of frames are less
             than a certain threshold.
         2.  Make sure the padding efficiency in the batch is high.
+        3.  Reshuffle the order of batches each epoch, from random_seed + epoch, see set_epoch().
+        4.  With num_replicas > 1 and balance_ranks, order batches as per-step rank sets (batches i*n ... i*n+n-1,
+            dealt round-robin to the n ranks by accelerate) of near-equal padded frames, i.e. samples x max frame len,
+            so ranks do not wait on a straggler at each all-reduce. step_imbalance() gives the resulting per-step wait.
+        Frame lengths are taken as one array, frame_lens or data_source.get_frame_lens() if not given,
+        and batches formed with a stable argsort & cumulative sums, same batches as the per index greedy loop.
     """
 
-    def __init__(self, sampler: Sampler[int], frames_threshold: int, max_samples=0, random_seed=None, drop_last: bool = False):
+    def __init__(self, sampler: Sampler[int], frames_threshold: int, max_samples=0, random_seed=None, drop_last: bool = False, frame_lens=None,
+                 num_replicas: int = 1, balance_ranks: bool = False):
         self.sampler = sampler
         self.frames_threshold = frames_threshold
         self.max_samples = max_samples
+        self.random_seed = random_seed
+        self.num_replicas = num_replicas
+        self.balance_ranks = balance_ranks
+        self.epoch = 0
+        self._order = None
+
+        if isinstance(sampler, SequentialSampler):
+            indices = np.arange(len(sampler), dtype = np.int64)
+        else:
+            indices = np.fromiter(iter(sampler), dtype = np.int64)
 
-        indices, batches = [], []
-        data_source = self.sampler.data_source
-        
-        for idx in tqdm(self.sampler, desc=f"Sorting with sampler... if slow, check whether dataset is provided with duration"):
-            indices.append((idx, data_source.get_frame_len(idx)))
-        indices.sort(key=lambda elem : elem[1])
-
-        batch = []
-        batch_frames = 0
-        for idx, frame_len in tqdm(indices, desc=f"Creating dynamic batches with {frames_threshold} audio frames per gpu"):
-            if batch_frames + frame_len <= self.frames_threshold and (max_samples == 0 or len(batch) < max_samples):
-                batch.append(idx)
-                batch_frames += frame_len
+        if frame_lens is None:
+            data_source = self.sampler.data_source
+            if hasattr(data_source, "get_frame_lens"):
+                frame_lens = data_source.get_frame_lens()
             else:
-                if len(batch) > 0:
-                    batches.append(batch)
-                if frame_len <= self.frames_threshold:
-                    batch = [idx]
-                    batch_frames = frame_len
-                else:
-                    batch = []
-                    batch_frames = 0
-
-        if not drop_last and len(batch) > 0:
-            batches.append(batch)
-
-        del indices
-
-        # if want to have different batches between epochs, may just set a seed and log it in ckpt
-        # cuz during multi-gpu training, although the batch on per gpu not change between epochs, the formed general minibatch is different
-        # e.g. for epoch n, use (random_seed + n)
-        random.seed(random_seed)
-        random.shuffle(batches)
+                frame_lens = np.fromiter((data_source.get_frame_len(idx) for idx in tqdm(range(len(data_source)), 
+                    desc=f"Sorting with sampler... if slow, check whether dataset is provided with duration")), dtype = np.float64)
+        frame_lens = np.asarray(frame_lens, dtype = np.float64)[indices]
+
+        # stable, so equal lengths keep sampler order; longer than threshold dropped, they only come last
+        order = np.argsort(frame_lens, kind = "stable")
+        num_valid = int(np.searchsorted(frame_lens[order], frames_threshold, side = "right"))
+        indices, frame_lens = indices[order[:num_valid]], frame_lens[order[:num_valid]]
+
+        # greedy cut: each batch is the longest run from its start with frames within threshold (and max_samples)
+        # the end is located on the global cumsum, then decided on the batch local running sum,
+        # which adds up in the same order as a per item loop, so batches are the same up to the last float bit
+        cum_frames = np.cumsum(frame_lens)
+        batches, padded_frames = [], []
+        start, num = 0, len(frame_lens)
+        while start < num:
+            before = cum_frames[start - 1] if start > 0 else 0.
+            end = min(int(cum_frames.searchsorted(before + frames_threshold, side = "right")) + 2, num)
+            if max_samples > 0:
+                end = min(end, start + max_samples)
+            while True:
+                running = np.add.accumulate(frame_lens[start:end])
+                size = int(running.searchsorted(frames_threshold, side = "right"))
+                if size < end - start or end == num or (max_samples > 0 and end - start == max_samples):
+                    break
+                end = min(end + (end - start), num)  # estimate fell short by rounding, widen
+            size = max(size, 1)
+            batches.append(indices[start:start + size])
+            padded_frames.append(size * frame_lens[start + size - 1])  # sorted, last is the longest
+            start += size
+
+        # an over threshold sample closes the last batch, so it is only dropped if none were
+        if drop_last and len(batches) > 0 and num_valid == len(order):
+            batches.pop()
+            padded_frames.pop()
 
         self.batches = batches
+        self.padded_frames = np.asarray(padded_frames, dtype = np.float64)
+
+    def set_epoch(self, epoch: int):
+        # batch order of the epoch drawn from random_seed + epoch, epoch 0 as the former single random.seed(random_seed) shuffle
+        self.epoch = epoch
+
+    def epoch_order(self):
+        # batches themselves fixed, only their order changes between epochs; with a seed, same order on every rank & on resume
+        if self._order is None or self._order[0] != self.epoch:
+            self._order = (self.epoch, self._shuffle(random.Random(self.random_seed + self.epoch if self.random_seed is not None else None)))
+        return self._order[1]
+
+    def _shuffle(self, rng):
+        if not self.balance_ranks or self.num_replicas <= 1:
+            order = list(range(len(self.batches)))
+            rng.shuffle(order)
+            return order
+
+        # neighbours in padded frames form a step, the leftover cheapest batches the last partial step
+        by_cost = np.argsort(self.padded_frames, kind = "stable")
+        num_left = len(by_cost) % self.num_replicas
+        steps = by_cost[num_left:].reshape(-1, self.num_replicas).tolist()
+        rng.shuffle(steps)
+        for step in steps:
+            rng.shuffle(step)  # no rank always gets the heaviest batch of a step
+        return [i for step in steps for i in step] + by_cost[:num_left].tolist()
+
+    def step_imbalance(self, order=None):
+        # per step, fraction of the straggler's padded frames the other ranks spend waiting: 1 - mean / max
+        # ranks without a batch in a last partial step count as waiting the whole step
+        order = self.epoch_order() if order is None else order
+        num_steps = -(-len(order) // self.num_replicas)
+        costs = np.zeros(num_steps * self.num_replicas)
+        costs[:len(order)] = self.padded_frames[order]
+        costs = costs.reshape(num_steps, self.num_replicas)
+        return 1 - costs.mean(axis = 1) / costs.max(axis = 1)
 
     def __iter__(self):
-        return iter(self.batches)
+        return (self.batches[i].tolist() for i in self.epoch_order())
 
     def __len__(self):
         return len(self.batches)
@@ -187,71 +394,95 @@ def load_dataset(
         tokenizer: str = "pinyin",
         dataset_type: str = "CustomDataset", 
         audio_type: str = "raw", 
-        mel_spec_kwargs: dict = dict()
+        mel_spec_kwargs: dict = dict(),
+        tokenize: bool = False,
+        vocab_char_map: dict[str, int] | None = None,
         ) -> CustomDataset | HFDataset:
     '''
     dataset_type    - "CustomDataset" if you want to use tokenizer name and default data path to load for train_dataset
                     - "CustomDatasetPath" if you just want to pass the full path to a preprocessed dataset without relying on tokenizer
+    audio_type      - "raw" to decode, resample & compute mel per sample
+                    - "mel" for precomputed mel, the memory-mapped store of scripts/prepare_mel.py if present, else mel.arrow
+    tokenize        - CustomDataset emits text as token ids of vocab_char_map (utf-8 bytes if None), tokenized in dataloader workers,
+                      or read from the token_ids column if its token_vocab.txt is vocab_char_map
     '''
     
     print("Loading dataset ...")
 
     if dataset_type == "CustomDataset":
+        rel_data_path = f"data/{dataset_name}_{tokenizer}"
+    elif dataset_type == "CustomDatasetPath":
+        rel_data_path = dataset_name
+
+    if dataset_type in ["CustomDataset", "CustomDatasetPath"]:
+        mel_store = None
+        if audio_type == "mel" and os.path.exists(f"{rel_data_path}/mel_offsets.npy"):
+            mel_store = MelStore(rel_data_path)  # text & duration from raw.arrow, mel from the store
+            audio_type = "raw"
         if audio_type == "raw":
             try:
-                train_dataset = load_from_disk(f"data/{dataset_name}_{tokenizer}/raw")
+                train_dataset = load_from_disk(f"{rel_data_path}/raw")
             except:
-                train_dataset = Dataset_.from_file(f"data/{dataset_name}_{tokenizer}/raw.arrow")
+                train_dataset = Dataset_.from_file(f"{rel_data_path}/raw.arrow")
             preprocessed_mel = False
         elif audio_type == "mel":
-            train_dataset = Dataset_.from_file(f"data/{dataset_name}_{tokenizer}/mel.arrow")
+            train_dataset = Dataset_.from_file(f"{rel_data_path}/mel.arrow")
             preprocessed_mel = True
-        with open(f"data/{dataset_name}_{tokenizer}/duration.json", 'r', encoding='utf-8') as f:
-            data_dict = json.load(f)
-        durations = data_dict["duration"]
-        train_dataset = CustomDataset(train_dataset, durations=durations, preprocessed_mel=preprocessed_mel, **mel_spec_kwargs)
-        
-    elif dataset_type == "CustomDatasetPath":
-        try:
-            train_dataset = load_from_disk(f"{dataset_name}/raw")
-        except:
-            train_dataset = Dataset_.from_file(f"{dataset_name}/raw.arrow")
-            
-        with open(f"{dataset_name}/duration.json", 'r', encoding='utf-8') as f:
-            data_dict = json.load(f)
-        durations = data_dict["duration"]
-        train_dataset = CustomDataset(train_dataset, durations=durations, preprocessed_mel=preprocessed_mel, **mel_spec_kwargs)
+        pretokenized = False
+        if tokenize and vocab_char_map is not None and "token_ids" in train_dataset.column_names:
+            pretokenized = load_token_vocab(rel_data_path) == vocab_char_map
+            if not pretokenized:
+                print(f"token_ids of {rel_data_path} computed with another vocab, tokenizing text instead")
+        durations, text_lengths = load_duration_index(rel_data_path)
+        assert len(durations) == len(train_dataset), f"{len(durations)} durations for {len(train_dataset)} rows in {rel_data_path}"
+        train_dataset = CustomDataset(train_dataset, durations=durations, text_lengths=text_lengths, preprocessed_mel=preprocessed_mel, mel_store=mel_store,
+                                      tokenize=tokenize, vocab_char_map=vocab_char_map, pretokenized=pretokenized, **mel_spec_kwargs)
             
     elif dataset_type == "HFDataset":
         print("Should manually modify the path of huggingface dataset to your need.\n" +
               "May also the corresponding script cuz different dataset may have different format.")
         pre, post = dataset_name.split("_")
-        train_dataset = HFDataset(load_dataset(f"{pre}/{pre}", split=f"train.{post}", cache_dir="./data"),)
+        train_dataset = HFDataset(load_dataset(f"{pre}/{pre}", split=f"train.{post}", cache_dir="./data"), num_proc=os.cpu_count())
 
     return train_dataset
 
 
 # collation
 
-def collate_fn(batch):
+def collate_fn(batch, pin_memory = False):
+    '''
+    mel                 - float [b d max_len], each mel copied once into one preallocated tensor (float16 from mel store cast on copy),
+                          pinned if pin_memory, for loading in process, as tensors from dataloader workers are pinned by the DataLoader
+    mask                - bool [b max_len], True for frames, False for padding, see CFM.forward
+    padding_efficiency  - share of real frames in the padded batch
+    text                - list of texts, or long [b max_nt] padded with -1 as list_str_to_idx if items are token ids (CustomDataset tokenize),
+                          tensors or numpy views of pre-tokenized ids copied in once
+    '''
     mel_specs = [item['mel_spec'].squeeze(0) for item in batch]
     mel_lengths = torch.LongTensor([spec.shape[-1] for spec in mel_specs])
-    max_mel_length = mel_lengths.amax()
+    max_mel_length = int(mel_lengths.amax())
 
-    padded_mel_specs = []
-    for spec in mel_specs:  # TODO. maybe records mask for attention here
-        padding = (0, max_mel_length - spec.size(-1))
-        padded_spec = F.pad(spec, padding, value = 0)
-        padded_mel_specs.append(padded_spec)
-    
-    mel_specs = torch.stack(padded_mel_specs)
+    padded_mel_specs = torch.empty(len(mel_specs), mel_specs[0].shape[0], max_mel_length, pin_memory = pin_memory)
+    for i, spec in enumerate(mel_specs):
+        padded_mel_specs[i, :, :spec.shape[-1]] = spec
+        padded_mel_specs[i, :, spec.shape[-1]:] = 0
+
+    mask = torch.arange(max_mel_length) < mel_lengths[:, None]
 
     text = [item['text'] for item in batch]
     text_lengths = torch.LongTensor([len(item) for item in text])
+    if isinstance(text[0], (torch.Tensor, np.ndarray)):
+        padded_text = torch.full((len(text), int(text_lengths.amax())), -1, dtype = torch.long)
+        padded_view = padded_text.numpy()  # numpy casting copy, also from read-only int16 views
+        for i, ids in enumerate(text):
+            padded_view[i, :len(ids)] = ids
+        text = padded_text
 
     return dict(
-        mel = mel_specs,
+        mel = padded_mel_specs,
         mel_lengths = mel_lengths,
+        mask = mask,
+        padding_efficiency = mel_lengths.sum().item() / mask.numel(),
         text = text,
         text_lengths = text_lengths,
     )
@@ -0,0 +1,125 @@
+# memoized, batched grapheme to pinyin front end, same tokens as model.utils.convert_char_to_pinyin
+
+from __future__ import annotations
+
+import multiprocessing as mp
+from functools import lru_cache
+
+import jieba
+from pypinyin import lazy_pinyin, Style
+
+
+zh_punc = "。，、；：？！《》【】—…"
+# clause ends, none in jieba's han blocks (jieba.re_han_default), so a text segments the same clause by clause
+clause_ends = set("。，、；：？！…,:?!")
+god_knows_why_en_testset_contains_zh_quote = str.maketrans({'“': '"', '”': '"', '‘': "'", '’': "'"})  # in case librispeech (orig no-pc) test-clean
+custom_trans = str.maketrans({';': ','})  # add custom trans here, to address oov
+
+
+def split_clauses(text):
+    clauses, start = [], 0
+    for i, c in enumerate(text):
+        if c in clause_ends:
+            clauses.append(text[start:i + 1])
+            start = i + 1
+    if start < len(text):
+        clauses.append(text[start:])
+    return clauses
+
+
+class G2P:
+    '''
+    polyphone           - as convert_char_to_pinyin, pinyin of pure chinese segments with tone sandhi
+    clause_cache_size   - clauses (text up to and including 。，？！ etc.) kept in the LRU cache, None for unbounded
+    segment_cache_size  - jieba segments -> lazy_pinyin kept in the LRU cache, None for unbounded
+    num_workers         - 0 to convert in process, otherwise convert() of large batches goes to a pool of that many processes,
+                          each with its own caches, e.g. for the prepare scripts
+    a repeated reference text or common phrase is only segmented & converted once, lazy_pinyin being most of the cost
+    '''
+    def __init__(self, polyphone = True, clause_cache_size = 65536, segment_cache_size = 262144, num_workers = 0):
+        self.polyphone = polyphone
+        self.clause_cache_size = clause_cache_size
+        self.segment_cache_size = segment_cache_size
+        self.num_workers = num_workers
+        self.pool = None
+
+        self.convert_clause = lru_cache(maxsize = clause_cache_size)(self._convert_clause)
+        self.segment_pinyin = lru_cache(maxsize = segment_cache_size)(self._segment_pinyin)
+
+    def _segment_pinyin(self, seg):
+        return tuple(lazy_pinyin(seg, style = Style.TONE3, tone_sandhi = True))
+
+    def _convert_clause(self, clause):
+        # tokens of the clause as if at the start of a text, and whether a space is due before them if not
+        # (pure alphabet word following anything but " :'\"", the only state convert_char_to_pinyin carries across segments)
+        tokens, leading_space = [], False
+        for seg in jieba.cut(clause):
+            seg_byte_len = len(bytes(seg, 'UTF-8'))
+            if seg_byte_len == len(seg):  # if pure alphabets and symbols
+                if seg_byte_len > 1:
+                    if not tokens:
+                        leading_space = True
+                    elif tokens[-1] not in " :'\"":
+                        tokens.append(" ")
+                tokens.extend(seg)
+            elif self.polyphone and seg_byte_len == 3 * len(seg):  # if pure chinese characters
+                for c in self.segment_pinyin(seg):
+                    if c not in zh_punc:
+                        tokens.append(" ")
+                    tokens.append(c)
+            else:  # if mixed chinese characters, alphabets and symbols
+                for c in seg:
+                    if ord(c) < 256:
+                        tokens.append(c)
+                    elif c not in zh_punc:
+                        tokens.append(" ")
+                        tokens.extend(self.segment_pinyin(c))
+                    else:  # if is zh punc
+                        tokens.append(c)
+        return tuple(tokens), leading_space
+
+    def __call__(self, text: str) -> list[str]:
+        char_list = []
+        text = text.translate(god_knows_why_en_testset_contains_zh_quote).translate(custom_trans)
+        for clause in split_clauses(text):
+            tokens, leading_space = self.convert_clause(clause)
+            if leading_space and char_list and char_list[-1] not in " :'\"":
+                char_list.append(" ")
+            char_list.extend(tokens)
+        return char_list
+
+    def convert(self, text_list: list[str], chunksize = 256) -> list[list[str]]:
+        ''' batch of texts, as convert_char_to_pinyin(text_list); clauses shared across texts are converted once '''
+        if self.num_workers > 0 and len(text_list) > chunksize:
+            if self.pool is None:
+                self.pool = mp.Pool(self.num_workers, initializer = init_worker,
+                                    initargs = (self.polyphone, self.clause_cache_size, self.segment_cache_size))
+            return self.pool.map(convert_in_worker, text_list, chunksize = chunksize)
+        return [self(text) for text in text_list]
+
+    def cache_info(self):
+        return dict(clause = self.convert_clause.cache_info(), segment = self.segment_pinyin.cache_info())
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# process pool workers, one in process G2P each
+
+worker_g2p = None
+
+def init_worker(polyphone, clause_cache_size, segment_cache_size):
+    global worker_g2p
+    worker_g2p = G2P(polyphone = polyphone, clause_cache_size = clause_cache_size, segment_cache_size = segment_cache_size)
+
+def convert_in_worker(text):
+    return worker_g2p(text)
@@ -9,6 +9,7 @@ d - dimension
 
 from __future__ import annotations
 from typing import Optional
+from functools import lru_cache
 import math
 
 import torch
@@ -64,6 +65,19 @@ class MelSpec(nn.Module):
         mel = self.mel_stft(inp)
         mel = mel.clamp(min = 1e-5).log()
         return mel
+
+
+# resampling, sinc kernel built once per (orig_sr, new_sr, dtype, device) instead of per call
+
+@lru_cache(maxsize = 32)
+def get_resampler(orig_sr, new_sr, dtype = torch.float32, device = "cpu"):
+    return torchaudio.transforms.Resample(orig_sr, new_sr).to(device = device, dtype = dtype)  # kernel built in float64 as before, then cast
+
+
+def resample(audio, orig_sr, new_sr):
+    if orig_sr == new_sr:
+        return audio
+    return get_resampler(orig_sr, new_sr, audio.dtype, str(audio.device))(audio)
     
 
 # sinusoidal position embedding
@@ -195,9 +209,13 @@ class AdaLayerNormZero(nn.Module):
 
         self.norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
 
-    def forward(self, x, emb = None):
-        emb = self.linear(self.silu(emb))
-        shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = torch.chunk(emb, 6, dim=1)
+    def modulation(self, emb):
+        return self.linear(self.silu(emb))
+
+    def forward(self, x, emb = None, mod = None):
+        if mod is None:  # otherwise precomputed with modulation(), e.g. for a whole ode schedule
+            mod = self.modulation(emb)
+        shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = torch.chunk(mod, 6, dim=1)
 
         x = self.norm(x) * (1 + scale_msa[:, None]) + shift_msa[:, None]
         return x, gate_msa, shift_mlp, scale_mlp, gate_mlp
@@ -215,9 +233,13 @@ class AdaLayerNormZero_Final(nn.Module):
 
         self.norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
 
-    def forward(self, x, emb):
-        emb = self.linear(self.silu(emb))
-        scale, shift = torch.chunk(emb, 2, dim=1)
+    def modulation(self, emb):
+        return self.linear(self.silu(emb))
+
+    def forward(self, x, emb = None, mod = None):
+        if mod is None:  # otherwise precomputed with modulation(), e.g. for a whole ode schedule
+            mod = self.modulation(emb)
+        scale, shift = torch.chunk(mod, 2, dim=1)
 
         x = self.norm(x) * (1 + scale)[:, None, :] + shift[:, None, :]
         return x
@@ -471,9 +493,9 @@ class DiTBlock(nn.Module):
         self.ff_norm = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
         self.ff = FeedForward(dim = dim, mult = ff_mult, dropout = dropout, approximate = "tanh")
 
-    def forward(self, x, t, mask = None, rope = None): # x: noised input, t: time embedding
+    def forward(self, x, t, mask = None, rope = None, mod = None): # x: noised input, t: time embedding, mod: precomputed modulation of t
         # pre-norm & modulation for attention input
-        norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attn_norm(x, emb=t)
+        norm, gate_msa, shift_mlp, scale_mlp, gate_mlp = self.attn_norm(x, emb=t, mod=mod)
 
         # attention
         attn_output = self.attn(x=norm, mask=mask, rope=rope)
@@ -526,13 +548,13 @@ class MMDiTBlock(nn.Module):
         self.ff_norm_x = nn.LayerNorm(dim, elementwise_affine=False, eps=1e-6)
         self.ff_x = FeedForward(dim = dim, mult = ff_mult, dropout = dropout, approximate = "tanh")
 
-    def forward(self, x, c, t, mask = None, rope = None, c_rope = None): # x: noised input, c: context, t: time embedding
+    def forward(self, x, c, t, mask = None, rope = None, c_rope = None, mod_x = None, mod_c = None): # x: noised input, c: context, t: time embedding, mod_*: precomputed modulations of t
         # pre-norm & modulation for attention input
         if self.context_pre_only:
-            norm_c = self.attn_norm_c(c, t)
+            norm_c = self.attn_norm_c(c, t, mod=mod_c)
         else:
-            norm_c, c_gate_msa, c_shift_mlp, c_scale_mlp, c_gate_mlp = self.attn_norm_c(c, emb=t)
-        norm_x, x_gate_msa, x_shift_mlp, x_scale_mlp, x_gate_mlp = self.attn_norm_x(x, emb=t)
+            norm_c, c_gate_msa, c_shift_mlp, c_scale_mlp, c_gate_mlp = self.attn_norm_c(c, emb=t, mod=mod_c)
+        norm_x, x_gate_msa, x_shift_mlp, x_scale_mlp, x_gate_mlp = self.attn_norm_x(x, emb=t, mod=mod_x)
 
         # attention
         x_attn_output, c_attn_output = self.attn(x=norm_x, c=norm_c, mask=mask, rope=rope, c_rope=c_rope)
@@ -5,6 +5,7 @@ import gc
 from tqdm import tqdm
 import wandb
 
+import numpy as np
 import torch
 from torch.optim import AdamW
 from torch.utils.data import DataLoader, Dataset, SequentialSampler
@@ -22,6 +23,17 @@ from model.utils import exists, default
 from model.dataset import DynamicBatchSampler, collate_fn
 
 
+# batch order of an epoch, for frame-wise batches
+
+def set_sampler_epoch(epoch, batch_sampler, *dataloaders):
+    # a prepared dataloader re-sets the epoch of its batch sampler from its own iteration count each time it is iterated,
+    # counted from 0 in every process & on skip_first_batches, so a resumed run would replay epoch 0's order; keep both at epoch
+    # (the sampler set directly too, as accelerate does not forward through SkipBatchSampler or BatchSamplerShard)
+    batch_sampler.set_epoch(epoch)
+    for dataloader in dataloaders:
+        dataloader.set_epoch(epoch)
+
+
 # trainer
 
 class Trainer:
@@ -36,6 +48,8 @@ class Trainer:
         batch_size = 32, 
         batch_size_type: str = "sample",
         max_samples = 32,
+        rank_balanced_batches = False,
+        mask_padding = False,
         grad_accumulation_steps = 1,
         max_grad_norm = 1.0,
         noise_scheduler: str | None = None,
@@ -70,6 +84,8 @@ class Trainer:
                     "batch_size": batch_size,
                     "batch_size_type": batch_size_type,
                     "max_samples": max_samples,
+                    "rank_balanced_batches": rank_balanced_batches,
+                    "mask_padding": mask_padding,
                     "grad_accumulation_steps": grad_accumulation_steps,
                     "max_grad_norm": max_grad_norm,
                     "gpus": self.accelerator.num_processes,
@@ -96,6 +112,8 @@ class Trainer:
         self.batch_size = batch_size
         self.batch_size_type = batch_size_type
         self.max_samples = max_samples
+        self.rank_balanced_batches = rank_balanced_batches
+        self.mask_padding = mask_padding
         self.grad_accumulation_steps = grad_accumulation_steps
         self.max_grad_norm = max_grad_norm
 
@@ -167,13 +185,15 @@ class Trainer:
         else: 
             generator = None
 
+        batch_sampler = None
         if self.batch_size_type == "sample":
             train_dataloader = DataLoader(train_dataset, collate_fn=collate_fn, num_workers=num_workers, pin_memory=True, persistent_workers=True,
                                           batch_size=self.batch_size, shuffle=True, generator=generator)
         elif self.batch_size_type == "frame":
             self.accelerator.even_batches = False
             sampler = SequentialSampler(train_dataset)
-            batch_sampler = DynamicBatchSampler(sampler, self.batch_size, max_samples=self.max_samples, random_seed=resumable_with_seed, drop_last=False)
+            batch_sampler = DynamicBatchSampler(sampler, self.batch_size, max_samples=self.max_samples, random_seed=resumable_with_seed, drop_last=False,
+                                                num_replicas=self.accelerator.num_processes, balance_ranks=self.rank_balanced_batches)
             train_dataloader = DataLoader(train_dataset, collate_fn=collate_fn, num_workers=num_workers, pin_memory=True, persistent_workers=True,
                                           batch_sampler=batch_sampler)
         else:
@@ -204,11 +224,23 @@ class Trainer:
 
         for epoch in range(skipped_epoch, self.epochs):
             self.model.train()
+            step_imbalance = None
+            if exists(batch_sampler):
+                # batch order reshuffled per epoch, reproducible from the seed when resumed
+                set_sampler_epoch(epoch, batch_sampler, train_dataloader, *([skipped_dataloader] if exists(resumable_with_seed) and epoch == skipped_epoch else []))
+                if self.accelerator.num_processes > 1:
+                    # padded frames of the rank batches at each step, share of the step the ranks wait on the straggler
+                    step_imbalance = batch_sampler.step_imbalance()
+                    if self.accelerator.is_local_main_process:
+                        print(f"Epoch {epoch+1}/{self.epochs} rank imbalance: mean {step_imbalance.mean():.3f}, p99 {np.percentile(step_imbalance, 99):.3f} "
+                              f"({'balanced' if self.rank_balanced_batches else 'round-robin'} batches over {self.accelerator.num_processes} ranks)")
             if exists(resumable_with_seed) and epoch == skipped_epoch:
                 progress_bar = tqdm(skipped_dataloader, desc=f"Epoch {epoch+1}/{self.epochs}", unit="step", disable=not self.accelerator.is_local_main_process, 
                                     initial=skipped_batch, total=orig_epoch_step)
+                epoch_step = skipped_batch
             else:
                 progress_bar = tqdm(train_dataloader, desc=f"Epoch {epoch+1}/{self.epochs}", unit="step", disable=not self.accelerator.is_local_main_process)
+                epoch_step = 0
 
             for batch in progress_bar:
                 with self.accelerator.accumulate(self.model):
@@ -221,7 +253,8 @@ class Trainer:
                         dur_loss = self.duration_predictor(mel_spec, lens=batch.get('durations'))
                         self.accelerator.log({"duration loss": dur_loss.item()}, step=global_step)
 
-                    loss, cond, pred = self.model(mel_spec, text=text_inputs, lens=mel_lengths, noise_scheduler=self.noise_scheduler)
+                    mask = batch['mask'] if self.mask_padding else None  # padding out of attention, more memory
+                    loss, cond, pred = self.model(mel_spec, text=text_inputs, lens=mel_lengths, mask=mask, noise_scheduler=self.noise_scheduler)
                     self.accelerator.backward(loss)
 
                     if self.max_grad_norm > 0 and self.accelerator.sync_gradients:
@@ -235,9 +268,12 @@ class Trainer:
                     self.ema_model.update()
 
                 global_step += 1
+                epoch_step += 1
 
                 if self.accelerator.is_local_main_process:
-                    self.accelerator.log({"loss": loss.item(), "lr": self.scheduler.get_last_lr()[0]}, step=global_step)
+                    self.accelerator.log({"loss": loss.item(), "lr": self.scheduler.get_last_lr()[0], "padding efficiency": batch["padding_efficiency"]}, step=global_step)
+                    if exists(step_imbalance) and epoch_step <= len(step_imbalance):
+                        self.accelerator.log({"rank imbalance": step_imbalance[epoch_step - 1]}, step=global_step)
                 
                 progress_bar.set_postfix(step=str(global_step), loss=loss.item())
                 
@@ -5,6 +5,7 @@ import re
 import math
 import random
 import string
+import itertools
 from tqdm import tqdm
 from collections import defaultdict
 
@@ -12,6 +13,7 @@ import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pylab as plt
 
+import numpy as np
 import torch
 import torch.nn.functional as F
 from torch.nn.utils.rnn import pad_sequence
@@ -24,7 +26,7 @@ import jieba
 from pypinyin import lazy_pinyin, Style
 
 from model.ecapa_tdnn import ECAPA_TDNN_SMALL
-from model.modules import MelSpec
+from model.modules import MelSpec, resample
 
 
 # seed everything
@@ -116,6 +118,60 @@ def list_str_to_idx(
     return text
 
 
+# token ids of a single text, vocab_char_map indices or utf-8 bytes if None, e.g. in dataloader workers
+def str_to_idx(
+    text: str | list[str],
+    vocab_char_map: dict[str, int] | None = None,  # {char: idx}
+) -> int['nt']:
+    if vocab_char_map is None:
+        return torch.tensor([*bytes(text if isinstance(text, str) else "".join(text), 'UTF-8')])
+    return torch.tensor([vocab_char_map.get(c, 0) for c in text])
+
+
+# batched list_str_to_idx / list_str_to_tensor, same ids, built once instead of one tensor per text and pad_sequence
+class VocabTokenizer:
+    '''
+    vocab_char_map  - {char: idx} as get_tokenizer, 0 for unknown; None for utf-8 bytes (list_str_to_tensor)
+    padding_value   - fill of the padded [b nt] batch
+    texts of str are encoded as code points through a lookup table of the single char vocab entries,
+    texts of list (pinyin, multi-char tokens) with one flat dict lookup over the whole batch,
+    then scattered into one preallocated padded tensor
+    '''
+    def __init__(self, vocab_char_map: dict[str, int] | None = None, padding_value = -1):
+        self.vocab_char_map = vocab_char_map
+        self.padding_value = padding_value
+        if vocab_char_map is not None:
+            chars = {ord(c): i for c, i in vocab_char_map.items() if len(c) == 1}
+            self.char_table = np.zeros(max(chars, default = 0) + 2, dtype = np.int64)  # last entry 0, for code points past the table
+            self.char_table[list(chars)] = list(chars.values())
+
+    @classmethod
+    def from_file(cls, vocab_path, padding_value = -1):
+        vocab_char_map, _ = get_tokenizer(vocab_path, "custom")
+        return cls(vocab_char_map, padding_value = padding_value)
+
+    def encode(self, text: list[str] | list[list[str]]) -> tuple[np.ndarray, np.ndarray]:
+        ''' flat int64 ids of the batch, and the number of ids of each text '''
+        if self.vocab_char_map is None:
+            encoded = [bytes(t if isinstance(t, str) else "".join(t), 'UTF-8') for t in text]
+            lens = np.fromiter(map(len, encoded), dtype = np.int64, count = len(encoded))
+            return np.frombuffer(b"".join(encoded), dtype = np.uint8).astype(np.int64), lens
+
+        lens = np.fromiter(map(len, text), dtype = np.int64, count = len(text))
+        if all(isinstance(t, str) for t in text):
+            codes = np.frombuffer("".join(text).encode('utf-32-le', 'surrogatepass'), dtype = np.uint32)
+            return self.char_table[np.minimum(codes, len(self.char_table) - 1)], lens
+        total = int(lens.sum())
+        ids = map(self.vocab_char_map.get, itertools.chain.from_iterable(text), itertools.repeat(0, total))
+        return np.fromiter(ids, dtype = np.int64, count = total), lens
+
+    def __call__(self, text: list[str] | list[list[str]]) -> int['b nt']:
+        ids, lens = self.encode(text)
+        batch = torch.full((len(text), int(lens.max(initial = 0))), self.padding_value, dtype = torch.long)
+        batch.numpy()[np.arange(batch.shape[1]) < lens[:, None]] = ids  # row-major, so each row's ids in order
+        return batch
+
+
 # Get tokenizer
 
 def get_tokenizer(dataset_name, tokenizer: str = "pinyin"):
@@ -271,9 +327,7 @@ def get_inference_prompt(
         if ref_rms < target_rms:
             ref_audio = ref_audio * target_rms / ref_rms
         assert ref_audio.shape[-1] > 5000, f"Empty prompt wav: {prompt_wav}, or torchaudio backend issue."
-        if ref_sr != target_sample_rate:
-            resampler = torchaudio.transforms.Resample(ref_sr, target_sample_rate)
-            ref_audio = resampler(ref_audio)
+        ref_audio = resample(ref_audio, ref_sr, target_sample_rate)
 
         # Text
         if len(prompt_text[-1].encode('utf-8')) == 1:
@@ -288,9 +342,7 @@ def get_inference_prompt(
         ref_mel_len = ref_audio.shape[-1] // hop_length
         if use_truth_duration:
             gt_audio, gt_sr = torchaudio.load(gt_wav)
-            if gt_sr != target_sample_rate:
-                resampler = torchaudio.transforms.Resample(gt_sr, target_sample_rate)
-                gt_audio = resampler(gt_audio)
+            gt_audio = resample(gt_audio, gt_sr, target_sample_rate)
             total_mel_len = ref_mel_len + int(gt_audio.shape[-1] / hop_length / speed)
 
             # # test vocoder resynthesis
@@ -523,10 +575,8 @@ def run_sim(args):
         wav1, sr1 = torchaudio.load(wav1)
         wav2, sr2 = torchaudio.load(wav2)
 
-        resample1 = torchaudio.transforms.Resample(orig_freq=sr1, new_freq=16000)
-        resample2 = torchaudio.transforms.Resample(orig_freq=sr2, new_freq=16000)
-        wav1 = resample1(wav1)
-        wav2 = resample2(wav2)
+        wav1 = resample(wav1, sr1, 16000)
+        wav2 = resample(wav2, sr2, 16000)
 
         if use_gpu:
             wav1 = wav1.cuda(device)
@@ -0,0 +1,849 @@
+# shared inference utilities for inference-cli.py & gradio_app.py
+
+from __future__ import annotations
+
+import io
+import os
+import re
+import json
+import math
+import queue
+import contextvars
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from tqdm import tqdm
+
+import torch
+import torchaudio
+from einops import rearrange
+
+from model.cfm import CFM, sample_duration
+from model.backbones.dit import DiT
+from model.backbones.unett import UNetT
+from model.modules import MelSpec, resample
+from model.utils import default, get_tokenizer, load_checkpoint
+from model.g2p import G2P
+
+
+device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
+
+target_sample_rate = 24000
+n_mel_channels = 100
+hop_length = 256
+
+# model name -> (hf repo, exp name, ckpt step, backbone, backbone config)
+model_registry = {
+    "F5-TTS": ("F5-TTS", "F5TTS_Base", 1200000, DiT, dict(dim = 1024, depth = 22, heads = 16, ff_mult = 2, text_dim = 512, conv_layers = 4)),
+    "E2-TTS": ("E2-TTS", "E2TTS_Base", 1200000, UNetT, dict(dim = 1024, depth = 24, heads = 16, ff_mult = 4)),
+}
+
+vocos_repo = "charactr/vocos-mel-24khz"
+
+# process level memoized pinyin front end, clauses of a reference text converted once across chunks & requests
+g2p = G2P()
+
+
+# process level pool of warm models
+
+class ModelPool:
+    '''
+    max_size    - number of models kept warm, least recently used one evicted beyond
+    get()       - lazy, loader() only called on first request of a key, concurrent requests of that key wait for it,
+                  the loader runs under a per-key lock so other keys are served meanwhile
+    preload()   - load ahead of first request
+    '''
+    def __init__(self, max_size = 2):
+        self.max_size = max_size
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        self.loading = {}  # key -> [lock held while its loader runs, callers waiting on or holding it]
+
+    def __contains__(self, key):
+        return key in self.models
+
+    def __len__(self):
+        return len(self.models)
+
+    def lookup(self, key):
+        # under self.lock
+        if key in self.models:
+            self.models.move_to_end(key)
+            return True, self.models[key]
+        return False, None
+
+    def get(self, key, loader):
+        with self.lock:
+            found, model = self.lookup(key)
+            if found:
+                return model
+            loading = self.loading.setdefault(key, [threading.Lock(), 0])
+            loading[1] += 1
+
+        try:
+            with loading[0]:
+                with self.lock:
+                    found, model = self.lookup(key)  # loaded by a concurrent caller of the same key meanwhile
+                if found:
+                    return model
+                model = loader()  # if it raises, the next waiter of the key retries, still one load at a time
+                with self.lock:
+                    self.models[key] = model
+                    while len(self.models) > self.max_size:
+                        self.models.popitem(last = False)
+                return model
+        finally:
+            with self.lock:
+                loading[1] -= 1
+                if loading[1] == 0 and self.loading.get(key) is loading:  # last caller of the key, new ones start over
+                    del self.loading[key]
+
+    def preload(self, key, loader):
+        self.get(key, loader)
+
+    def evict(self, key = None):
+        with self.lock:
+            if key is None:
+                self.models.clear()
+            else:
+                self.models.pop(key, None)
+
+
+model_pool = ModelPool(max_size = 2)
+vocoder_pool = ModelPool(max_size = 1)
+
+
+# tokenizer, vocab file read once per process
+
+@lru_cache(maxsize = None)
+def get_cached_tokenizer(dataset_name = "Emilia_ZH_EN", tokenizer = "pinyin"):
+    return get_tokenizer(dataset_name, tokenizer)
+
+
+# ckpt path, local ckpts/ first, then huggingface hub, resolved once per process so warm get_model() calls skip cached_path
+
+@lru_cache(maxsize = None)
+def resolve_ckpt_path(model_name):
+    repo_name, exp_name, ckpt_step, _, _ = model_registry[model_name]
+    ckpt_path = f"ckpts/{exp_name}/model_{ckpt_step}.pt"  # .pt | .safetensors
+    if not Path(ckpt_path).exists():
+        from cached_path import cached_path
+        ckpt_path = str(cached_path(f"hf://SWivid/{repo_name}/{exp_name}/model_{ckpt_step}.safetensors"))
+    return ckpt_path
+
+
+def load_model(model_name, ckpt_path, device = device, dtype = torch.float32, ode_method = "euler"):
+    _, _, _, model_cls, model_cfg = model_registry[model_name]
+    vocab_char_map, vocab_size = get_cached_tokenizer("Emilia_ZH_EN", "pinyin")
+    model = CFM(
+        transformer = model_cls(**model_cfg, text_num_embeds = vocab_size, mel_dim = n_mel_channels),
+        mel_spec_kwargs = dict(
+            target_sample_rate = target_sample_rate,
+            n_mel_channels = n_mel_channels,
+            hop_length = hop_length,
+        ),
+        odeint_kwargs = dict(
+            method = ode_method,
+        ),
+        vocab_char_map = vocab_char_map,
+    ).to(device)
+
+    model = load_checkpoint(model, ckpt_path, device, use_ema = True)
+    return model.to(dtype).eval()
+
+
+def get_model(model_name, ckpt_path = None, device = device, dtype = torch.float32):
+    # warm model from pool, keyed by (model, ckpt, device, dtype)
+    if ckpt_path is None:
+        ckpt_path = resolve_ckpt_path(model_name)
+    key = (model_name, ckpt_path, str(device), str(dtype))
+    return model_pool.get(key, lambda: load_model(model_name, ckpt_path, device = device, dtype = dtype))
+
+
+def preload_model(model_name, ckpt_path = None, device = device, dtype = torch.float32):
+    get_model(model_name, ckpt_path = ckpt_path, device = device, dtype = dtype)
+
+
+def load_vocoder(local_path = None):
+    # kept on cpu, mels are decoded with .cpu()
+    from vocos import Vocos
+    if local_path is not None:
+        print(f"Load vocos from local path {local_path}")
+        vocos = Vocos.from_hparams(f"{local_path}/config.yaml")
+        state_dict = torch.load(f"{local_path}/pytorch_model.bin", weights_only = True, map_location = "cpu")
+        vocos.load_state_dict(state_dict)
+    else:
+        print(f"Download Vocos from huggingface {vocos_repo}")
+        vocos = Vocos.from_pretrained(vocos_repo)
+    return vocos.eval()
+
+
+def get_vocoder(local_path = None):
+    return vocoder_pool.get(("vocos", local_path), lambda: load_vocoder(local_path))
+
+
+# asr for reference audio transcription
+
+asr_pool = ModelPool(max_size = 1)
+
+def get_asr_pipe(device = device):
+    def load():
+        from transformers import pipeline
+        return pipeline(
+            "automatic-speech-recognition",
+            model = "openai/whisper-large-v3-turbo",
+            torch_dtype = torch.float16,
+            device = device,
+        )
+    return asr_pool.get(("whisper-large-v3-turbo", str(device)), load)
+
+
+# text chunking for long-form synthesis
+
+def chunk_text(text, max_chars = 135):
+    """
+    Splits the input text into chunks, each with a maximum number of characters.
+    Args:
+        text (str): The text to be split.
+        max_chars (int): The maximum number of characters per chunk.
+    Returns:
+        List[str]: A list of text chunks.
+    """
+    chunks = []
+    current_chunk = ""
+    # Split the text into sentences based on punctuation followed by whitespace
+    sentences = re.split(r'(?<=[;:,.!?])\s+|(?<=[；：，。！？])', text)
+
+    for sentence in sentences:
+        if len(current_chunk.encode('utf-8')) + len(sentence.encode('utf-8')) <= max_chars:
+            current_chunk += sentence + " " if sentence and len(sentence[-1].encode('utf-8')) == 1 else sentence
+        else:
+            if current_chunk:
+                chunks.append(current_chunk.strip())
+            current_chunk = sentence + " " if sentence and len(sentence[-1].encode('utf-8')) == 1 else sentence
+
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+
+    return chunks
+
+
+# length bucketing of chunks, for batched sampling
+
+def bucket_by_length(durations, max_batch_size = 8, max_batch_frames = 32768):
+    '''
+    durations           - total frames (ref + gen) of each chunk
+    max_batch_size      - max chunks per bucket
+    max_batch_frames    - max padded frames per bucket, i.e. max duration in bucket x bucket size
+    return list of buckets, each a list of chunk indices, adjacent in sorted duration order
+    '''
+    order = sorted(range(len(durations)), key = lambda i: durations[i])
+    buckets, bucket = [], []
+    for i in order:
+        if bucket and (len(bucket) == max_batch_size or durations[i] * (len(bucket) + 1) > max_batch_frames):
+            buckets.append(bucket)
+            bucket = []
+        bucket.append(i)
+    if bucket:
+        buckets.append(bucket)
+    return buckets
+
+
+# cross-fade assembly of chunk waves into one preallocated buffer, linear in total samples
+
+@lru_cache(maxsize = 16)
+def fade_windows(n, curve = "linear"):
+    # (fade_out, fade_in) of n samples, read-only and shared
+    if curve == "linear":
+        fade_in = np.linspace(0, 1, n, dtype = np.float32)
+        fade_out = np.linspace(1, 0, n, dtype = np.float32)
+    elif curve == "equal_power":  # constant power for uncorrelated overlaps, sin^2 + cos^2 = 1
+        theta = np.linspace(0, np.pi / 2, n)
+        fade_in = np.sin(theta).astype(np.float32)
+        fade_out = np.cos(theta).astype(np.float32)
+    else:
+        raise ValueError(f"cross-fade curve should be 'linear' or 'equal_power', but received {curve}")
+    fade_in.flags.writeable = False
+    fade_out.flags.writeable = False
+    return fade_out, fade_in
+
+
+class AudioAssembler:
+    '''
+    lengths             - samples of each chunk wave, known up front (e.g. from estimated durations)
+    cross_fade_duration - seconds of overlap between adjacent chunks, clipped to the shorter side, <= 0 to concatenate
+    curve               - "linear" | "equal_power"
+    add()               - write chunk i in place, any order, its fades applied once
+    ready()             - samples final since last call, i.e. up to where a not yet added chunk overlaps
+    '''
+    def __init__(self, lengths, cross_fade_duration = 0.15, sample_rate = target_sample_rate, curve = "linear"):
+        cross_fade_samples = max(int(cross_fade_duration * sample_rate), 0)
+        self.curve = curve
+        self.lengths = list(lengths)
+
+        # offset of each chunk in the output & its overlap with all before, as sequential cross-fading would give
+        self.offsets, self.overlaps = [], []
+        total = 0
+        for i, length in enumerate(self.lengths):
+            n = min(cross_fade_samples, total, length) if i > 0 else 0
+            self.offsets.append(total - n)
+            self.overlaps.append(n)
+            total = total - n + length
+
+        # earliest offset from each chunk on, where output may still change
+        self.final_until = [total] * (len(self.lengths) + 1)
+        for i in reversed(range(len(self.lengths))):
+            self.final_until[i] = min(self.offsets[i], self.final_until[i + 1])
+
+        self.buffer = np.zeros(total, dtype = np.float32)
+        self.added = [False] * len(self.lengths)
+        self.next_missing = 0
+        self.emitted = 0
+
+    def add(self, i, wave):
+        assert len(wave) == self.lengths[i], f"chunk {i} has {len(wave)} samples, expected {self.lengths[i]}"
+        offset, n, length = self.offsets[i], self.overlaps[i], self.lengths[i]
+        segment = np.asarray(wave, dtype = np.float32).copy()
+
+        if n > 0:
+            segment[:n] *= fade_windows(n, self.curve)[1]
+        # fade out under each later chunk overlapping this one, normally only the next
+        k = i + 1
+        while k < len(self.lengths) and self.final_until[k] < offset + length:
+            start, end = max(self.offsets[k], offset), min(self.offsets[k] + self.overlaps[k], offset + length)
+            if start < end:
+                fade_out = fade_windows(self.overlaps[k], self.curve)[0]
+                segment[start - offset:end - offset] *= fade_out[start - self.offsets[k]:end - self.offsets[k]]
+            k += 1
+
+        self.buffer[offset:offset + length] += segment
+        self.added[i] = True
+        while self.next_missing < len(self.lengths) and self.added[self.next_missing]:
+            self.next_missing += 1
+
+    def ready(self):
+        end = self.final_until[self.next_missing]
+        block = self.buffer[self.emitted:end]
+        self.emitted = max(self.emitted, end)
+        return block
+
+    def result(self):
+        return self.buffer
+
+
+def cross_fade(waves, cross_fade_duration = 0.15, sample_rate = target_sample_rate, curve = "linear"):
+    # Combine all generated waves with cross-fading
+    assembler = AudioAssembler([len(wave) for wave in waves], cross_fade_duration, sample_rate, curve)
+    for i, wave in enumerate(waves):
+        assembler.add(i, wave)
+    return assembler.result()
+
+
+# silence trimming on in-memory audio, same cuts as pydub.silence.split_on_silence on 16-bit pcm, no temp files
+
+def detect_nonsilent(audio, sr, min_silence_len = 1000, silence_thresh = -50, seek_step = 1, max_amplitude = 32768):
+    '''
+    audio           - float [c nw] or [nw], in [-1, 1]
+    min_silence_len - ms, silences shorter than this are kept
+    silence_thresh  - dBFS, window rms below or at this is silent
+    return list of [start, end] nonsilent ranges in ms, as pydub.silence.detect_nonsilent
+    '''
+    audio = np.asarray(audio, dtype = np.float64).reshape(-1, np.shape(audio)[-1])
+    frames = audio.shape[-1]
+    seg_len = round(1000 * frames / sr)
+
+    silent_ranges = []
+    if seg_len >= min_silence_len:
+        # rms of every min_silence_len window at seek_step ms, from cumulative energy over all channels
+        energy = np.concatenate([[0.], np.cumsum(np.square(audio * max_amplitude).sum(axis = 0))])
+        starts = np.arange(0, seg_len - min_silence_len + 1, seek_step)
+        if (seg_len - min_silence_len) % seek_step:
+            starts = np.append(starts, seg_len - min_silence_len)
+        lo = (starts * sr / 1000).astype(np.int64)
+        hi = (np.minimum(starts + min_silence_len, seg_len) * sr / 1000).astype(np.int64)
+        samples = (hi - lo) * audio.shape[0]  # frames past the end count as zero padding, as in pydub slicing
+        energy_window = energy[hi.clip(max = frames)] - energy[lo.clip(max = frames)]
+        rms = np.floor(np.sqrt(energy_window / np.maximum(samples, 1)))  # integer rms as audioop
+        silence_starts = starts[rms <= 10 ** (silence_thresh / 20) * max_amplitude]
+
+        # join overlapping windows into ranges, split where next window starts past the end of previous
+        if len(silence_starts):
+            breaks = np.nonzero(np.diff(silence_starts) > min_silence_len)[0]
+            range_starts = np.concatenate([silence_starts[:1], silence_starts[breaks + 1]])
+            range_ends = np.concatenate([silence_starts[breaks], silence_starts[-1:]]) + min_silence_len
+            silent_ranges = [[int(s), int(e)] for s, e in zip(range_starts, range_ends)]
+
+    if not silent_ranges:
+        return [[0, seg_len]]
+    if silent_ranges[0][0] == 0 and silent_ranges[0][1] == seg_len:
+        return []
+
+    nonsilent_ranges = []
+    prev_end = 0
+    for start, end in silent_ranges:
+        nonsilent_ranges.append([prev_end, start])
+        prev_end = end
+    if prev_end != seg_len:
+        nonsilent_ranges.append([prev_end, seg_len])
+    if nonsilent_ranges[0] == [0, 0]:
+        nonsilent_ranges.pop(0)
+    return nonsilent_ranges
+
+
+def remove_silence(audio, sr, min_silence_len = 1000, silence_thresh = -50, keep_silence = 1000):
+    '''
+    audio           - float [c nw] or [nw], torch or numpy, returned as the same type
+    keep_silence    - ms of silence kept around each nonsilent range, split evenly where two would overlap
+    nonsilent parts concatenated, as joining the segments of pydub.silence.split_on_silence
+    '''
+    frames = audio.shape[-1]
+    seg_len = round(1000 * frames / sr)
+    ranges = [[start - keep_silence, end + keep_silence] for start, end in detect_nonsilent(
+        audio.numpy() if torch.is_tensor(audio) else audio, sr, min_silence_len, silence_thresh)]
+    for prev_range, next_range in zip(ranges, ranges[1:]):
+        if next_range[0] < prev_range[1]:
+            prev_range[1] = next_range[0] = (prev_range[1] + next_range[0]) // 2
+
+    # the last ms may end past the last frame, zero padded as pydub slicing does
+    to_frame = lambda ms: int(min(max(ms, 0), seg_len) * sr / 1000)
+    pad = max(to_frame(seg_len) - frames, 0)
+    if torch.is_tensor(audio):
+        audio = torch.nn.functional.pad(audio, (0, pad))
+        return torch.cat([audio[..., to_frame(start):to_frame(end)] for start, end in ranges] or [audio[..., :0]], dim = -1)
+    audio = np.pad(audio, [(0, 0)] * (audio.ndim - 1) + [(0, pad)])
+    return np.concatenate([audio[..., to_frame(start):to_frame(end)] for start, end in ranges] or [audio[..., :0]], axis = -1)
+
+
+def preprocess_ref_audio_orig(ref_audio_orig, clip_ms = 15000, trim_silence = True):
+    '''
+    ref_audio_orig  - path, or (audio [c nw] | [nw], sr) already in memory, e.g. from a numpy gradio input
+    clip_ms         - clip to the first clip_ms after trimming, None for no clipping
+    trim_silence    - remove silences over 1s, keeping 1s around speech
+    return (audio [c nw] float, sr), and whether it was clipped
+    '''
+    if isinstance(ref_audio_orig, (tuple, list)):
+        audio, sr = ref_audio_orig
+        audio = torch.as_tensor(audio, dtype = torch.float32)
+        if audio.ndim == 1:
+            audio = audio.unsqueeze(0)
+    else:
+        audio, sr = torchaudio.load(ref_audio_orig)
+
+    if trim_silence:
+        audio = remove_silence(audio, sr, min_silence_len = 1000, silence_thresh = -50, keep_silence = 1000)
+    clipped = clip_ms is not None and round(1000 * audio.shape[-1] / sr) > clip_ms
+    if clipped:
+        audio = audio[..., :int(clip_ms * sr / 1000)]
+    return (audio, sr), clipped
+
+
+def transcribe(pipe, ref_audio):
+    # whisper on the in-memory (audio [c nw], sr), mono mixdown, resampled inside the pipeline
+    audio, sr = ref_audio
+    return pipe(
+        {"raw": audio.mean(dim = 0).numpy(), "sampling_rate": sr},
+        chunk_length_s = 30,
+        batch_size = 128,
+        generate_kwargs = {"task": "transcribe"},
+        return_timestamps = False,
+    )["text"].strip()
+
+
+# long-form synthesis helpers
+
+def preprocess_ref_audio(ref_audio, target_rms = 0.1, device = device):
+    # (audio [c nw], sr) -> mono, loudness raised to target_rms, resampled, on device. also return orig rms
+    audio, sr = ref_audio
+    if audio.shape[0] > 1:
+        audio = torch.mean(audio, dim = 0, keepdim = True)
+
+    rms = torch.sqrt(torch.mean(torch.square(audio)))
+    if rms < target_rms:
+        audio = audio * target_rms / rms
+    audio = resample(audio, sr, target_sample_rate)
+    return audio.to(device), rms
+
+
+def prepare_chunk_texts(ref_audio_len, ref_text, gen_text_batches, speed = 1., tokenize_ref_text = None, cond_len = None):
+    # model input text of each chunk (ref text prepended) & total frames estimated from ref speaking rate
+    # cond_len, mel frames of the reference as passed to CFM.sample (ref_audio_len if not given), durations clamped as it does
+    # tokenize_ref_text, memoized g2p of ref_text, e.g. RefVoice.text_tokens
+    if len(ref_text[-1].encode('utf-8')) == 1:
+        ref_text = ref_text + " "
+    if tokenize_ref_text is not None and ref_text[-1].isspace():
+        # jieba segments & pinyin spacing don't carry over a trailing space, so tokens of ref + gen are the two joined
+        ref_text_tokens = tokenize_ref_text(ref_text)
+        final_text_list = [ref_text_tokens + gen_tokens for gen_tokens in g2p.convert(gen_text_batches)]
+    else:
+        final_text_list = g2p.convert([ref_text + gen_text for gen_text in gen_text_batches])
+
+    zh_pause_punc = r"。，、；：？！"
+    ref_text_len = len(ref_text.encode('utf-8')) + 3 * len(re.findall(zh_pause_punc, ref_text))
+    durations = []
+    for gen_text, final_text in zip(gen_text_batches, final_text_list):
+        gen_text_len = len(gen_text.encode('utf-8')) + 3 * len(re.findall(zh_pause_punc, gen_text))
+        duration = ref_audio_len + int(ref_audio_len / ref_text_len * gen_text_len / speed)
+        duration = sample_duration(duration, max(default(cond_len, ref_audio_len), len(final_text)))  # as clamped in CFM.sample
+        durations.append(duration)
+
+    return final_text_list, durations
+
+
+def sample_mels(model, cond, ref_audio_len, final_text_list, durations, *, device = device, **sample_kwargs):
+    '''
+    cond            - reference as wave [1 nw] or mel [1 n d], on device
+    ref_audio_len   - reference frames, cut from the output
+    one sample() call for all given chunks, padded to longest with per sample duration
+    return generated part as mel [b d n] on cpu, padding frames set to silence, and each generated length
+    '''
+    batch_durations = torch.tensor(durations, dtype = torch.long, device = device)
+
+    with torch.inference_mode():
+        generated, _ = model.sample(
+            cond = cond.expand(len(durations), *cond.shape[1:]),
+            text = final_text_list,
+            duration = batch_durations,
+            **sample_kwargs,
+        )
+
+        generated = generated[:, ref_audio_len:, :].float().cpu()
+        gen_lens = [duration - ref_audio_len for duration in durations]
+        for j, gen_len in enumerate(gen_lens):
+            generated[j, gen_len:] = math.log(1e-5)
+    return rearrange(generated, "b n d -> b d n"), gen_lens
+
+
+def decode_mels(vocoder, generated_mel_spec, gen_lens, rms, target_rms = 0.1):
+    # one vocoder decode for all, then each wave cut back to its length
+    # return list of (wave np [nw], mel np [d n]), in given order
+    with torch.inference_mode():
+        generated_wave = vocoder.decode(generated_mel_spec)
+    if rms < target_rms:
+        generated_wave = generated_wave * rms / target_rms
+
+    # wav -> numpy
+    return [
+        (generated_wave[j, :gen_len * hop_length].cpu().numpy(), generated_mel_spec[j, :, :gen_len].numpy())
+        for j, gen_len in enumerate(gen_lens)
+    ]
+
+
+# producer / consumer pipelining, so vocoder decode of chunk i overlaps with ode solve of chunk i+1
+
+def pipelined(items, queue_depth = 1):
+    '''
+    items           - iterable producing work, e.g. a generator of sampled mels, run in a worker thread
+    queue_depth     - max produced items waiting for the consumer, 0 to run inline without thread
+    yield items in order, exceptions of the producer re-raised in the consumer
+    '''
+    if queue_depth <= 0:
+        yield from items
+        return
+
+    handoff = queue.Queue(maxsize = queue_depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                handoff.put(entry, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+
+    thread = threading.Thread(target = contextvars.copy_context().run, args = (worker,), daemon = True)  # producer sees the caller's contextvars
+    thread.start()
+    try:
+        while True:
+            item, error = handoff.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                break
+            yield item
+    finally:
+        stop.set()  # consumer finished or closed early, release a producer blocked on a full queue
+        thread.join()
+
+
+# reference voice artifacts, computed once per reference audio & preprocessing params
+
+@lru_cache(maxsize = None)
+def get_mel_spec():
+    return MelSpec(target_sample_rate = target_sample_rate, n_mel_channels = n_mel_channels, hop_length = hop_length)
+
+
+class RefVoice:
+    '''
+    mel         - [1 n d] float32 on cpu, of the mono, rms normalized, resampled reference, as CFM.sample computes from wave
+    audio_len   - samples at target_sample_rate, reference frames are audio_len // hop_length
+    rms         - of the reference before normalization, to scale the output back
+    duration    - seconds of the (trimmed) reference, for text chunking
+    clipped     - whether the reference was clipped to its max duration
+    transcript  - whisper text of the reference, None if not transcribed
+    tokens      - ref_text -> g2p tokens, filled by text_tokens()
+    path        - on-disk store of the voice, rewritten when transcript or tokens are added, None for memory only
+    '''
+    def __init__(self, mel, audio_len, rms, duration, target_rms = 0.1, clipped = False, transcript = None, tokens = None, path = None):
+        self.mel = mel
+        self.audio_len = audio_len
+        self.rms = rms
+        self.duration = duration
+        self.target_rms = target_rms
+        self.clipped = clipped
+        self.transcript = transcript
+        self.tokens = tokens if tokens is not None else {}
+        self.path = path
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_audio(cls, ref_audio, target_rms = 0.1, **kwargs):
+        # (audio [c nw], sr) -> mono, rms normalized, resampled & mel, all on cpu
+        audio, sr = ref_audio
+        duration = audio.shape[-1] / sr
+        audio, rms = preprocess_ref_audio((audio, sr), target_rms = target_rms, device = "cpu")
+        with torch.inference_mode():
+            mel = rearrange(get_mel_spec()(audio), 'b d n -> b n d')
+        return cls(mel, audio.shape[-1], rms.item(), duration, target_rms = target_rms, **kwargs)
+
+    def text_tokens(self, ref_text):
+        with self.lock:
+            if ref_text not in self.tokens:
+                self.tokens[ref_text] = g2p(ref_text)
+                self.save()
+            return self.tokens[ref_text]
+
+    def save(self):
+        # mel as float16 & the rest as json in one .npz, written aside then renamed, so readers never see a partial file
+        if self.path is None:
+            return
+        meta = dict(audio_len = self.audio_len, rms = self.rms, duration = self.duration, target_rms = self.target_rms,
+                    clipped = self.clipped, transcript = self.transcript, tokens = self.tokens)
+        tmp_path = f"{self.path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, mel = self.mel.numpy().astype(np.float16), meta = np.array(json.dumps(meta, ensure_ascii = False)))
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            mel = torch.from_numpy(data["mel"].astype(np.float32))
+        return cls(mel, path = path, **meta)
+
+
+class VoiceCache:
+    '''
+    content addressed cache of RefVoice, keyed by hash of the reference audio bytes & the preprocessing params
+    max_size        - voices kept in memory, least recently used evicted beyond
+    cache_dir       - optional on-disk store, one <key>.npz per voice, shared across processes & restarts
+    trim_silence    - remove silences over 1s as preprocess_ref_audio_orig, off to keep timings e.g. for speech edit
+    clip_ms         - clip the (trimmed) reference to its first clip_ms, None for no clipping
+    '''
+    def __init__(self, max_size = 32, cache_dir = None, trim_silence = True, clip_ms = 15000, target_rms = 0.1):
+        self.pool = ModelPool(max_size = max_size)
+        self.cache_dir = cache_dir
+        self.trim_silence = trim_silence
+        self.clip_ms = clip_ms
+        self.target_rms = target_rms
+
+    def params(self):
+        return dict(trim_silence = self.trim_silence, clip_ms = self.clip_ms, target_rms = self.target_rms,
+                    target_sample_rate = target_sample_rate, n_mel_channels = n_mel_channels, hop_length = hop_length)
+
+    def key(self, ref_audio_orig):
+        # path -> (file bytes, key), (audio, sr) in memory -> (None, key)
+        digest = hashlib.sha256(json.dumps(self.params(), sort_keys = True).encode())
+        if isinstance(ref_audio_orig, (tuple, list)):
+            audio, sr = ref_audio_orig
+            audio = np.ascontiguousarray(np.asarray(audio, dtype = np.float32))
+            digest.update(f"{audio.shape} {sr}".encode())
+            digest.update(audio.tobytes())
+            return None, digest.hexdigest()
+        with open(ref_audio_orig, "rb") as f:
+            data = f.read()
+        digest.update(data)
+        return data, digest.hexdigest()
+
+    def decode(self, ref_audio_orig, data):
+        # file bytes already read for hashing are decoded from memory
+        if data is not None:
+            ref_audio_orig = torchaudio.load(io.BytesIO(data))
+        return preprocess_ref_audio_orig(ref_audio_orig, clip_ms = self.clip_ms, trim_silence = self.trim_silence)
+
+    def get(self, ref_audio_orig, get_asr = None):
+        '''
+        ref_audio_orig  - path, or (audio [c nw] | [nw], sr) in memory
+        get_asr         - returns the whisper pipeline, called only if the reference is not transcribed yet, None if ref_text is given
+        return RefVoice, from memory, else disk, else decoded & preprocessed
+        '''
+        data, key = self.key(ref_audio_orig)
+        path = os.path.join(self.cache_dir, f"{key}.npz") if self.cache_dir is not None else None
+
+        def load():
+            if path is not None and os.path.exists(path):
+                return RefVoice.load(path)
+            ref_audio, clipped = self.decode(ref_audio_orig, data)
+            voice = RefVoice.from_audio(ref_audio, target_rms = self.target_rms, clipped = clipped, path = path)
+            if get_asr is not None:
+                voice.transcript = transcribe(get_asr(), ref_audio)
+            if path is not None:
+                os.makedirs(self.cache_dir, exist_ok = True)
+                voice.save()
+            return voice
+
+        voice = self.pool.get(key, load)
+        if get_asr is not None and voice.transcript is None:
+            # cached from a request with given ref_text, decoded again once for transcription
+            with voice.lock:
+                if voice.transcript is None:  # transcribed by a concurrent request meanwhile
+                    ref_audio, _ = self.decode(ref_audio_orig, data)
+                    voice.transcript = transcribe(get_asr(), ref_audio)
+                    voice.save()
+        return voice
+
+    def clear(self):
+        self.pool.evict()
+
+
+# long-form synthesis, all chunks of one reference voice in length-bucketed batches
+
+def infer_batch_process(
+    ref_audio,
+    ref_text,
+    gen_text_batches,
+    model,
+    vocoder,
+    *,
+    cross_fade_duration = 0.15,
+    cross_fade_curve = "linear",
+    nfe_step = 32,
+    cfg_strength = 2.,
+    sway_sampling_coef = -1.,
+    speed = 1.,
+    target_rms = 0.1,
+    max_batch_size = 8,
+    max_batch_frames = 32768,
+    decode_queue_depth = 0,
+    progress = tqdm,
+    device = device,
+    **sample_kwargs,
+):
+    '''
+    ref_audio           - (audio [c nw], sr), or RefVoice e.g. from VoiceCache
+    gen_text_batches    - text chunks from chunk_text(), in order
+    max_batch_size      - max chunks per sample() call, 1 for sequential per chunk inference
+    max_batch_frames    - max padded frames per sample() call
+    cross_fade_curve    - "linear" | "equal_power"
+    decode_queue_depth  - sampled buckets waiting for vocoder decode while next bucket is sampled, 0 for no pipelining
+    progress            - wraps the iterable of buckets, e.g. tqdm or gradio progress.tqdm
+    sample_kwargs       - passed to CFM.sample, e.g. batched_cfg, lean_ode, block_cache_*
+    return (final_wave np.float32, combined_spectrogram [d n]), chunks in order and cross-faded
+    '''
+    voice = ref_audio if isinstance(ref_audio, RefVoice) else RefVoice.from_audio(ref_audio, target_rms = target_rms)
+    assert voice.target_rms == target_rms, f"voice prepared with target_rms {voice.target_rms}, but received {target_rms}"
+    cond, rms = voice.mel.to(device), voice.rms
+    ref_audio_len = voice.audio_len // hop_length
+    final_text_list, durations = prepare_chunk_texts(ref_audio_len, ref_text, gen_text_batches, speed = speed,
+                                                   tokenize_ref_text = voice.text_tokens, cond_len = cond.shape[1])
+
+    # progress wraps the consumer side, on the caller thread, gradio's progress.tqdm tracks the request through its contextvars
+    buckets = list(bucket_by_length(durations, max_batch_size, max_batch_frames))
+
+    def sample_buckets():
+        for bucket in buckets:
+            yield bucket, sample_mels(
+                model, cond, ref_audio_len, [final_text_list[i] for i in bucket], [durations[i] for i in bucket], device = device,
+                steps = nfe_step, cfg_strength = cfg_strength, sway_sampling_coef = sway_sampling_coef, **sample_kwargs,
+            )
+
+    # each chunk cross-faded into place as soon as decoded
+    assembler = AudioAssembler([(duration - ref_audio_len) * hop_length for duration in durations], cross_fade_duration, curve = cross_fade_curve)
+    spectrograms = [None] * len(gen_text_batches)
+
+    sampled = pipelined(sample_buckets(), decode_queue_depth)
+    try:
+        for _ in progress(buckets):
+            bucket, (generated_mel_spec, gen_lens) = next(sampled)
+            outputs = decode_mels(vocoder, generated_mel_spec, gen_lens, rms, target_rms = target_rms)
+            for i, (wave, mel) in zip(bucket, outputs):
+                assembler.add(i, wave)
+                spectrograms[i] = mel
+    finally:
+        sampled.close()  # joins the producer thread
+
+    final_wave = assembler.result()
+
+    # Create a combined spectrogram
+    combined_spectrogram = np.concatenate(spectrograms, axis = 1)
+
+    return final_wave, combined_spectrogram
+
+
+# long-form synthesis as a generator, in text order, yielding cross-faded audio as soon as each chunk is decoded
+
+def infer_stream_process(
+    ref_audio,
+    ref_text,
+    gen_text_batches,
+    model,
+    vocoder,
+    *,
+    cross_fade_duration = 0.15,
+    cross_fade_curve = "linear",
+    nfe_step = 32,
+    cfg_strength = 2.,
+    sway_sampling_coef = -1.,
+    speed = 1.,
+    target_rms = 0.1,
+    max_batch_size = 1,
+    decode_queue_depth = 0,
+    device = device,
+    **sample_kwargs,
+):
+    '''
+    max_batch_size      - consecutive chunks per sample() call, 1 for lowest time to first audio
+    decode_queue_depth  - sampled chunks waiting for vocoder decode while next chunk is sampled, 0 for no pipelining
+    yield (wave block np.float32 [nw], mel [d n] of the chunk just finished or None at the final flush)
+    concatenated blocks are the same as final_wave of infer_batch_process() with max_batch_size 1
+    '''
+    voice = ref_audio if isinstance(ref_audio, RefVoice) else RefVoice.from_audio(ref_audio, target_rms = target_rms)
+    assert voice.target_rms == target_rms, f"voice prepared with target_rms {voice.target_rms}, but received {target_rms}"
+    cond, rms = voice.mel.to(device), voice.rms
+    ref_audio_len = voice.audio_len // hop_length
+    final_text_list, durations = prepare_chunk_texts(ref_audio_len, ref_text, gen_text_batches, speed = speed,
+                                                   tokenize_ref_text = voice.text_tokens, cond_len = cond.shape[1])
+
+    def sample_in_order():
+        for start in range(0, len(gen_text_batches), max_batch_size):
+            end = start + max_batch_size
+            yield sample_mels(
+                model, cond, ref_audio_len, final_text_list[start:end], durations[start:end], device = device,
+                steps = nfe_step, cfg_strength = cfg_strength, sway_sampling_coef = sway_sampling_coef, **sample_kwargs,
+            )
+
+    # sampling in worker thread, decode & cross-fade here, so blocks are yielded on the caller thread right away
+    assembler = AudioAssembler([(duration - ref_audio_len) * hop_length for duration in durations], cross_fade_duration, curve = cross_fade_curve)
+    i = 0
+    for generated_mel_spec, gen_lens in pipelined(sample_in_order(), decode_queue_depth):
+        for wave, mel in decode_mels(vocoder, generated_mel_spec, gen_lens, rms, target_rms = target_rms):
+            assembler.add(i, wave)
+            i += 1
+            yield assembler.ready(), mel
+
+    yield assembler.ready(), None
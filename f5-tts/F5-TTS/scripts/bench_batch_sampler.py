@@ -0,0 +1,145 @@
+# DynamicBatchSampler construction time, previous per index get_frame_len + python sort & greedy loop
+# vs. the vectorized one (one duration array, stable argsort, cumsum cut); checks epoch 0 batches are identical
+# then per-step rank imbalance (share of a step ranks wait on the straggler, by padded frames) for round-robin vs. balanced steps
+# and a resume check: batches of a run resumed mid-epoch through accelerate (prepare, skip_first_batches) vs. an uninterrupted one
+#
+# python scripts/bench_batch_sampler.py                        # synthetic durations, 1M & 4M samples
+# python scripts/bench_batch_sampler.py -d data/Emilia_ZH_EN_pinyin
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import random
+import argparse
+
+import numpy as np
+from torch.utils.data import DataLoader, SequentialSampler
+from accelerate import Accelerator
+
+from model.dataset import DynamicBatchSampler, load_duration_index
+from model.trainer import set_sampler_epoch
+
+
+parser = argparse.ArgumentParser(description="dynamic batch sampler construction benchmark")
+
+parser.add_argument('-d', '--dataset_dir', default=None, help="folder with duration.npy or duration.json, synthetic durations if not given")
+parser.add_argument('-n', '--num_samples', default=[1_000_000, 4_000_000], type=int, nargs='+', help="synthetic dataset sizes")
+parser.add_argument('-f', '--frames_threshold', default=38400, type=int)
+parser.add_argument('-m', '--max_samples', default=64, type=int)
+parser.add_argument('-s', '--seed', default=666, type=int)
+parser.add_argument('-g', '--gpus', default=[2, 8], type=int, nargs='+', help="ranks for the imbalance comparison")
+parser.add_argument('-e', '--epochs', default=3, type=int, help="epochs of the resume check")
+
+args = parser.parse_args()
+
+target_sample_rate, hop_length = 24000, 256
+
+
+class Durations:
+    # the part of CustomDataset the sampler reads
+    def __init__(self, durations):
+        self.durations = durations
+
+    def __len__(self):
+        return len(self.durations)
+
+    def get_frame_len(self, index):
+        return self.durations[index] * target_sample_rate / hop_length
+
+    def get_frame_lens(self):
+        return np.asarray(self.durations, dtype = np.float64) * target_sample_rate / hop_length
+
+
+def previous(dataset):
+    # as DynamicBatchSampler.__init__ before
+    indices, batches = [], []
+    for idx in SequentialSampler(dataset):
+        indices.append((idx, dataset.get_frame_len(idx)))
+    indices.sort(key=lambda elem : elem[1])
+
+    batch, batch_frames = [], 0
+    for idx, frame_len in indices:
+        if batch_frames + frame_len <= args.frames_threshold and (args.max_samples == 0 or len(batch) < args.max_samples):
+            batch.append(idx)
+            batch_frames += frame_len
+        else:
+            if len(batch) > 0:
+                batches.append(batch)
+            if frame_len <= args.frames_threshold:
+                batch = [idx]
+                batch_frames = frame_len
+            else:
+                batch = []
+                batch_frames = 0
+    if len(batch) > 0:
+        batches.append(batch)
+
+    random.seed(args.seed)
+    random.shuffle(batches)
+    return batches
+
+
+if args.dataset_dir is not None:
+    datasets = {args.dataset_dir: load_duration_index(args.dataset_dir)[0]}
+else:
+    rng = np.random.default_rng(0)
+    datasets = {f"synthetic {n}": rng.uniform(0.3, 30, n).round(2).tolist() for n in args.num_samples}
+
+print(f"frames threshold {args.frames_threshold}, max samples {args.max_samples}\n")
+print(f"{'dataset':>24} | {'samples':>9} | {'batches':>8} | {'previous (s)':>12} | {'vectorized (s)':>14} | {'speedup':>7} | {'epoch 0':>9}")
+for name, durations in datasets.items():
+    dataset = Durations(durations)
+
+    start = time.perf_counter()
+    old_batches = previous(dataset)
+    t_previous = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sampler = DynamicBatchSampler(SequentialSampler(dataset), args.frames_threshold, max_samples = args.max_samples, random_seed = args.seed)
+    t_vectorized = time.perf_counter() - start
+
+    same = "identical" if list(sampler) == old_batches else "DIFFERENT"
+    print(f"{name[-24:]:>24} | {len(dataset):>9} | {len(sampler):>8} | {t_previous:>12.2f} | {t_vectorized:>14.2f} | "
+          f"{t_previous / t_vectorized:>6.1f}x | {same:>9}")
+
+print(f"\n{'dataset':>24} | {'gpus':>4} | {'round-robin mean / p99':>22} | {'balanced mean / p99':>19}")
+for name, durations in datasets.items():
+    frame_lens = Durations(durations).get_frame_lens()
+    for gpus in args.gpus:
+        imbalance = []
+        for balance_ranks in (False, True):
+            sampler = DynamicBatchSampler(SequentialSampler(frame_lens), args.frames_threshold, max_samples = args.max_samples, random_seed = args.seed,
+                                          frame_lens = frame_lens, num_replicas = gpus, balance_ranks = balance_ranks)
+            imbalance.append(sampler.step_imbalance())
+        print(f"{name[-24:]:>24} | {gpus:>4} | {imbalance[0].mean():>14.3f} / {np.percentile(imbalance[0], 99):.3f} | {imbalance[1].mean():>11.3f} / {np.percentile(imbalance[1], 99):.3f}")
+
+
+def run(frame_lens, start_step, set_epoch):
+    # Trainer.train loop over a freshly prepared dataloader, resumed at start_step with resumable_with_seed
+    accelerator = Accelerator(cpu = True)
+    batch_sampler = DynamicBatchSampler(SequentialSampler(frame_lens), args.frames_threshold, max_samples = args.max_samples, random_seed = args.seed,
+                                        frame_lens = frame_lens)
+    train_dataloader = accelerator.prepare(DataLoader(np.arange(len(frame_lens)), batch_sampler = batch_sampler))
+    orig_epoch_step = len(train_dataloader)
+    skipped_epoch, skipped_batch = start_step // orig_epoch_step, start_step % orig_epoch_step
+    skipped_dataloader = accelerator.skip_first_batches(train_dataloader, num_batches = skipped_batch)
+    batches = []
+    for epoch in range(skipped_epoch, args.epochs):
+        dataloader = skipped_dataloader if epoch == skipped_epoch else train_dataloader
+        set_epoch(epoch, batch_sampler, train_dataloader, *([skipped_dataloader] if epoch == skipped_epoch else []))
+        batches.extend(batch.tolist() for batch in dataloader)
+    return batches, orig_epoch_step
+
+
+def previous_set_epoch(epoch, batch_sampler, *dataloaders):
+    batch_sampler.set_epoch(epoch)  # as Trainer.train before, overridden by the prepared dataloader's own iteration count
+
+
+frame_lens = np.random.default_rng(1).uniform(0.3, 30, 20000) * target_sample_rate / hop_length
+full, epoch_step = run(frame_lens, 0, set_sampler_epoch)
+print(f"\nresume check, {args.epochs} epochs of {epoch_step} batches, seed {args.seed}, batches from the resume step on vs. uninterrupted run")
+print(f"{'resumed at step':>15} | {'previous':>9} | {'fixed':>9}")
+for start_step in (epoch_step // 2, epoch_step + epoch_step // 3, 2 * epoch_step):
+    same = ["identical" if run(frame_lens, start_step, set_epoch)[0] == full[start_step:] else "DIFFERENT" for set_epoch in (previous_set_epoch, set_sampler_epoch)]
+    print(f"{start_step:>15} | {same[0]:>9} | {same[1]:>9}")
@@ -0,0 +1,82 @@
+# Real-time factor of CFM.sample with DiT block caching, against the number of full refreshes
+# (flow evaluations running all blocks, the rest recompute shallow blocks only and reuse the deep blocks residual)
+# deviation is mean abs diff of sampled mel to the uncached run with same noise
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+
+import torch
+
+from model import CFM, DiT
+from model.utils import load_checkpoint
+
+
+parser = argparse.ArgumentParser(description="dit block cache benchmark")
+
+parser.add_argument('-c', '--ckpt', default=None, help="F5TTS_Base checkpoint, random init if not given")
+parser.add_argument('-k', '--shallow', default=[4, 8], type=int, nargs='+', help="shallow blocks recomputed at every step")
+parser.add_argument('-r', '--refresh', default=[1, 2, 3, 4, 8], type=int, nargs='+', help="full refresh intervals, 1 is no cache")
+parser.add_argument('-st', '--start', default=0., type=float, help="always full pass below this t")
+parser.add_argument('-s', '--seconds', default=10, type=float, help="total duration, prompt included")
+parser.add_argument('-nfe', '--nfestep', default=32, type=int)
+parser.add_argument('-d', '--device', default="cuda" if torch.cuda.is_available() else "cpu")
+parser.add_argument('-t', '--threads', default=None, type=int)
+
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+target_sample_rate = 24000
+n_mel_channels = 100
+hop_length = 256
+vocab_size = 2545
+
+model = CFM(
+    transformer = DiT(dim = 1024, depth = 22, heads = 16, ff_mult = 2, text_dim = 512, conv_layers = 4, text_num_embeds = vocab_size, mel_dim = n_mel_channels),
+).to(args.device)
+if args.ckpt is not None:
+    model = load_checkpoint(model, args.ckpt, args.device, use_ema = True)
+
+frames = int(args.seconds * target_sample_rate / hop_length)
+gen_seconds = (frames - frames // 3) * hop_length / target_sample_rate
+torch.manual_seed(0)
+cond = torch.randn(1, frames // 3, n_mel_channels, device = args.device)
+text = torch.randint(0, vocab_size, (1, frames // 4), device = args.device)
+
+refreshes = 0
+def count_refreshes(module, args, kwargs):
+    global refreshes
+    refreshes += kwargs['block_cache']['refresh'] if 'block_cache' in kwargs else 1
+model.transformer.register_forward_pre_hook(count_refreshes, with_kwargs = True)
+
+
+def run(shallow, refresh):
+    global refreshes
+    refreshes = 0
+    if args.device.startswith("cuda"):
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    with torch.inference_mode():
+        out, _ = model.sample(cond = cond, text = text, duration = frames, steps = args.nfestep, cfg_strength = 2., sway_sampling_coef = -1.,
+                              seed = 0, batched_cfg = True, lean_ode = True,
+                              block_cache_shallow = shallow, block_cache_refresh = refresh, block_cache_start = args.start)
+    if args.device.startswith("cuda"):
+        torch.cuda.synchronize()
+    return out, time.perf_counter() - start, refreshes
+
+
+run(0, 1)  # warmup
+ref, elapsed, total = run(0, 1)
+
+print(f"F5TTS_Base{'' if args.ckpt else ' (random init)'} on {args.device}, {args.seconds}s ({gen_seconds:.2f}s generated), "
+      f"{args.nfestep} nfe, batched cfg, start {args.start}\n")
+print(f"{'shallow':>7} | {'refresh':>7} | {'full refreshes':>14} | {'time (s)':>8} | {'RTF':>6} | {'speedup':>7} | {'mel deviation':>13}")
+print(f"{'-':>7} | {'-':>7} | {total:>9} / {total} | {elapsed:>8.2f} | {elapsed / gen_seconds:>6.3f} | {1:>6.2f}x | {0:>13.2e}")
+for shallow in args.shallow:
+    for refresh in args.refresh:
+        out, t, n = run(shallow, refresh)
+        print(f"{shallow:>7} | {refresh:>7} | {n:>9} / {total} | {t:>8.2f} | {t / gen_seconds:>6.3f} | {elapsed / t:>6.2f}x | {(out - ref).abs().mean().item():>13.2e}")
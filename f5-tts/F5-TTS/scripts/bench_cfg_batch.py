@@ -0,0 +1,76 @@
+# CPU benchmark of classifier-free guidance per ODE step:
+# two sequential transformer forwards (cond & null) vs. one forward with both branches stacked along batch
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+
+import torch
+
+from model import CFM, UNetT, DiT, MMDiT
+
+
+parser = argparse.ArgumentParser(description="batched cfg benchmark")
+
+parser.add_argument('-n', '--expname', default="F5TTS_Base", choices=["F5TTS_Base", "E2TTS_Base", "MMDiT"])
+parser.add_argument('-b', '--batch_sizes', default=[1, 2, 4, 8], type=int, nargs='+')
+parser.add_argument('-f', '--frames', default=512, type=int, help="mel frames per sample, ~5.5s at 24khz with hop 256")
+parser.add_argument('-r', '--repeats', default=3, type=int)
+parser.add_argument('-t', '--threads', default=None, type=int)
+
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+n_mel_channels = 100
+vocab_size = 2545
+cfg_strength = 2.
+
+if args.expname == "F5TTS_Base":
+    transformer = DiT(dim = 1024, depth = 22, heads = 16, ff_mult = 2, text_dim = 512, conv_layers = 4, text_num_embeds = vocab_size, mel_dim = n_mel_channels)
+elif args.expname == "E2TTS_Base":
+    transformer = UNetT(dim = 1024, depth = 24, heads = 16, ff_mult = 4, text_num_embeds = vocab_size, mel_dim = n_mel_channels)
+elif args.expname == "MMDiT":
+    transformer = MMDiT(dim = 512, depth = 16, heads = 16, ff_mult = 2, text_num_embeds = vocab_size, mel_dim = n_mel_channels)
+
+model = CFM(transformer = transformer).eval()
+
+
+def cfg_step(x, cond, text, t, mask, batched):
+    if batched:
+        pred_cfg = model.transformer(x = x, cond = cond, text = text, time = t, mask = mask, drop_audio_cond = False, drop_text = False, cfg_infer = True)
+        pred, null_pred = torch.chunk(pred_cfg, 2, dim = 0)
+    else:
+        pred = model.transformer(x = x, cond = cond, text = text, time = t, mask = mask, drop_audio_cond = False, drop_text = False)
+        null_pred = model.transformer(x = x, cond = cond, text = text, time = t, mask = mask, drop_audio_cond = True, drop_text = True)
+    return pred + (pred - null_pred) * cfg_strength
+
+
+def timed(fn):
+    fn()  # warmup
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        fn()
+    return (time.perf_counter() - start) / args.repeats
+
+
+print(f"{args.expname}, {args.frames} frames, {torch.get_num_threads()} threads\n")
+print(f"{'batch':>5} | {'sequential (s/step)':>19} | {'batched (s/step)':>16} | {'speedup':>7} | {'max abs diff':>12}")
+
+torch.manual_seed(0)
+with torch.inference_mode():
+    for batch in args.batch_sizes:
+        x = torch.randn(batch, args.frames, n_mel_channels)
+        cond = torch.randn(batch, args.frames, n_mel_channels)
+        text = torch.randint(0, vocab_size, (batch, args.frames // 4))
+        t = torch.tensor(0.5)
+        mask = torch.ones(batch, args.frames, dtype = torch.bool) if batch > 1 else None  # as CFM.sample
+
+        diff = (cfg_step(x, cond, text, t, mask, False) - cfg_step(x, cond, text, t, mask, True)).abs().max().item()
+        t_seq = timed(lambda: cfg_step(x, cond, text, t, mask, False))
+        t_bat = timed(lambda: cfg_step(x, cond, text, t, mask, True))
+
+        print(f"{batch:>5} | {t_seq:>19.4f} | {t_bat:>16.4f} | {t_seq / t_bat:>6.2f}x | {diff:>12.2e}")
@@ -0,0 +1,68 @@
+# Host side collate time at frame-wise batches (default 38400 frames, max 64 samples as in train.py),
+# previous F.pad per mel + torch.stack (two copies) vs. collate_fn (one preallocated [b d max_len] tensor, optionally pinned)
+# batches from DynamicBatchSampler over synthetic Emilia-like durations, mels float32 (raw path) or float16 (mel store)
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import SequentialSampler
+
+from model.dataset import DynamicBatchSampler, collate_fn
+
+
+parser = argparse.ArgumentParser(description="collate benchmark")
+
+parser.add_argument('-f', '--frames_threshold', default=38400, type=int)
+parser.add_argument('-m', '--max_samples', default=64, type=int)
+parser.add_argument('-n', '--num_batches', default=50, type=int)
+parser.add_argument('--n_mel_channels', default=100, type=int)
+
+args = parser.parse_args()
+
+
+def previous(batch):
+    # as collate_fn before
+    mel_specs = [item['mel_spec'].squeeze(0) for item in batch]
+    mel_lengths = torch.LongTensor([spec.shape[-1] for spec in mel_specs])
+    max_mel_length = mel_lengths.amax()
+    padded_mel_specs = []
+    for spec in mel_specs:
+        padding = (0, max_mel_length - spec.size(-1))
+        padded_spec = F.pad(spec, padding, value = 0)
+        padded_mel_specs.append(padded_spec)
+    mel_specs = torch.stack(padded_mel_specs).float()
+    text = [item['text'] for item in batch]
+    text_lengths = torch.LongTensor([len(item) for item in text])
+    return dict(mel = mel_specs, mel_lengths = mel_lengths, text = text, text_lengths = text_lengths)
+
+
+def timed(fn, batches):
+    for batch in batches[:2]:
+        fn(batch)  # warmup
+    start = time.perf_counter()
+    for batch in batches:
+        fn(batch)
+    return (time.perf_counter() - start) / len(batches) * 1000
+
+
+rng = np.random.default_rng(0)
+frame_lens = np.floor(rng.uniform(2, 15, 100_000) * 24000 / 256)
+sampler = DynamicBatchSampler(SequentialSampler(frame_lens), args.frames_threshold, max_samples = args.max_samples, random_seed = 0, frame_lens = frame_lens)
+index_batches = list(sampler)[:args.num_batches]
+efficiency = np.mean([frame_lens[b].sum() / (len(b) * frame_lens[b].max()) for b in index_batches])
+print(f"{len(index_batches)} batches of up to {args.frames_threshold} frames / {args.max_samples} samples, "
+      f"mean {np.mean([len(b) for b in index_batches]):.1f} samples, padding efficiency {efficiency:.3f}\n")
+
+print(f"{'mel dtype':>9} | {'previous (ms)':>13} | {'collate (ms)':>12} | {'speedup':>7} | {'pinned (ms)':>11}")
+for dtype in (torch.float32, torch.float16):
+    batches = [[dict(mel_spec = torch.randn(args.n_mel_channels, int(frame_lens[i])).to(dtype), text = "some text") for i in b] for b in index_batches]
+    t_previous = timed(previous, batches)
+    t_collate = timed(collate_fn, batches)
+    t_pinned = timed(lambda batch: collate_fn(batch, pin_memory = True), batches) if torch.cuda.is_available() else float("nan")
+    print(f"{str(dtype).split('.')[-1]:>9} | {t_previous:>13.2f} | {t_collate:>12.2f} | {t_previous / t_collate:>6.2f}x | {t_pinned:>11.2f}")
@@ -0,0 +1,89 @@
+# Per ODE step FLOPs & CPU latency of the transformer, with and without the step-invariant conditioning cache
+# (text embed with convnextv2 blocks & cond/text share of the input proj precomputed once by prepare_cond)
+# and with the time embed & adaln modulation table of the whole schedule (precomputed once by prepare_time)
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+
+import torch
+from torch.utils.flop_counter import FlopCounterMode
+
+from model import UNetT, DiT
+
+
+parser = argparse.ArgumentParser(description="conditioning cache benchmark")
+
+parser.add_argument('-n', '--expname', default="F5TTS_Base", choices=["F5TTS_Base", "E2TTS_Base"])
+parser.add_argument('-f', '--frames', default=512, type=int, help="mel frames per sample")
+parser.add_argument('-nt', '--text_len', default=128, type=int)
+parser.add_argument('-nfe', '--nfestep', default=32, type=int)
+parser.add_argument('-r', '--repeats', default=3, type=int)
+parser.add_argument('-t', '--threads', default=None, type=int)
+
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+n_mel_channels = 100
+vocab_size = 2545
+
+if args.expname == "F5TTS_Base":
+    transformer = DiT(dim = 1024, depth = 22, heads = 16, ff_mult = 2, text_dim = 512, conv_layers = 4, text_num_embeds = vocab_size, mel_dim = n_mel_channels)
+elif args.expname == "E2TTS_Base":
+    transformer = UNetT(dim = 1024, depth = 24, heads = 16, ff_mult = 4, text_num_embeds = vocab_size, mel_dim = n_mel_channels)
+transformer.eval()
+
+
+def count_flops(fn):
+    with FlopCounterMode(display = False) as counter:
+        fn()
+    return counter.get_total_flops()
+
+
+def timed(fn):
+    fn()  # warmup
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        fn()
+    return (time.perf_counter() - start) / args.repeats
+
+
+torch.manual_seed(0)
+x = torch.randn(1, args.frames, n_mel_channels)
+cond = torch.randn(1, args.frames, n_mel_channels)
+text = torch.randint(0, vocab_size, (1, args.text_len))
+
+with torch.inference_mode():
+    prepare = lambda: torch.cat((
+        transformer.prepare_cond(cond, text, drop_audio_cond = False, drop_text = False),
+        transformer.prepare_cond(cond, text, drop_audio_cond = True, drop_text = True),
+    ), dim = 0)
+    cfg_embed = prepare()
+
+    time_table = transformer.prepare_time(torch.linspace(0, 1, args.nfestep + 1)[:-1])
+    t = time_table['time'][args.nfestep // 2]
+
+    step = lambda: transformer(x = x, cond = cond, text = text, time = t, drop_audio_cond = False, drop_text = False, cfg_infer = True)
+    step_cached = lambda: transformer(x = x, cond = cond, text = text, time = t, drop_audio_cond = False, drop_text = False, cfg_infer = True, cond_embed = cfg_embed)
+    step_tabled = lambda: transformer(x = x, cond = cond, text = text, time = t, drop_audio_cond = False, drop_text = False, cfg_infer = True, cond_embed = cfg_embed, time_table = time_table)
+    prepare_time = lambda: transformer.prepare_time(torch.linspace(0, 1, args.nfestep + 1)[:-1])
+
+    diff = (step() - step_tabled()).abs().max().item()
+    flops, flops_cached, flops_tabled = count_flops(step), count_flops(step_cached), count_flops(step_tabled)
+    flops_prepare, flops_prepare_time = count_flops(prepare), count_flops(prepare_time)
+    latency, latency_cached, latency_tabled = timed(step), timed(step_cached), timed(step_tabled)
+    latency_prepare, latency_prepare_time = timed(prepare), timed(prepare_time)
+
+print(f"{args.expname}, {args.frames} frames, {args.text_len} text tokens, batched cfg, {torch.get_num_threads()} threads\n")
+print(f"{'':>16} | {'GFLOPs/step':>11} | {'latency (s/step)':>16}")
+print(f"{'no cache':>16} | {flops / 1e9:>11.2f} | {latency:>16.4f}")
+print(f"{'cond cache':>16} | {flops_cached / 1e9:>11.2f} | {latency_cached:>16.4f}")
+print(f"{'+ time table':>16} | {flops_tabled / 1e9:>11.2f} | {latency_tabled:>16.4f}")
+print(f"{'prepare_cond':>16} | {flops_prepare / 1e9:>11.2f} | {latency_prepare:>16.4f}  (once)")
+print(f"{'prepare_time':>16} | {flops_prepare_time / 1e9:>11.2f} | {latency_prepare_time:>16.4f}  (once, {args.nfestep} nfe)")
+print(f"\nsaved per step: {(flops - flops_tabled) / 1e9:.2f} GFLOPs ({(1 - flops_tabled / flops) * 100:.1f}%), "
+      f"{(latency - latency_tabled) * 1e3:.1f} ms; max abs diff {diff:.2e}")
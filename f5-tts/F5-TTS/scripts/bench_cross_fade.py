@@ -0,0 +1,79 @@
+# Micro-benchmark of cross-fade assembly of many chunk waves:
+# previous per chunk np.concatenate of the whole output (quadratic) vs. AudioAssembler writing into one preallocated buffer,
+# all at once (cross_fade) and incrementally as streaming does (add() per decoded chunk, ready() block after each)
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+
+import numpy as np
+
+from model.utils_infer import AudioAssembler, cross_fade
+
+
+parser = argparse.ArgumentParser(description="cross-fade assembly benchmark")
+
+parser.add_argument('-k', '--chunks', default=[100, 200, 400], type=int, nargs='+')
+parser.add_argument('-s', '--seconds', default=8, type=float, help="mean chunk duration")
+parser.add_argument('-cf', '--cross_fade_duration', default=0.15, type=float)
+parser.add_argument('-r', '--repeats', default=3, type=int)
+
+args = parser.parse_args()
+
+sample_rate = 24000
+
+
+def cross_fade_concat(waves, cross_fade_duration):
+    # as previously in infer_batch, whole output re-concatenated & fade curves rebuilt per chunk
+    final_wave = waves[0]
+    for i in range(1, len(waves)):
+        prev_wave = final_wave
+        next_wave = waves[i]
+        cross_fade_samples = min(int(cross_fade_duration * sample_rate), len(prev_wave), len(next_wave))
+        if cross_fade_samples <= 0:
+            final_wave = np.concatenate([prev_wave, next_wave])
+            continue
+        fade_out = np.linspace(1, 0, cross_fade_samples)
+        fade_in = np.linspace(0, 1, cross_fade_samples)
+        cross_faded_overlap = prev_wave[-cross_fade_samples:] * fade_out + next_wave[:cross_fade_samples] * fade_in
+        final_wave = np.concatenate([prev_wave[:-cross_fade_samples], cross_faded_overlap, next_wave[cross_fade_samples:]])
+    return final_wave
+
+
+def incremental(waves, cross_fade_duration):
+    # as infer_stream_process, blocks handed out as soon as final
+    assembler = AudioAssembler([len(wave) for wave in waves], cross_fade_duration)
+    blocks = []
+    for i, wave in enumerate(waves):
+        assembler.add(i, wave)
+        blocks.append(assembler.ready())
+    blocks.append(assembler.ready())
+    return np.concatenate(blocks)
+
+
+def timed(fn):
+    fn()  # warmup
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        out = fn()
+    return (time.perf_counter() - start) / args.repeats, out
+
+
+rng = np.random.default_rng(0)
+
+print(f"mean chunk {args.seconds}s at {sample_rate}hz, cross-fade {args.cross_fade_duration}s\n")
+print(f"{'chunks':>6} | {'audio (min)':>11} | {'concat (s)':>10} | {'assembler (s)':>13} | {'incremental (s)':>15} | {'equal power (s)':>15} | {'speedup':>7} | {'max abs diff':>12}")
+for num_chunks in args.chunks:
+    lengths = rng.integers(int(args.seconds * sample_rate * 0.5), int(args.seconds * sample_rate * 1.5), num_chunks)
+    waves = [rng.uniform(-0.5, 0.5, length).astype(np.float32) for length in lengths]
+
+    t_concat, ref = timed(lambda: cross_fade_concat(waves, args.cross_fade_duration))
+    t_assembler, out = timed(lambda: cross_fade(waves, args.cross_fade_duration))
+    t_incremental, streamed = timed(lambda: incremental(waves, args.cross_fade_duration))
+    t_equal_power, _ = timed(lambda: cross_fade(waves, args.cross_fade_duration, curve = "equal_power"))
+
+    diff = max(np.abs(ref - out).max(), np.abs(ref - streamed).max())
+    print(f"{num_chunks:>6} | {len(out) / sample_rate / 60:>11.1f} | {t_concat:>10.3f} | {t_assembler:>13.3f} | {t_incremental:>15.3f} | {t_equal_power:>15.3f} | "
+          f"{t_concat / t_assembler:>6.1f}x | {diff:>12.2e}")
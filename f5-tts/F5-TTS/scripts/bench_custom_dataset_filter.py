@@ -0,0 +1,83 @@
+# Dataloader epoch time of CustomDataset, previous skip-on-read (decode, check duration, retry index + 1)
+# vs. the valid-index map built from the durations at construction (rows out of 0.3-30s never opened)
+# synthetic Emilia-like wavs: mostly 2-15s speech segments, a share of too short clips and of too long ones
+#
+# python scripts/bench_custom_dataset_filter.py -n 512 --short_ratio 0.05 --long_ratio 0.05
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import soundfile as sf
+import torchaudio
+from torch.utils.data import DataLoader
+from datasets import Dataset as Dataset_
+from einops import rearrange
+
+from model.modules import resample
+from model.dataset import CustomDataset, collate_fn
+
+
+parser = argparse.ArgumentParser(description="CustomDataset pre-filtered index benchmark")
+
+parser.add_argument('-n', '--num_clips', default=512, type=int)
+parser.add_argument('--short_ratio', default=0.05, type=float, help="share of clips under 0.3s")
+parser.add_argument('--long_ratio', default=0.05, type=float, help="share of clips of 30-40s")
+parser.add_argument('-sr', '--sample_rate', default=24000, type=int)
+parser.add_argument('-b', '--batch_size', default=16, type=int)
+parser.add_argument('-w', '--num_workers', default=[0, 4], type=int, nargs='+')
+
+args = parser.parse_args()
+
+
+class SkipOnReadDataset(CustomDataset):
+    # as CustomDataset before, every row indexed, rejected rows decoded then skipped
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        row = self.data[index]
+        audio, source_sample_rate = torchaudio.load(row["audio_path"])
+        if row["duration"] > 30 or row["duration"] < 0.3:
+            return self.__getitem__((index + 1) % len(self.data))
+        audio = resample(audio, source_sample_rate, self.target_sample_rate)
+        mel_spec = rearrange(self.mel_spectrogram(audio), '1 d t -> d t')
+        return dict(mel_spec = mel_spec, text = row["text"])
+
+
+def run(dataset, num_workers):
+    loader = DataLoader(dataset, batch_size = args.batch_size, num_workers = num_workers, collate_fn = collate_fn)
+    samples = 0
+    start = time.perf_counter()
+    for batch in loader:
+        samples += len(batch["mel_lengths"])
+    return time.perf_counter() - start, samples
+
+
+rng = np.random.default_rng(0)
+kind = rng.choice(3, size = args.num_clips, p = [1 - args.short_ratio - args.long_ratio, args.short_ratio, args.long_ratio])
+durations = np.where(kind == 0, rng.uniform(2, 15, args.num_clips), np.where(kind == 1, rng.uniform(0.05, 0.3, args.num_clips), rng.uniform(30.5, 40, args.num_clips)))
+
+with tempfile.TemporaryDirectory() as tmp:
+    paths = []
+    for i, duration in enumerate(durations):
+        paths.append(os.path.join(tmp, f"{i}.wav"))
+        sf.write(paths[-1], rng.normal(0, 0.1, int(duration * args.sample_rate)).astype(np.float32), args.sample_rate)
+    durations = [len(sf.read(path)[0]) / args.sample_rate for path in paths]
+    data = Dataset_.from_dict(dict(audio_path = paths, text = ["some text"] * len(paths), duration = durations))
+
+    previous = SkipOnReadDataset(data, durations = durations)
+    filtered = CustomDataset(data, durations = durations)
+    print(f"{len(paths)} clips, {len(paths) - len(filtered)} out of 0.3-30s ({(kind == 1).sum()} short, {(kind == 2).sum()} long), "
+          f"{sum(durations) / 60:.1f} min audio, batch size {args.batch_size}\n")
+
+    print(f"{'workers':>7} | {'skip on read (s)':>16} | {'filtered (s)':>12} | {'saved (s)':>9} | {'saved':>6} | {'samples / epoch':>15}")
+    for num_workers in args.num_workers:
+        t_previous, n_previous = run(previous, num_workers)
+        t_filtered, n_filtered = run(filtered, num_workers)
+        print(f"{num_workers:>7} | {t_previous:>16.2f} | {t_filtered:>12.2f} | {t_previous - t_filtered:>9.2f} | "
+              f"{1 - t_filtered / t_previous:>6.1%} | {f'{n_previous} -> {n_filtered}':>15}")
@@ -0,0 +1,71 @@
+# Dataloader throughput on a mixed sample rate corpus, resampler built per item (as before) vs. cached kernels (get_resampler)
+# synthetic clips at 16k / 22.05k / 24k / 44.1k / 48k, through HFDataset (in memory arrays) or CustomDataset (wav files)
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import soundfile as sf
+from torch.utils.data import DataLoader
+from datasets import Dataset as Dataset_
+
+import model.modules
+from model.modules import get_resampler
+from model.dataset import HFDataset, CustomDataset, collate_fn
+
+
+parser = argparse.ArgumentParser(description="dataloader resampling benchmark")
+
+parser.add_argument('-d', '--dataset', default="HFDataset", help="HFDataset | CustomDataset")
+parser.add_argument('-n', '--num_clips', default=256, type=int)
+parser.add_argument('-sr', '--sample_rates', default=[16000, 22050, 24000, 44100, 48000], type=int, nargs='+')
+parser.add_argument('-s', '--seconds', default=[1, 10], type=float, nargs=2, help="min & max clip duration")
+parser.add_argument('-b', '--batch_size', default=16, type=int)
+parser.add_argument('-w', '--num_workers', default=[0, 4], type=int, nargs='+')
+
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+clips = [(int(rng.choice(args.sample_rates)), rng.uniform(*args.seconds)) for _ in range(args.num_clips)]
+total_seconds = sum(seconds for _, seconds in clips)
+
+
+def make_dataset(tmp):
+    texts = ["some text"] * len(clips)
+    if args.dataset == "HFDataset":
+        rows = [dict(audio = dict(array = rng.normal(0, 0.1, int(sr * seconds)).astype(np.float32), sampling_rate = sr), text = text)
+                for (sr, seconds), text in zip(clips, texts)]
+        return HFDataset(rows)
+    paths = []
+    for i, (sr, seconds) in enumerate(clips):
+        paths.append(os.path.join(tmp, f"{i}.wav"))
+        sf.write(paths[-1], rng.normal(0, 0.1, int(sr * seconds)).astype(np.float32), sr)
+    durations = [seconds for _, seconds in clips]
+    data = Dataset_.from_dict(dict(audio_path = paths, text = texts, duration = durations))
+    return CustomDataset(data, durations = durations)
+
+
+def run(dataset, num_workers):
+    loader = DataLoader(dataset, batch_size = args.batch_size, num_workers = num_workers, collate_fn = collate_fn)
+    start = time.perf_counter()
+    for _ in loader:
+        pass
+    return time.perf_counter() - start
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    dataset = make_dataset(tmp)
+
+    print(f"{args.dataset}, {len(clips)} clips at {args.sample_rates} hz, {total_seconds / 60:.1f} min audio, batch size {args.batch_size}\n")
+    print(f"{'workers':>7} | {'per item (clips/s)':>18} | {'cached (clips/s)':>16} | {'speedup':>7} | {'cached (audio s/s)':>18}")
+    for num_workers in args.num_workers:
+        model.modules.get_resampler = get_resampler.__wrapped__  # kernel rebuilt every call, as before
+        t_fresh = run(dataset, num_workers)
+        model.modules.get_resampler = get_resampler
+        get_resampler.cache_clear()
+        t_cached = run(dataset, num_workers)
+        print(f"{num_workers:>7} | {len(clips) / t_fresh:>18.1f} | {len(clips) / t_cached:>16.1f} | {t_fresh / t_cached:>6.2f}x | {total_seconds / t_cached:>18.1f}")
@@ -0,0 +1,86 @@
+# End-to-end latency of multi-chunk synthesis, with vocoder decode of chunk i inline after its ode solve
+# vs. pipelined with the ode solve of chunk i+1 (decode_queue_depth > 0)
+# reports time to first audio block and total time of infer_stream_process, and total time of infer_batch_process
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+
+import torch
+
+from model import CFM, DiT
+from model.utils import load_checkpoint
+from model.utils_infer import get_cached_tokenizer, get_vocoder, infer_batch_process, infer_stream_process
+
+
+parser = argparse.ArgumentParser(description="vocoder decode pipelining benchmark")
+
+parser.add_argument('-c', '--ckpt', default=None, help="F5TTS_Base checkpoint, random init with dummy tokens if not given")
+parser.add_argument('-v', '--vocoder_local_path', default=None, help="local vocos dir, else from huggingface")
+parser.add_argument('-q', '--queue_depths', default=[0, 1, 2, 4], type=int, nargs='+', help="0 is decode inline")
+parser.add_argument('-k', '--chunks', default=8, type=int)
+parser.add_argument('-r', '--ref_seconds', default=5, type=float)
+parser.add_argument('-nfe', '--nfestep', default=32, type=int)
+parser.add_argument('-b', '--batch_size', default=1, type=int, help="chunks per sample() call")
+parser.add_argument('-d', '--device', default="cuda" if torch.cuda.is_available() else "cpu")
+
+args = parser.parse_args()
+
+target_sample_rate = 24000
+n_mel_channels = 100
+
+if args.ckpt is not None:
+    vocab_char_map, vocab_size = get_cached_tokenizer("Emilia_ZH_EN", "pinyin")
+else:
+    vocab_char_map, vocab_size = dict(), 2545  # every char to token 0, only latency matters
+
+model = CFM(
+    transformer = DiT(dim = 1024, depth = 22, heads = 16, ff_mult = 2, text_dim = 512, conv_layers = 4, text_num_embeds = vocab_size, mel_dim = n_mel_channels),
+    vocab_char_map = vocab_char_map,
+).to(args.device)
+if args.ckpt is not None:
+    model = load_checkpoint(model, args.ckpt, args.device, use_ema = True)
+
+vocos = get_vocoder(args.vocoder_local_path)
+
+torch.manual_seed(0)
+ref_audio = (torch.randn(1, int(args.ref_seconds * target_sample_rate)) * 0.1, target_sample_rate)
+ref_text = "Some call me nature, others call me mother nature. "
+gen_text_batches = [f"Chunk number {i}, I don't really care what you call me, I have been a silent spectator." for i in range(args.chunks)]
+
+kwargs = dict(nfe_step = args.nfestep, max_batch_size = args.batch_size, device = args.device, batched_cfg = True, lean_ode = True)
+
+
+def sync():
+    if args.device.startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def run_stream(depth):
+    sync()
+    start = time.perf_counter()
+    first = None
+    for wave_block, _ in infer_stream_process(ref_audio, ref_text, gen_text_batches, model, vocos, decode_queue_depth = depth, **kwargs):
+        if first is None and len(wave_block):
+            first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+
+def run_batch(depth):
+    sync()
+    start = time.perf_counter()
+    infer_batch_process(ref_audio, ref_text, gen_text_batches, model, vocos, decode_queue_depth = depth, progress = lambda x: x, **kwargs)
+    return time.perf_counter() - start
+
+
+run_stream(0)  # warmup
+
+print(f"F5TTS_Base{'' if args.ckpt else ' (random init)'} on {args.device}, {args.chunks} chunks, {args.batch_size} per sample() call, "
+      f"{args.nfestep} nfe, {torch.get_num_threads()} threads\n")
+print(f"{'queue depth':>11} | {'stream first audio (s)':>22} | {'stream total (s)':>16} | {'batch total (s)':>15}")
+for depth in args.queue_depths:
+    first, total = run_stream(depth)
+    total_batch = run_batch(depth)
+    print(f"{depth if depth > 0 else 'inline':>11} | {first:>22.2f} | {total:>16.2f} | {total_batch:>15.2f}")
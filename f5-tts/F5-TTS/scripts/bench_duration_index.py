@@ -0,0 +1,97 @@
+# Startup time & memory of the duration index, duration.json parsed into python floats vs. memory-mapped duration.npy
+# each format loaded in a fresh process, then forked "dataloader workers" read every duration as get_frame_len would;
+# reading python floats touches their refcounts, so each worker ends up with private copies of the pages, the mmap stays shared
+#
+# python scripts/bench_duration_index.py                       # synthetic, 5M rows
+# python scripts/bench_duration_index.py -d data/Emilia_ZH_EN_pinyin -w 16
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+
+import numpy as np
+
+from model.dataset import save_duration_index
+
+
+parser = argparse.ArgumentParser(description="duration index startup time & memory benchmark")
+
+parser.add_argument('-d', '--dataset_dir', default=None, help="folder with duration.json & duration.npy (scripts/convert_duration_index.py)")
+parser.add_argument('-n', '--num_rows', default=5_000_000, type=int, help="synthetic rows, if no dataset_dir")
+parser.add_argument('-w', '--num_workers', default=4, type=int)
+
+args = parser.parse_args()
+
+
+def memory_kb(field, path="/proc/self/status"):
+    with open(path) as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1])
+
+
+def private_kb():
+    return memory_kb("Private_Dirty:", "/proc/self/smaps_rollup") + memory_kb("Private_Clean:", "/proc/self/smaps_rollup")
+
+
+def worker(durations, queue):
+    # as get_frame_len for every index of an epoch
+    total = 0.
+    for index in range(len(durations)):
+        total += durations[index] * 24000 / 256
+    queue.put(private_kb())
+
+
+def load_json(dataset_dir):
+    # as load_dataset did before
+    with open(f"{dataset_dir}/duration.json", "r", encoding="utf-8") as f:
+        return json.load(f)["duration"]
+
+
+def load_npy(dataset_dir):
+    return np.load(f"{dataset_dir}/duration.npy", mmap_mode="r")  # as load_duration_index
+
+
+def measure(dataset_dir, load, queue):
+    rss_before = memory_kb("VmRSS:")
+    start = time.perf_counter()
+    durations = load(dataset_dir)
+    load_time = time.perf_counter() - start
+    rss_after = memory_kb("VmRSS:")
+
+    ctx = mp.get_context("fork")
+    worker_queue = ctx.Queue()
+    workers = [ctx.Process(target=worker, args=(durations, worker_queue)) for _ in range(args.num_workers)]
+    for p in workers:
+        p.start()
+    worker_private = [worker_queue.get() for _ in workers]
+    for p in workers:
+        p.join()
+    queue.put((load_time, (rss_after - rss_before) / 1024, sum(worker_private) / 1024))
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    dataset_dir = args.dataset_dir
+    if dataset_dir is None:
+        dataset_dir = tmp
+        durations = np.random.default_rng(0).uniform(0.3, 30, args.num_rows).round(3).tolist()
+        with open(f"{tmp}/duration.json", "w", encoding="utf-8") as f:
+            json.dump({"duration": durations}, f, ensure_ascii=False)
+        save_duration_index(tmp, durations)
+        del durations
+
+    num_rows = len(load_npy(dataset_dir))
+    print(f"{dataset_dir}, {num_rows} rows, {args.num_workers} forked workers reading all durations\n")
+    print(f"{'format':>14} | {'load (s)':>8} | {'main rss (MB)':>13} | {'workers private (MB)':>20}")
+    for load, name in ((load_json, "duration.json"), (load_npy, "duration.npy")):
+        queue = mp.get_context("fork").Queue()
+        p = mp.get_context("fork").Process(target=measure, args=(dataset_dir, load, queue))
+        p.start()
+        load_time, main_mb, workers_mb = queue.get()
+        p.join()
+        print(f"{name:>14} | {load_time:>8.2f} | {main_mb:>13.1f} | {workers_mb:>20.1f}")
@@ -0,0 +1,94 @@
+# Pinyin front end throughput in sentences / s, convert_char_to_pinyin (jieba + lazy_pinyin on every call)
+# vs. model.g2p.G2P (LRU caches of clauses & jieba segments, optional process pool); checks the tokens are identical
+# dataset prep: unique rows, converted in process cold, then in a process pool;
+# inference: ref_text + gen_text per chunk, the same reference across chunks & requests as prepare_chunk_texts
+#
+# python scripts/bench_g2p.py                                  # synthetic sentences, words drawn by jieba dict frequency
+# python scripts/bench_g2p.py -t transcripts.txt -w 4 8        # one sentence per line
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import random
+import itertools
+import argparse
+
+import jieba
+
+from model.g2p import G2P
+from model.utils import convert_char_to_pinyin
+
+
+parser = argparse.ArgumentParser(description="pinyin front end throughput benchmark")
+
+parser.add_argument('-t', '--text_file', default=None, type=str, help="one sentence per line, synthetic if not given")
+parser.add_argument('-n', '--num_sentences', default=5000, type=int, help="dataset prep rows")
+parser.add_argument('-w', '--num_workers', default=[2, 4], type=int, nargs='+', help="process pool sizes")
+parser.add_argument('-r', '--requests', default=20, type=int, help="inference requests, each with its own reference text")
+parser.add_argument('-c', '--chunks', default=8, type=int, help="gen text chunks per request")
+
+args = parser.parse_args()
+
+
+def timed(fn, texts):
+    start = time.perf_counter()
+    out = fn(texts)
+    return out, len(texts) / (time.perf_counter() - start)
+
+
+random.seed(0)
+jieba.initialize()
+if args.text_file is not None:
+    with open(args.text_file, "r", encoding="utf-8") as f:
+        sentences = [line.strip() for line in f if line.strip()]
+else:
+    words = [w for w, freq in jieba.dt.FREQ.items() if freq > 0 and all('一' <= c <= '龥' for c in w)]
+    cum_weights = list(itertools.accumulate(jieba.dt.FREQ[w] for w in words))
+    english = ["Hello", "AI", "OK", "iPhone", "GPU", "model", "flow matching"]
+
+    def clause():
+        parts = random.choices(words, cum_weights=cum_weights, k=random.randint(2, 8))
+        if random.random() < 0.1:
+            parts.insert(random.randint(0, len(parts)), random.choice(english))
+        return "".join(parts)
+
+    sentences = ["".join(clause() + random.choice("，，，。？！") for _ in range(random.randint(1, 4))) for _ in range(args.num_sentences + args.requests * (1 + args.chunks))]
+
+rows = sentences[:args.num_sentences]
+print(f"{len(rows)} rows for dataset prep, {args.requests} requests x {args.chunks} chunks for inference, "
+      f"{sum(map(len, rows)) / len(rows):.1f} chars per sentence\n")
+print(f"{'scenario':>34} | {'sentences / s':>13} | {'speedup':>7} | {'tokens':>9}")
+
+reference, base = timed(convert_char_to_pinyin, rows)
+print(f"{'prep, convert_char_to_pinyin':>34} | {base:>13.0f} | {1:>6.1f}x | {'':>9}")
+
+g2p = G2P()
+out, rate = timed(g2p.convert, rows)
+print(f"{'prep, G2P in process (cold)':>34} | {rate:>13.0f} | {rate / base:>6.1f}x | {'identical' if out == reference else 'DIFFERENT':>9}")
+info = g2p.cache_info()
+for num_workers in args.num_workers:
+    with G2P(num_workers=num_workers) as pool_g2p:
+        pool_g2p.convert(rows[:num_workers * 256 + 1], chunksize=256)  # start up & import in the workers
+        out, rate = timed(lambda texts: pool_g2p.convert(texts, chunksize=64), rows)
+    print(f"{f'prep, G2P pool of {num_workers}':>34} | {rate:>13.0f} | {rate / base:>6.1f}x | {'identical' if out == reference else 'DIFFERENT':>9}")
+
+# inference, each chunk of a request prepended with the request's reference text, one call per request
+# (gen texts all different, only the reference repeats; from the end of the text file if shorter than prep + inference)
+ref_texts = sentences[-args.requests:]
+gen_texts = sentences[-args.requests * (1 + args.chunks):-args.requests]
+requests = [[ref_text + " " + gen_text for gen_text in gen_texts[i * args.chunks:(i + 1) * args.chunks]] for i, ref_text in enumerate(ref_texts)]
+
+start = time.perf_counter()
+reference = [convert_char_to_pinyin(chunks) for chunks in requests]
+base = sum(map(len, requests)) / (time.perf_counter() - start)
+print(f"{'inference, convert_char_to_pinyin':>34} | {base:>13.0f} | {1:>6.1f}x | {'':>9}")
+
+g2p = G2P()
+start = time.perf_counter()
+out = [g2p.convert(chunks) for chunks in requests]
+rate = sum(map(len, requests)) / (time.perf_counter() - start)
+print(f"{'inference, G2P':>34} | {rate:>13.0f} | {rate / base:>6.1f}x | {'identical' if out == reference else 'DIFFERENT':>9}")
+
+print(f"\nprep cache: clauses {info['clause'].hits} hits / {info['clause'].misses} misses, "
+      f"segments {info['segment'].hits} hits / {info['segment'].misses} misses")
@@ -0,0 +1,51 @@
+# Dataloader frames/sec of a prepared dataset, raw path (decode + resample + stft per sample)
+# vs. the precomputed float16 mel store of scripts/prepare_mel.py (zero-copy memory-mapped views)
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+
+import torch
+from torch.utils.data import DataLoader, Subset
+
+from model.dataset import load_dataset, collate_fn
+
+
+parser = argparse.ArgumentParser(description="mel store dataloader benchmark")
+
+parser.add_argument('dataset_dir', type=str, help="folder with raw.arrow, duration index & the mel store")
+parser.add_argument('-n', '--num_samples', default=2048, type=int, help="first n rows read")
+parser.add_argument('-b', '--batch_size', default=16, type=int)
+parser.add_argument('-w', '--num_workers', default=[0, 4], type=int, nargs='+')
+
+args = parser.parse_args()
+
+
+def run(dataset, num_workers):
+    subset = Subset(dataset, range(min(args.num_samples, len(dataset))))
+    loader = DataLoader(subset, batch_size = args.batch_size, num_workers = num_workers, collate_fn = collate_fn)
+    frames = 0
+    start = time.perf_counter()
+    for batch in loader:
+        frames += batch["mel_lengths"].sum().item()
+    elapsed = time.perf_counter() - start
+    return frames / elapsed, len(subset) / elapsed
+
+
+raw_dataset = load_dataset(args.dataset_dir, dataset_type = "CustomDatasetPath", audio_type = "raw")
+mel_dataset = load_dataset(args.dataset_dir, dataset_type = "CustomDatasetPath", audio_type = "mel")
+assert mel_dataset.mel_store is not None, f"no mel store in {args.dataset_dir}, run scripts/prepare_mel.py first"
+
+# same features up to float16 rounding
+for index in range(min(4, len(raw_dataset))):
+    raw_mel, store_mel = raw_dataset[index]["mel_spec"], mel_dataset[index]["mel_spec"]
+    assert raw_mel.shape == store_mel.shape and torch.allclose(raw_mel, store_mel.float(), atol = 1e-2), f"row {index} differs"
+
+print(f"{args.dataset_dir}, first {min(args.num_samples, len(raw_dataset))} rows, batch size {args.batch_size}, {torch.get_num_threads()} threads\n")
+print(f"{'workers':>7} | {'raw (frames/s)':>14} | {'mel store (frames/s)':>20} | {'speedup':>7} | {'mel store (samples/s)':>21}")
+for num_workers in args.num_workers:
+    raw_fps, _ = run(raw_dataset, num_workers)
+    mel_fps, mel_sps = run(mel_dataset, num_workers)
+    print(f"{num_workers:>7} | {raw_fps:>14.0f} | {mel_fps:>20.0f} | {raw_fps and mel_fps / raw_fps:>6.1f}x | {mel_sps:>21.1f}")
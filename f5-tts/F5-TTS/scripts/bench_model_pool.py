@@ -0,0 +1,135 @@
+# Concurrency check of model.utils_infer.ModelPool, as hit by gradio's concurrent requests (models, vocoder, VoiceCache voices)
+# slow load of one key while other keys are looked up, and a failing load with callers of the same key waiting & arriving;
+# loaders only sleep, so the numbers are of the locking alone; then concurrent requests transcribing a voice
+# cached without a transcript (whisper stubbed by a sleep)
+#
+# python scripts/bench_model_pool.py -l 0.5 -c 4
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+import threading
+
+import numpy as np
+
+from model.utils_infer import ModelPool, VoiceCache
+
+
+parser = argparse.ArgumentParser(description="ModelPool concurrency check")
+
+parser.add_argument('-l', '--load_seconds', default=0.5, type=float, help="duration of a slow load")
+parser.add_argument('-c', '--callers', default=4, type=int, help="concurrent callers of the slow key")
+
+args = parser.parse_args()
+
+
+class PreviousModelPool(ModelPool):
+    # as the per-key lock before, entry dropped whenever a load ends, also while callers still wait on a failed one
+    def get(self, key, loader):
+        with self.lock:
+            found, model = self.lookup(key)
+            if found:
+                return model
+            key_lock = self.loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self.lock:
+                found, model = self.lookup(key)
+            if found:
+                return model
+            try:
+                model = loader()
+                with self.lock:
+                    self.models[key] = model
+                    while len(self.models) > self.max_size:
+                        self.models.popitem(last = False)
+            finally:
+                with self.lock:
+                    self.loading.pop(key, None)
+            return model
+
+
+class SlowLoader:
+    # counts loads & the most running at once, the first fail_first ones raise at the end
+    def __init__(self, fail_first = 0):
+        self.fail_first = fail_first
+        self.loads = self.running = self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.loads += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            fail = self.loads <= self.fail_first
+        time.sleep(args.load_seconds)
+        with self.lock:
+            self.running -= 1
+        if fail:
+            raise RuntimeError("load failed")
+        return "model"
+
+
+def call(pool, loader, errors):
+    try:
+        pool.get("slow", loader)
+    except RuntimeError:
+        errors.append(1)
+
+
+def slow_key(pool_cls):
+    # callers of the slow key, then another key looked up meanwhile
+    pool, loader, errors = pool_cls(max_size = 4), SlowLoader(), []
+    threads = [threading.Thread(target = call, args = (pool, loader, errors)) for _ in range(args.callers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.load_seconds / 10)
+    pool.get("other", lambda: "model")
+    other_seconds = time.perf_counter() - start
+    for thread in threads:
+        thread.join()
+    return other_seconds, loader
+
+
+def failing_load(pool_cls):
+    # first load fails with callers waiting on it, one more caller arrives right after the failure
+    pool, loader, errors = pool_cls(max_size = 4), SlowLoader(fail_first = 1), []
+    threads = [threading.Thread(target = call, args = (pool, loader, errors)) for _ in range(args.callers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.load_seconds * 1.1)
+    late = threading.Thread(target = call, args = (pool, loader, errors))
+    late.start()
+    for thread in threads + [late]:
+        thread.join()
+    return loader, errors
+
+
+def transcriptions():
+    # voice cached by a request with ref_text, then requests without it at once, each must see the one transcript
+    cache, asr = VoiceCache(trim_silence = False), SlowLoader()
+    ref_audio = (np.random.default_rng(0).uniform(-0.1, 0.1, 24000).astype(np.float32), 24000)
+    cache.get(ref_audio)
+    pipe = lambda inputs, **kwargs: dict(text = f" transcript {asr()}")
+    voices = []
+    threads = [threading.Thread(target = lambda: voices.append(cache.get(ref_audio, get_asr = lambda: pipe))) for _ in range(args.callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return asr.loads, len({voice.transcript for voice in voices})
+
+
+print(f"{args.callers} callers of a key loading {args.load_seconds}s\n")
+print(f"{'pool':>9} | {'other key served (s)':>20} | {'loads':>5} | {'failing load: loads':>19} | {'most at once':>12} | {'errors':>6}")
+for name, pool_cls in (("previous", PreviousModelPool), ("current", ModelPool)):
+    other_seconds, loader = slow_key(pool_cls)
+    failed, errors = failing_load(pool_cls)
+    print(f"{name:>9} | {other_seconds:>20.2f} | {loader.loads:>5} | {failed.loads:>19} | {failed.max_running:>12} | {len(errors):>6}")
+
+loads, transcripts = transcriptions()
+print(f"\nVoiceCache, {args.callers} requests without ref_text of a voice cached without transcript: "
+      f"{loads} transcription(s), {transcripts} distinct transcript(s)")
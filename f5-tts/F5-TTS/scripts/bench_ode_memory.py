@@ -0,0 +1,82 @@
+# Peak memory of CFM.sample for long batched generations:
+# torchdiffeq odeint (full trajectory kept) vs. lean_ode built-in fixed grid solver (current state only)
+# each mode runs in a fresh subprocess, cpu peak taken from max rss, cuda peak from max_memory_allocated
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+import resource
+import subprocess
+
+import torch
+
+from model import CFM, UNetT, DiT
+
+
+parser = argparse.ArgumentParser(description="ode solver memory benchmark")
+
+parser.add_argument('-n', '--expname', default="F5TTS_Base", choices=["F5TTS_Base", "E2TTS_Base", "tiny"])
+parser.add_argument('-b', '--batch_size', default=4, type=int)
+parser.add_argument('-s', '--seconds', default=30, type=float, help="total duration per sample, prompt included")
+parser.add_argument('-nfe', '--nfestep', default=32, type=int)
+parser.add_argument('-o', '--odemethod', default="euler", choices=["euler", "midpoint"])
+parser.add_argument('-d', '--device', default="cuda" if torch.cuda.is_available() else "cpu")
+parser.add_argument('--mode', default=None, choices=["odeint", "lean"], help="internal, run a single mode")
+
+args = parser.parse_args()
+
+target_sample_rate = 24000
+n_mel_channels = 100
+hop_length = 256
+vocab_size = 2545
+
+frames = int(args.seconds * target_sample_rate / hop_length)
+trajectory_bytes = args.nfestep * args.batch_size * frames * n_mel_channels * 4
+
+
+def run(mode):
+    if args.expname == "F5TTS_Base":
+        transformer = DiT(dim = 1024, depth = 22, heads = 16, ff_mult = 2, text_dim = 512, conv_layers = 4, text_num_embeds = vocab_size, mel_dim = n_mel_channels)
+    elif args.expname == "E2TTS_Base":
+        transformer = UNetT(dim = 1024, depth = 24, heads = 16, ff_mult = 4, text_num_embeds = vocab_size, mel_dim = n_mel_channels)
+    elif args.expname == "tiny":
+        transformer = DiT(dim = 256, depth = 4, heads = 4, ff_mult = 2, text_dim = 128, conv_layers = 2, text_num_embeds = vocab_size, mel_dim = n_mel_channels)
+    model = CFM(transformer = transformer, odeint_kwargs = dict(method = args.odemethod)).to(args.device)
+
+    cond = torch.randn(args.batch_size, frames // 10, n_mel_channels, device = args.device)  # short prompt
+    text = torch.randint(0, vocab_size, (args.batch_size, frames // 4), device = args.device)
+
+    if args.device.startswith("cuda"):
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    else:
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    start = time.perf_counter()
+    with torch.inference_mode():
+        out, trajectory = model.sample(cond = cond, text = text, duration = frames, steps = args.nfestep,
+                                       cfg_strength = 2., sway_sampling_coef = -1., batched_cfg = True, lean_ode = mode == "lean")
+    elapsed = time.perf_counter() - start
+
+    if args.device.startswith("cuda"):
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() - base
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base
+    print(f"{peak} {elapsed}")
+
+
+if args.mode is not None:
+    run(args.mode)
+    sys.exit()
+
+print(f"{args.expname} on {args.device}, batch {args.batch_size} x {args.seconds}s ({frames} frames), "
+      f"{args.odemethod} {args.nfestep} nfe, trajectory {trajectory_bytes / 2**20:.1f} MiB\n")
+print(f"{'mode':>8} | {'peak sampling memory (MiB)':>26} | {'time (s)':>8}")
+for mode in ["odeint", "lean"]:
+    result = subprocess.run([sys.executable, *sys.argv, "--mode", mode], capture_output = True, text = True, check = True)
+    peak, elapsed = map(float, result.stdout.split()[-2:])
+    print(f"{mode:>8} | {peak / 2**20:>26.1f} | {elapsed:>8.2f}")
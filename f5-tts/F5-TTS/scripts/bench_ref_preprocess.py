@@ -0,0 +1,120 @@
+# Latency of reference audio preprocessing (silence trim, 15s clip, mono, rms, resample) and of output remove_silence:
+# previous pydub split_on_silence with temp wav round trips vs. in memory numpy / torch (preprocess_ref_audio_orig, remove_silence)
+# both read the reference file once, with soundfile, as a 16-bit wav so pydub needs no ffmpeg
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import argparse
+import tempfile
+
+import numpy as np
+import soundfile as sf
+import torch
+from pydub import AudioSegment, silence
+
+from model.utils_infer import preprocess_ref_audio, preprocess_ref_audio_orig, remove_silence
+
+
+parser = argparse.ArgumentParser(description="reference audio preprocessing benchmark")
+
+parser.add_argument('-a', '--ref_audio', default=None, help="16-bit wav, synthetic speech-like bursts & pauses if not given")
+parser.add_argument('-s', '--seconds', default=[10, 20, 60], type=float, nargs='+', help="synthetic reference durations")
+parser.add_argument('-sr', '--sample_rate', default=44100, type=int, help="synthetic reference sample rate")
+parser.add_argument('-ch', '--channels', default=2, type=int, help="synthetic reference channels")
+parser.add_argument('-o', '--output_seconds', default=60, type=float, help="synthetic generated output duration, for remove_silence")
+parser.add_argument('-r', '--repeats', default=5, type=int)
+
+args = parser.parse_args()
+
+target_sample_rate = 24000
+rng = np.random.default_rng(0)
+
+
+def synthetic(seconds, sr, channels):
+    # noise bursts of 0.2-3s, pauses of 0.1-2s some above 1s silence, quantized to 16 bit
+    parts, total = [], 0
+    while total < seconds * sr:
+        for length, amp in ((rng.uniform(0.2, 3), 0.1), (rng.uniform(0.1, 2), 0.001)):
+            n = int(length * sr)
+            parts.append(rng.normal(0, amp, (n, channels)))
+            total += n
+    return (np.clip(np.concatenate(parts)[:int(seconds * sr)], -1, 1) * 32767).astype(np.int16)
+
+
+def pydub_ref(path):
+    # as previously in infer(): decode, split & join, clip, export to temp wav, reload
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+        aseg = AudioSegment.from_file(path)
+        non_silent_segs = silence.split_on_silence(aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=1000)
+        non_silent_wave = AudioSegment.silent(duration=0)
+        for non_silent_seg in non_silent_segs:
+            non_silent_wave += non_silent_seg
+        aseg = non_silent_wave
+        if len(aseg) > 15000:
+            aseg = aseg[:15000]
+        aseg.export(f.name, format="wav")
+        audio, sr = sf.read(f.name, dtype="float32", always_2d=True)
+    os.remove(f.name)
+    return preprocess_ref_audio((torch.from_numpy(audio.T), sr), device = "cpu")[0]
+
+
+def in_memory_ref(path):
+    audio, sr = sf.read(path, dtype="float32", always_2d=True)
+    ref_audio, _ = preprocess_ref_audio_orig((audio.T, sr))
+    return preprocess_ref_audio(ref_audio, device = "cpu")[0]
+
+
+def pydub_output(wave):
+    # as previously in infer_batch() with remove_silence
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as f:
+        sf.write(f.name, wave, target_sample_rate)
+        aseg = AudioSegment.from_file(f.name)
+        non_silent_segs = silence.split_on_silence(aseg, min_silence_len=1000, silence_thresh=-50, keep_silence=500)
+        non_silent_wave = AudioSegment.silent(duration=0)
+        for non_silent_seg in non_silent_segs:
+            non_silent_wave += non_silent_seg
+        aseg = non_silent_wave
+        aseg.export(f.name, format="wav")
+        out, _ = sf.read(f.name, dtype="float32")
+    os.remove(f.name)
+    return out
+
+
+def timed(fn, *inputs):
+    fn(*inputs)  # warmup
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        out = fn(*inputs)
+    return (time.perf_counter() - start) / args.repeats * 1000, out
+
+
+with tempfile.TemporaryDirectory() as tmp:
+    if args.ref_audio is not None:
+        refs = [args.ref_audio]
+    else:
+        refs = []
+        for seconds in args.seconds:
+            refs.append(os.path.join(tmp, f"ref_{seconds:g}s.wav"))
+            sf.write(refs[-1], synthetic(seconds, args.sample_rate, args.channels), args.sample_rate, subtype="PCM_16")
+
+    print(f"{'reference':>16} | {'pydub (ms)':>10} | {'in memory (ms)':>14} | {'speedup':>7} | {'samples':>7} | {'max abs diff':>12}")
+    for path in refs:
+        t_pydub, ref = timed(pydub_ref, path)
+        t_memory, out = timed(in_memory_ref, path)
+        info = sf.info(path)
+        same_len = "same" if ref.shape == out.shape else f"{out.shape[-1] - ref.shape[-1]:+d}"
+        diff = (ref - out).abs().max().item() if ref.shape == out.shape else float("nan")
+        print(f"{f'{info.duration:.0f}s {info.samplerate}hz x{info.channels}':>16} | {t_pydub:>10.1f} | {t_memory:>14.1f} | "
+              f"{t_pydub / t_memory:>6.1f}x | {same_len:>7} | {diff:>12.2e}")
+
+    # generated output, float at 24khz, written as 16-bit pcm before
+    wave = synthetic(args.output_seconds, target_sample_rate, 1)[:, 0] / 32768
+    t_pydub, ref = timed(pydub_output, wave)
+    t_memory, out = timed(lambda: remove_silence(wave.astype(np.float32), target_sample_rate, keep_silence = 500))
+    same_len = "same" if ref.shape == out.shape else f"{out.shape[-1] - ref.shape[-1]:+d}"
+    diff = np.abs(ref - out).max() if ref.shape == out.shape else float("nan")
+    print(f"\n{'output':>16} | {'pydub (ms)':>10} | {'in memory (ms)':>14} | {'speedup':>7} | {'samples':>7} | {'max abs diff':>12}")
+    print(f"{f'{args.output_seconds:g}s {target_sample_rate}hz':>16} | {t_pydub:>10.1f} | {t_memory:>14.1f} | "
+          f"{t_pydub / t_memory:>6.1f}x | {same_len:>7} | {diff:>12.2e}")
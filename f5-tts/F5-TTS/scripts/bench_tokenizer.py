@@ -0,0 +1,80 @@
+# Text tokenization time per batch, list_str_to_idx / list_str_to_tensor (one tensor per text, pad_sequence)
+# vs. model.utils.VocabTokenizer (flat lookup over the batch into one preallocated padded tensor); checks the ids are identical
+# pinyin (lists with multi-char tokens), char (str, code point table) and byte modes, at inference and training batch sizes
+#
+# python scripts/bench_tokenizer.py                            # synthetic vocab & zh / en sentences
+# python scripts/bench_tokenizer.py --vocab data/Emilia_ZH_EN_pinyin/vocab.txt -b 1 16 64 256
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import random
+import argparse
+
+import torch
+from pypinyin import lazy_pinyin, Style, pinyin_dict
+
+from model.utils import VocabTokenizer, get_tokenizer, list_str_to_idx, list_str_to_tensor, convert_char_to_pinyin
+
+
+parser = argparse.ArgumentParser(description="batched tokenizer benchmark")
+
+parser.add_argument('--vocab', default=None, type=str, help="vocab.txt, synthetic pinyin + char vocab if not given")
+parser.add_argument('-b', '--batch_sizes', default=[1, 8, 64, 256], type=int, nargs='+', help="1 & 8 as inference, 64+ as training batches")
+parser.add_argument('--min_chars', default=20, type=int)
+parser.add_argument('--max_chars', default=150, type=int)
+parser.add_argument('-r', '--repeats', default=200, type=int)
+
+args = parser.parse_args()
+
+
+def timed(fn, text):
+    fn(text)
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        fn(text)
+    return (time.perf_counter() - start) / args.repeats * 1e3
+
+
+random.seed(0)
+hanzi = [chr(c) for c in sorted(pinyin_dict.pinyin_dict) if 0x4e00 <= c <= 0x9fff][:3500]
+words = ["Hello", "world", "F5-TTS", "AI", "OK", "the", "model", "flow", "matching"]
+punctuation = ["，", "。", "、", "？", "！", ", ", ". "]
+
+if args.vocab is not None:
+    vocab_char_map, vocab_size = get_tokenizer(args.vocab, "custom")
+else:
+    syllables = sorted({p for c in hanzi for p in lazy_pinyin(c, style=Style.TONE3, tone_sandhi=True)})
+    vocab = [" "] + [chr(c) for c in range(33, 127)] + syllables + hanzi[:2000] + list("。，、；：？！《》【】—…")
+    vocab_char_map = {c: i for i, c in enumerate(dict.fromkeys(vocab))}
+    vocab_size = len(vocab_char_map)
+
+
+def sentence():
+    parts = []
+    while sum(map(len, parts)) < random.randint(args.min_chars, args.max_chars):
+        r = random.random()
+        parts.append(random.choice(hanzi) if r < 0.8 else random.choice(punctuation) if r < 0.9 else random.choice(words) + " ")
+    return "".join(parts)
+
+
+texts = [sentence() for _ in range(max(args.batch_sizes))]
+modes = dict(
+    pinyin = (convert_char_to_pinyin(texts), vocab_char_map),
+    char = (texts, vocab_char_map),
+    byte = (texts, None),
+)
+
+print(f"vocab of {vocab_size} entries, {args.min_chars}-{args.max_chars} chars per text, ms per batch\n")
+print(f"{'mode':>6} | {'batch':>5} | {'tokens':>6} | {'list_str_to_* (ms)':>18} | {'VocabTokenizer (ms)':>19} | {'speedup':>7} | {'ids':>9}")
+for mode, (mode_texts, mode_vocab) in modes.items():
+    tokenizer = VocabTokenizer(mode_vocab)
+    previous = (lambda t: list_str_to_idx(t, mode_vocab)) if mode_vocab is not None else list_str_to_tensor
+    for batch_size in args.batch_sizes:
+        batch = mode_texts[:batch_size]
+        same = "identical" if torch.equal(previous(batch), tokenizer(batch)) else "DIFFERENT"
+        t_previous, t_tokenizer = timed(previous, batch), timed(tokenizer, batch)
+        tokens = int(tokenizer.encode(batch)[1].sum())
+        print(f"{mode:>6} | {batch_size:>5} | {tokens:>6} | {t_previous:>18.3f} | {t_tokenizer:>19.3f} | "
+              f"{t_previous / t_tokenizer:>6.1f}x | {same:>9}")
@@ -0,0 +1,68 @@
+# Convert the duration.json of an already prepared dataset into the memory-mapped duration index (model.dataset.save_duration_index)
+# duration.npy from duration.json, text_length.npy from the text column of raw.arrow; duration.json is left in place
+#
+# python scripts/convert_duration_index.py data/Emilia_ZH_EN_pinyin data/WenetSpeech4TTS_Premium_pinyin
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import json
+import time
+import argparse
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from tqdm import tqdm
+from datasets import load_from_disk
+from datasets import Dataset as Dataset_
+
+from model.dataset import save_duration_index, load_duration_index
+
+
+def load_raw(dataset_dir):
+    try:
+        return load_from_disk(f"{dataset_dir}/raw")
+    except:
+        return Dataset_.from_file(f"{dataset_dir}/raw.arrow")
+
+
+def text_lengths(dataset):
+    # len(text) per row straight from arrow, list of pinyin / chars or a string
+    lengths = []
+    for chunk in tqdm(dataset.data.column("text").chunks, desc="Text lengths"):
+        if pa.types.is_list(chunk.type) or pa.types.is_large_list(chunk.type):
+            lengths.append(pc.list_value_length(chunk).to_numpy(zero_copy_only=False))
+        else:
+            lengths.append(pc.utf8_length(chunk).to_numpy(zero_copy_only=False))
+    return np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="convert duration.json to the memory-mapped duration index")
+    parser.add_argument('dataset_dirs', type=str, nargs='+', help="folders with raw.arrow (or raw/) and duration.json")
+    parser.add_argument('--no_text_lengths', action='store_true', help="durations only, skip reading raw.arrow")
+    args = parser.parse_args()
+
+    for dataset_dir in args.dataset_dirs:
+        start_time = time.time()
+        with open(f"{dataset_dir}/duration.json", 'r', encoding='utf-8') as f:
+            durations = json.load(f)["duration"]
+
+        lengths = None
+        if not args.no_text_lengths:
+            dataset = load_raw(dataset_dir)
+            assert len(dataset) == len(durations), f"{len(durations)} durations for {len(dataset)} rows in {dataset_dir}"
+            lengths = text_lengths(dataset)
+
+        save_duration_index(dataset_dir, durations, lengths)
+
+        # round trip check
+        index_durations, index_lengths = load_duration_index(dataset_dir)
+        assert np.array_equal(index_durations, np.asarray(durations, dtype=np.float64))
+        print(f"{dataset_dir}: {len(durations)} rows, {sum(durations) / 3600:.2f} hours, "
+              f"{'with' if index_lengths is not None else 'no'} text lengths, {time.time() - start_time:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
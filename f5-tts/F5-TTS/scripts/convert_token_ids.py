@@ -0,0 +1,85 @@
+# Add the pre-tokenized token_ids (int16, int32 for vocabs over 32768) & token_len columns to an already prepared dataset,
+# against a given vocab.txt, recorded as token_vocab.txt next to raw.arrow (see model.dataset.load_dataset tokenize)
+# ids mapped in arrow (pyarrow.compute.index_in over the flattened pinyin / char lists), 0 for unknown as list_str_to_idx
+#
+# python scripts/convert_token_ids.py data/Emilia_ZH_EN_pinyin
+# python scripts/convert_token_ids.py data/my_finetune_pinyin --vocab data/Emilia_ZH_EN_pinyin/vocab.txt
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import time
+import shutil
+import argparse
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import load_from_disk, Value, Sequence
+from datasets import Dataset as Dataset_
+from datasets.arrow_writer import ArrowWriter
+
+from model.utils import get_tokenizer
+from model.dataset import save_token_vocab, text_to_token_ids, token_id_dtype
+
+
+def add_token_ids(batch, vocab, dtype):
+    text = batch.column("text").combine_chunks()
+    if pa.types.is_list(text.type):
+        offsets = pc.subtract(text.offsets, text.offsets[0])
+        ids = pc.fill_null(pc.index_in(text.flatten(), value_set=vocab), 0).cast(dtype)
+        token_ids = pa.ListArray.from_arrays(offsets, ids)
+    else:  # plain strings, char-wise
+        vocab_char_map = {char: i for i, char in enumerate(vocab.to_pylist())}
+        token_ids = pa.array([text_to_token_ids(t, vocab_char_map) for t in text.to_pylist()], type=pa.list_(dtype))
+    return batch.append_column("token_ids", token_ids).append_column("token_len", pc.list_value_length(token_ids).cast(pa.int64()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="add pre-tokenized token_ids to a prepared dataset")
+    parser.add_argument('dataset_dir', type=str, help="folder with raw.arrow (or raw/)")
+    parser.add_argument('--vocab', default=None, type=str, help="vocab.txt the ids map to, the dataset's own if not given")
+    parser.add_argument('-b', '--batch_size', default=10000, type=int)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    vocab_path = args.vocab or f"{args.dataset_dir}/vocab.txt"
+    vocab_char_map, vocab_size = get_tokenizer(vocab_path, "custom")
+    dtype = pa.from_numpy_dtype(token_id_dtype(vocab_size))
+    vocab = pa.array(sorted(vocab_char_map, key=vocab_char_map.get))
+
+    from_disk = os.path.isdir(f"{args.dataset_dir}/raw")
+    dataset = load_from_disk(f"{args.dataset_dir}/raw") if from_disk else Dataset_.from_file(f"{args.dataset_dir}/raw.arrow")
+    if "token_ids" in dataset.column_names:
+        dataset = dataset.remove_columns(["token_ids", "token_len"])
+    features = dataset.features.copy()
+    features["token_ids"] = Sequence(Value(str(dtype)))
+    features["token_len"] = Value("int64")
+
+    tokenized = dataset.with_format("arrow").map(add_token_ids, batched=True, batch_size=args.batch_size, features=features,
+                                                 fn_kwargs=dict(vocab=vocab, dtype=dtype), desc="Tokenizing").with_format(None)
+
+    # replace raw.arrow (or raw/) only once fully written
+    if from_disk:
+        tokenized.save_to_disk(f"{args.dataset_dir}/raw.tmp")
+        shutil.rmtree(f"{args.dataset_dir}/raw")
+        os.rename(f"{args.dataset_dir}/raw.tmp", f"{args.dataset_dir}/raw")
+    else:
+        with ArrowWriter(path=f"{args.dataset_dir}/raw.arrow.tmp", features=tokenized.features) as writer:
+            for batch in tokenized.data.to_batches():
+                writer.write_table(pa.Table.from_batches([batch]))
+            writer.finalize()
+        os.replace(f"{args.dataset_dir}/raw.arrow.tmp", f"{args.dataset_dir}/raw.arrow")
+    save_token_vocab(args.dataset_dir, vocab_char_map)
+
+    token_len = np.asarray(tokenized.data.column("token_len"))
+    unknown = int(pc.sum(pc.equal(pc.list_flatten(tokenized.data.column("token_ids")), 0)).as_py() or 0)
+    for cache_file in tokenized.cache_files:  # the map output, copied above (gone with the old raw/ if from disk)
+        if os.path.exists(cache_file["filename"]):
+            os.remove(cache_file["filename"])
+    print(f"{args.dataset_dir}: {len(tokenized)} rows, {int(token_len.sum())} tokens as {dtype} against {vocab_path} "
+          f"({vocab_size} entries), {unknown} unknown or space (id 0), {time.time() - start_time:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# Sweep of guidance-interval schedules (cfg null branch skipped on part of the flow evaluations)
+# each setting runs scripts/eval_infer_batch.py with a fixed seed, so generations share the same noise,
+# then reports wall time, transformer branch passes, and log mel distance to the full cfg generations.
+# WER / SIM of each printed output dir can be evaluated further with scripts/eval_*_test*.py
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import re
+import argparse
+import subprocess
+
+import torchaudio
+
+from model.modules import MelSpec
+
+
+parser = argparse.ArgumentParser(description="cfg schedule sweep")
+
+parser.add_argument('-n', '--expname', required=True)
+parser.add_argument('-c', '--ckptstep', default=1200000, type=int)
+parser.add_argument('-t', '--testset', required=True)
+parser.add_argument('-s', '--seed', default=0, type=int)
+parser.add_argument('-nfe', '--nfestep', default=32, type=int)
+parser.add_argument('-o', '--odemethod', default="euler")
+parser.add_argument('-ss', '--swaysampling', default=-1, type=float)
+parser.add_argument('-l', '--launcher', default="accelerate launch", help="command prefix to run eval_infer_batch.py")
+parser.add_argument('--schedules', default=["full", "ce2", "ce3", "ci0-0.5", "ci0.1-0.7", "ci0-0.7+ce2"], nargs='+',
+                    help="full | ce<k> | ci<t_min>-<t_max> | ci<t_min>-<t_max>+ce<k>")
+
+args = parser.parse_args()
+
+target_sample_rate = 24000
+
+
+def schedule_args(schedule):
+    extra = []
+    for part in schedule.split('+'):
+        if part == "full":
+            continue
+        elif part.startswith("ce"):
+            extra += ["-ce", part[2:]]
+        elif part.startswith("ci"):
+            extra += ["-ci", *part[2:].split('-')]
+        else:
+            raise ValueError(f"unknown schedule {part}")
+    return extra
+
+
+def run(schedule):
+    cmd = [*args.launcher.split(), "scripts/eval_infer_batch.py",
+           "-n", args.expname, "-c", str(args.ckptstep), "-t", args.testset, "-s", str(args.seed),
+           "-nfe", str(args.nfestep), "-o", args.odemethod, "-ss", str(args.swaysampling), *schedule_args(schedule)]
+    print(" ".join(cmd))
+    stdout = subprocess.run(cmd, capture_output = True, text = True, check = True).stdout
+    minutes = float(re.search(r"Done batch inference in ([\d.]+) minutes", stdout).group(1))
+    passes = float(re.search(r"Transformer passes: \d+, ([\d.]+) per sample", stdout).group(1))
+    output_dir = re.search(r"Output dir: (.+)", stdout).group(1).strip()
+    return minutes, passes, output_dir
+
+
+mel_spec = MelSpec(target_sample_rate = target_sample_rate)
+
+def mel_distance(output_dir, reference_dir):
+    # mean abs log mel difference over utterances, against the same utterance generated with full cfg
+    dists = []
+    for wav in sorted(os.listdir(reference_dir)):
+        ref, _ = torchaudio.load(os.path.join(reference_dir, wav))
+        gen, _ = torchaudio.load(os.path.join(output_dir, wav))
+        ref_mel, gen_mel = mel_spec(ref), mel_spec(gen)
+        n = min(ref_mel.shape[-1], gen_mel.shape[-1])
+        dists.append((ref_mel[..., :n] - gen_mel[..., :n]).abs().mean().item())
+    return sum(dists) / len(dists)
+
+
+results = {schedule: run(schedule) for schedule in dict.fromkeys(["full", *args.schedules])}
+full_minutes, full_passes, full_dir = results["full"]
+
+print(f"\n{args.expname} {args.ckptstep}, {args.testset}, {args.odemethod} {args.nfestep} nfe, sway {args.swaysampling}, seed {args.seed}\n")
+print(f"{'schedule':>14} | {'passes/sample':>13} | {'time (min)':>10} | {'speedup':>7} | {'log mel L1 vs full':>18} | output dir")
+for schedule, (minutes, passes, output_dir) in results.items():
+    dist = mel_distance(output_dir, full_dir) if schedule != "full" else 0.
+    print(f"{schedule:>14} | {passes:>13.1f} | {minutes:>10.2f} | {full_minutes / minutes:>6.2f}x | {dist:>18.4f} | {output_dir}")
@@ -47,6 +47,8 @@ parser.add_argument('-c', '--ckptstep', default=1200000, type=int)
 parser.add_argument('-nfe', '--nfestep', default=32, type=int)
 parser.add_argument('-o', '--odemethod', default="euler")
 parser.add_argument('-ss', '--swaysampling', default=-1, type=float)
+parser.add_argument('-ci', '--cfginterval', default=None, type=float, nargs=2, help="t_min t_max, run cfg null branch only within")
+parser.add_argument('-ce', '--cfgevery', default=1, type=int, help="run cfg null branch only every k-th flow evaluation")
 
 parser.add_argument('-t', '--testset', required=True)
 
@@ -62,6 +64,8 @@ ckpt_path = f"ckpts/{exp_name}/model_{ckpt_step}.pt"
 nfe_step = args.nfestep
 ode_method = args.odemethod
 sway_sampling_coef = args.swaysampling
+cfg_interval = args.cfginterval
+cfg_every = args.cfgevery
 
 testset = args.testset
 
@@ -102,6 +106,8 @@ output_dir = f"results/{exp_name}_{ckpt_step}/{testset}/" \
     f"seed{seed}_{ode_method}_nfe{nfe_step}" \
     f"{f'_ss{sway_sampling_coef}' if sway_sampling_coef else ''}" \
     f"_cfg{cfg_strength}_speed{speed}" \
+    f"{f'_ci{cfg_interval[0]}-{cfg_interval[1]}' if cfg_interval else ''}" \
+    f"{f'_ce{cfg_every}' if cfg_every > 1 else ''}" \
     f"{'_gt-dur' if use_truth_duration else ''}" \
     f"{'_no-ref-audio' if no_ref_audio else ''}"
 
@@ -156,6 +162,13 @@ model = CFM(
 
 model = load_checkpoint(model, ckpt_path, device, use_ema = use_ema)
 
+# count transformer branch passes (batched cfg forward holds two)
+transformer_passes = 0
+def count_passes(module, args, kwargs):
+    global transformer_passes
+    transformer_passes += 2 if kwargs.get('cfg_infer') else 1
+model.transformer.register_forward_pre_hook(count_passes, with_kwargs = True)
+
 if not os.path.exists(output_dir) and accelerator.is_main_process:
     os.makedirs(output_dir)
 
@@ -183,6 +196,9 @@ with accelerator.split_between_processes(prompts_all) as prompts:
                 sway_sampling_coef = sway_sampling_coef,
                 no_ref_audio = no_ref_audio,
                 seed = seed,
+                lean_ode = ode_method in ("euler", "midpoint"),  # trajectory not needed
+                cfg_interval = cfg_interval,
+                cfg_every = cfg_every,
             )
         # Final result
         for i, gen in enumerate(generated):
@@ -193,7 +209,11 @@ with accelerator.split_between_processes(prompts_all) as prompts:
                 generated_wave = generated_wave * ref_rms_list[i] / target_rms
             torchaudio.save(f"{output_dir}/{utts[i]}.wav", generated_wave, target_sample_rate)
 
+transformer_passes = accelerator.gather(torch.tensor([transformer_passes], device = device)).sum().item()
+
 accelerator.wait_for_everyone()
 if accelerator.is_main_process:
     timediff = time.time() - start
     print(f"Done batch inference in {timediff / 60 :.2f} minutes.")
+    print(f"Transformer passes: {transformer_passes}, {transformer_passes / len(metainfo):.1f} per sample.")
+    print(f"Output dir: {output_dir}")
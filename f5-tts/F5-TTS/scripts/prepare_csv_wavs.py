@@ -2,7 +2,6 @@ import sys, os
 sys.path.append(os.getcwd())
 
 from pathlib import Path
-import json
 import shutil
 import argparse
 
@@ -11,9 +10,9 @@ import torchaudio
 from tqdm import tqdm
 from datasets.arrow_writer import ArrowWriter
 
-from model.utils import (
-    convert_char_to_pinyin,
-)
+from model.utils import get_tokenizer
+from model.g2p import G2P
+from model.dataset import save_duration_index, save_token_vocab, text_to_token_ids
 
 PRETRAINED_VOCAB_PATH = Path(__file__).parent.parent / "data/Emilia_ZH_EN_pinyin/vocab.txt"
 
@@ -24,7 +23,7 @@ def is_csv_wavs_format(input_dataset_dir):
     return metadata.exists() and metadata.is_file() and wavs.exists() and wavs.is_dir()
 
 
-def prepare_csv_wavs_dir(input_dir):
+def prepare_csv_wavs_dir(input_dir, num_workers=0):
     assert is_csv_wavs_format(input_dir), f"not csv_wavs format: {input_dir}"
     input_dir = Path(input_dir)
     metadata_path = input_dir / "metadata.csv"
@@ -38,10 +37,14 @@ def prepare_csv_wavs_dir(input_dir):
             print(f"audio {audio_path} not found, skipping")
             continue
         audio_duration = get_audio_duration(audio_path)
-        # assume tokenizer = "pinyin"  ("pinyin" | "char")
-        text = convert_char_to_pinyin([text], polyphone=polyphone)[0]
         sub_result.append({"audio_path": audio_path, "text": text, "duration": audio_duration})
         durations.append(audio_duration)
+
+    # assume tokenizer = "pinyin"  ("pinyin" | "char"), all rows at once, in a process pool if num_workers
+    with G2P(polyphone=polyphone, num_workers=num_workers) as g2p:
+        texts = g2p.convert([line["text"] for line in sub_result])
+    for line, text in zip(sub_result, texts):
+        line["text"] = text
         vocab_set.update(list(text))
 
     return sub_result, durations, vocab_set
@@ -76,15 +79,19 @@ def save_prepped_dataset(out_dir, result, duration_list, text_vocab_set, is_fine
 
     # dataset = Dataset.from_dict({"audio_path": audio_path_list, "text": text_list, "duration": duration_list})  # oom
     # dataset.save_to_disk(f"data/{dataset_name}/raw", max_shard_size="2GB")
+    # token ids against the vocab.txt written below, pretrained one if finetune, for pre-tokenized training
+    if is_finetune:
+        vocab_char_map, _ = get_tokenizer(PRETRAINED_VOCAB_PATH.as_posix(), "custom")
+    else:
+        vocab_char_map = {vocab: i for i, vocab in enumerate(sorted(text_vocab_set))}
     raw_arrow_path = out_dir / "raw.arrow"
     with ArrowWriter(path=raw_arrow_path.as_posix(), writer_batch_size=1) as writer:
         for line in tqdm(result, desc=f"Writing to raw.arrow ..."):
-            writer.write(line)
+            token_ids = text_to_token_ids(line["text"], vocab_char_map)
+            writer.write({**line, "token_ids": token_ids, "token_len": len(token_ids)})
 
-    # dup a json separately saving duration in case for DynamicBatchSampler ease
-    dur_json_path = out_dir / "duration.json"
-    with open(dur_json_path.as_posix(), 'w', encoding='utf-8') as f:
-        json.dump({"duration": duration_list}, f, ensure_ascii=False)
+    # dup durations & text lengths separately, memory-mapped by load_dataset for DynamicBatchSampler ease
+    save_duration_index(out_dir.as_posix(), duration_list, [len(line["text"]) for line in result])
 
     # vocab map, i.e. tokenizer
     # add alphabets and symbols (optional, if plan to ft on de/fr etc.)
@@ -102,6 +109,7 @@ def save_prepped_dataset(out_dir, result, duration_list, text_vocab_set, is_fine
         with open(voca_out_path, "w") as f:
             for vocab in sorted(text_vocab_set):
                 f.write(vocab + "\n")
+    save_token_vocab(out_dir.as_posix(), vocab_char_map)
 
     dataset_name = out_dir.stem
     print(f"\nFor {dataset_name}, sample count: {len(result)}")
@@ -109,10 +117,10 @@ def save_prepped_dataset(out_dir, result, duration_list, text_vocab_set, is_fine
     print(f"For {dataset_name}, total {sum(duration_list)/3600:.2f} hours")
 
 
-def prepare_and_save_set(inp_dir, out_dir, is_finetune: bool = True):
+def prepare_and_save_set(inp_dir, out_dir, is_finetune: bool = True, num_workers: int = 0):
     if is_finetune:
         assert PRETRAINED_VOCAB_PATH.exists(), f"pretrained vocab.txt not found: {PRETRAINED_VOCAB_PATH}"
-    sub_result, durations, vocab_set = prepare_csv_wavs_dir(inp_dir)
+    sub_result, durations, vocab_set = prepare_csv_wavs_dir(inp_dir, num_workers=num_workers)
     save_prepped_dataset(out_dir, sub_result, durations, vocab_set, is_finetune)
 
 
@@ -123,10 +131,11 @@ def cli():
     parser.add_argument('inp_dir', type=str, help="Input directory containing the data.")
     parser.add_argument('out_dir', type=str, help="Output directory to save the prepared data.")
     parser.add_argument('--pretrain', action='store_true', help="Enable for new pretrain, otherwise is a fine-tune")
+    parser.add_argument('--num_workers', type=int, default=0, help="Processes for the pinyin conversion, 0 for in process")
 
     args = parser.parse_args()
 
-    prepare_and_save_set(args.inp_dir, args.out_dir, is_finetune=not args.pretrain)
+    prepare_and_save_set(args.inp_dir, args.out_dir, is_finetune=not args.pretrain, num_workers=args.num_workers)
 
 if __name__ == "__main__":
     cli()
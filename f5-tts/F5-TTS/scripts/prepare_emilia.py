@@ -15,10 +15,9 @@ from concurrent.futures import ProcessPoolExecutor
 from datasets import Dataset
 from datasets.arrow_writer import ArrowWriter
 
-from model.utils import (
-    repetition_found,
-    convert_char_to_pinyin,
-)
+from model.utils import repetition_found
+from model.g2p import G2P
+from model.dataset import save_duration_index, save_token_vocab, text_to_token_ids
 
 
 out_zh = {"ZH_B00041_S06226", "ZH_B00042_S09204", "ZH_B00065_S09430", "ZH_B00065_S09431", "ZH_B00066_S09327", "ZH_B00066_S09328"}
@@ -53,12 +52,14 @@ def deal_with_audio_dir(audio_dir):
                 if obj["wav"].split("/")[1] in out_en or any(f in text for f in en_filters) or repetition_found(text, length=4):
                     bad_case_en += 1
                     continue
-            if tokenizer == "pinyin":
-                text = convert_char_to_pinyin([text], polyphone = polyphone)[0]
             duration = obj["duration"]
             sub_result.append({"audio_path": str(audio_dir.parent / obj["wav"]), "text": text, "duration": duration})
             durations.append(duration)
-            vocab_set.update(list(text))
+    if tokenizer == "pinyin":  # whole dir at once, clauses & words shared across rows converted once per worker
+        for line, text in zip(sub_result, g2p.convert([line["text"] for line in sub_result])):
+            line["text"] = text
+    for line in sub_result:
+        vocab_set.update(list(line["text"]))
     return sub_result, durations, vocab_set, bad_case_zh, bad_case_en
 
 
@@ -95,13 +96,15 @@ def main():
     print(f"\nSaving to data/{dataset_name} ...")
     # dataset = Dataset.from_dict({"audio_path": audio_path_list, "text": text_list, "duration": duration_list})  # oom
     # dataset.save_to_disk(f"data/{dataset_name}/raw", max_shard_size="2GB")
+    # token ids against the vocab.txt written below, for pre-tokenized training
+    vocab_char_map = {vocab: i for i, vocab in enumerate(sorted(text_vocab_set))}
     with ArrowWriter(path=f"data/{dataset_name}/raw.arrow") as writer:
         for line in tqdm(result, desc=f"Writing to raw.arrow ..."):
-            writer.write(line)
+            token_ids = text_to_token_ids(line["text"], vocab_char_map)
+            writer.write({**line, "token_ids": token_ids, "token_len": len(token_ids)})
 
-    # dup a json separately saving duration in case for DynamicBatchSampler ease
-    with open(f"data/{dataset_name}/duration.json", 'w', encoding='utf-8') as f:
-        json.dump({"duration": duration_list}, f, ensure_ascii=False)
+    # dup durations & text lengths separately, memory-mapped by load_dataset for DynamicBatchSampler ease
+    save_duration_index(f"data/{dataset_name}", duration_list, [len(line["text"]) for line in result])
 
     # vocab map, i.e. tokenizer
     # add alphabets and symbols (optional, if plan to ft on de/fr etc.)
@@ -110,6 +113,7 @@ def main():
     with open(f"data/{dataset_name}/vocab.txt", "w") as f:
         for vocab in sorted(text_vocab_set):
             f.write(vocab + "\n")
+    save_token_vocab(f"data/{dataset_name}", vocab_char_map)
 
     print(f"\nFor {dataset_name}, sample count: {len(result)}")
     print(f"For {dataset_name}, vocab size is: {len(text_vocab_set)}")
@@ -124,6 +128,7 @@ if __name__ == "__main__":
 
     tokenizer = "pinyin"  # "pinyin" | "char"
     polyphone = True
+    g2p = G2P(polyphone = polyphone)  # in each worker, with its own caches
 
     langs = ["ZH", "EN"]
     dataset_dir = "<SOME_PATH>/Emilia_Dataset/raw"
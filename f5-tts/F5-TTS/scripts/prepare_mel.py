@@ -0,0 +1,97 @@
+# Precompute mel features of a prepared dataset (raw.arrow + duration index) into a memory-mapped store,
+# read by load_dataset(..., audio_type="mel") as zero-copy views instead of decode + resample + stft per sample
+#
+# python scripts/prepare_mel.py data/Emilia_ZH_EN_pinyin -w 32
+# writes mel.bin, mel_info.json & mel_offsets.npy (last, marks the store complete) next to raw.arrow, see model.dataset.MelStore
+
+import sys, os
+sys.path.append(os.getcwd())
+
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import torch
+from tqdm import tqdm
+from datasets import load_from_disk
+from datasets import Dataset as Dataset_
+
+from model.dataset import CustomDataset
+
+
+def load_raw(dataset_dir):
+    try:
+        return load_from_disk(f"{dataset_dir}/raw")
+    except:
+        return Dataset_.from_file(f"{dataset_dir}/raw.arrow")
+
+
+def init_worker(dataset_dir, mel_spec_kwargs):
+    global dataset
+    torch.set_num_threads(1)  # parallel over processes
+    dataset = CustomDataset(load_raw(dataset_dir), **mel_spec_kwargs)
+
+
+def compute_mels(index_range):
+    # same decode, resample & MelSpec as the raw training path, rows filtered out of its index left empty
+    mels = []
+    rows = np.arange(*index_range)
+    positions = np.searchsorted(dataset.indices, rows)  # dataset items are positions in the filtered index
+    for row, position in zip(rows, positions):
+        if position < len(dataset.indices) and dataset.indices[position] == row:
+            mels.append(dataset[position]["mel_spec"].to(torch.float16).contiguous().numpy())
+        else:
+            mels.append(None)
+    return mels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="precompute float16 mel store")
+    parser.add_argument('dataset_dir', type=str, help="folder with raw.arrow (or raw/)")
+    parser.add_argument('-w', '--workers', default=os.cpu_count(), type=int)
+    parser.add_argument('-c', '--chunk_size', default=256, type=int, help="rows per worker task")
+    parser.add_argument('--target_sample_rate', default=24000, type=int)
+    parser.add_argument('--n_mel_channels', default=100, type=int)
+    parser.add_argument('--hop_length', default=256, type=int)
+    args = parser.parse_args()
+
+    mel_spec_kwargs = dict(target_sample_rate = args.target_sample_rate, n_mel_channels = args.n_mel_channels, hop_length = args.hop_length)
+    num_rows = len(load_raw(args.dataset_dir))
+    ranges = [(start, min(start + args.chunk_size, num_rows)) for start in range(0, num_rows, args.chunk_size)]
+
+    offsets = np.zeros(num_rows + 1, dtype = np.int64)
+    offsets_path = f"{args.dataset_dir}/mel_offsets.npy"
+    if os.path.exists(offsets_path):
+        os.remove(offsets_path)  # store incomplete until rewritten
+
+    start_time = time.time()
+    index = 0
+    with open(f"{args.dataset_dir}/mel.bin", "wb") as f, \
+         ProcessPoolExecutor(max_workers = args.workers, initializer = init_worker, initargs = (args.dataset_dir, mel_spec_kwargs)) as executor:
+        # a few waves of tasks in flight, results written in row order
+        wave_size = args.workers * 4
+        with tqdm(total = num_rows, desc = "Computing mel") as pbar:
+            for wave_start in range(0, len(ranges), wave_size):
+                for mels in executor.map(compute_mels, ranges[wave_start:wave_start + wave_size]):
+                    for mel in mels:
+                        frames = 0 if mel is None else mel.shape[-1]
+                        if mel is not None:
+                            f.write(mel.tobytes())
+                        offsets[index + 1] = offsets[index] + frames
+                        index += 1
+                    pbar.update(len(mels))
+
+    with open(f"{args.dataset_dir}/mel_info.json", "w", encoding="utf-8") as f:
+        json.dump(mel_spec_kwargs, f)
+    np.save(offsets_path, offsets)
+
+    elapsed = time.time() - start_time
+    total_frames = int(offsets[-1])
+    print(f"\n{num_rows} rows, {int((np.diff(offsets) > 0).sum())} with mel, {total_frames} frames "
+          f"({total_frames * args.n_mel_channels * 2 / 1024 ** 3:.2f} GB float16) in {elapsed / 60:.1f} min, {total_frames / elapsed:.0f} frames/s")
+
+
+if __name__ == "__main__":
+    main()
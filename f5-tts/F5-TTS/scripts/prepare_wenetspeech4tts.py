@@ -4,14 +4,14 @@
 import sys, os
 sys.path.append(os.getcwd())
 
-import json
 from tqdm import tqdm
 from concurrent.futures import ProcessPoolExecutor
 
 import torchaudio
 from datasets import Dataset
 
-from model.utils import convert_char_to_pinyin
+from model.g2p import G2P
+from model.dataset import save_duration_index, save_token_vocab, text_to_token_ids
 
 
 def deal_with_sub_path_files(dataset_path, sub_path):
@@ -30,15 +30,14 @@ def deal_with_sub_path_files(dataset_path, sub_path):
         text = first_line[1].strip()
 
         audio_paths.append(audio_path)
-
-        if tokenizer == "pinyin":
-            texts.extend(convert_char_to_pinyin([text], polyphone = polyphone))
-        elif tokenizer == "char":
-            texts.append(text)
+        texts.append(text)
 
         audio, sample_rate = torchaudio.load(audio_path)
         durations.append(audio.shape[-1] / sample_rate)
 
+    if tokenizer == "pinyin":  # whole sub path at once, clauses & words shared across rows converted once per worker
+        texts = g2p.convert(texts)
+
     return audio_paths, texts, durations
 
 
@@ -64,13 +63,6 @@ def main():
     if not os.path.exists("data"):
         os.makedirs("data")
 
-    print(f"\nSaving to data/{dataset_name}_{tokenizer} ...")
-    dataset = Dataset.from_dict({"audio_path": audio_path_list, "text": text_list, "duration": duration_list})
-    dataset.save_to_disk(f"data/{dataset_name}_{tokenizer}/raw", max_shard_size="2GB")  # arrow format
-
-    with open(f"data/{dataset_name}_{tokenizer}/duration.json", 'w', encoding='utf-8') as f:
-        json.dump({"duration": duration_list}, f, ensure_ascii=False)  # dup a json separately saving duration in case for DynamicBatchSampler ease
-
     print("\nEvaluating vocab size (all characters and symbols / all phonemes) ...")
     text_vocab_set = set()
     for text in tqdm(text_list):
@@ -80,9 +72,22 @@ def main():
     if tokenizer == "pinyin":
         text_vocab_set.update([chr(i) for i in range(32, 127)] + [chr(i) for i in range(192, 256)])
 
+    # token ids against the vocab.txt written below, for pre-tokenized training
+    vocab_char_map = {vocab: i for i, vocab in enumerate(sorted(text_vocab_set))}
+    token_id_list = [text_to_token_ids(text, vocab_char_map) for text in tqdm(text_list, desc="Tokenizing")]
+
+    print(f"\nSaving to data/{dataset_name}_{tokenizer} ...")
+    dataset = Dataset.from_dict({"audio_path": audio_path_list, "text": text_list, "duration": duration_list,
+                                 "token_ids": token_id_list, "token_len": [len(token_ids) for token_ids in token_id_list]})
+    dataset.save_to_disk(f"data/{dataset_name}_{tokenizer}/raw", max_shard_size="2GB")  # arrow format
+
+    # dup durations & text lengths separately, memory-mapped by load_dataset for DynamicBatchSampler ease
+    save_duration_index(f"data/{dataset_name}_{tokenizer}", duration_list, [len(text) for text in text_list])
+
     with open(f"data/{dataset_name}_{tokenizer}/vocab.txt", "w") as f:
         for vocab in sorted(text_vocab_set):
             f.write(vocab + "\n")
+    save_token_vocab(f"data/{dataset_name}_{tokenizer}", vocab_char_map)
     print(f"\nFor {dataset_name}, sample count: {len(text_list)}")
     print(f"For {dataset_name}, vocab size is: {len(text_vocab_set)}\n")
     
@@ -93,6 +98,7 @@ if __name__ == "__main__":
 
     tokenizer = "pinyin"  # "pinyin" | "char"
     polyphone = True
+    g2p = G2P(polyphone = polyphone)  # in each worker, with its own caches
     dataset_choice = 1  # 1: Premium, 2: Standard, 3: Basic
 
     dataset_name = ["WenetSpeech4TTS_Premium", "WenetSpeech4TTS_Standard", "WenetSpeech4TTS_Basic"][dataset_choice-1]
@@ -13,6 +13,7 @@ from model.utils import (
     convert_char_to_pinyin, 
     save_spectrogram,
 )
+from model.utils_infer import VoiceCache
 
 device = "cuda" if torch.cuda.is_available() else "mps" if torch.backends.mps.is_available() else "cpu"
 
@@ -51,6 +52,7 @@ elif exp_name == "E2TTS_Base":
 
 ckpt_path = f"ckpts/{exp_name}/model_{ckpt_step}.pt"
 output_dir = "tests"
+voice_cache_dir = None  # e.g. "tests/voice_cache", None for memory only
 
 # [leverage https://github.com/MahmoudAshraf97/ctc-forced-aligner to get char level alignment]
 # pip install git+https://github.com/MahmoudAshraf97/ctc-forced-aligner.git
@@ -115,33 +117,25 @@ model = CFM(
 
 model = load_checkpoint(model, ckpt_path, device, use_ema = use_ema)
 
-# Audio
-audio, sr = torchaudio.load(audio_to_edit)
-if audio.shape[0] > 1:
-    audio = torch.mean(audio, dim=0, keepdim=True)
-rms = torch.sqrt(torch.mean(torch.square(audio)))
-if rms < target_rms:
-    audio = audio * target_rms / rms
-if sr != target_sample_rate:
-    resampler = torchaudio.transforms.Resample(sr, target_sample_rate)
-    audio = resampler(audio)
+# Audio, mel & rms computed once per audio content, kept in voice_cache_dir across runs
+# no silence trimming nor clipping, parts_to_edit refer to the original timeline
+voice_cache = VoiceCache(cache_dir = voice_cache_dir, trim_silence = False, clip_ms = None, target_rms = target_rms)
+voice = voice_cache.get(audio_to_edit)
+rms = voice.rms
 offset = 0
-audio_ = torch.zeros(1, 0)
 edit_mask = torch.zeros(1, 0, dtype=torch.bool)
 for part in parts_to_edit:
     start, end = part
     part_dur = end - start if fix_duration is None else fix_duration.pop(0)
     part_dur = part_dur * target_sample_rate
     start = start * target_sample_rate
-    audio_ = torch.cat((audio_, audio[:, round(offset):round(start)], torch.zeros(1, round(part_dur))), dim = -1)
     edit_mask = torch.cat((edit_mask, 
                            torch.ones(1, round((start - offset) / hop_length), dtype = torch.bool), 
                            torch.zeros(1, round(part_dur / hop_length), dtype = torch.bool)
                            ), dim = -1)
     offset = end * target_sample_rate
-# audio = torch.cat((audio_, audio[:, round(offset):]), dim = -1)
-edit_mask = F.pad(edit_mask, (0, audio.shape[-1] // hop_length - edit_mask.shape[-1] + 1), value = True)
-audio = audio.to(device)
+edit_mask = F.pad(edit_mask, (0, voice.audio_len // hop_length - edit_mask.shape[-1] + 1), value = True)
+audio = voice.mel.to(device)
 edit_mask = edit_mask.to(device)
 
 # Text
@@ -155,7 +149,7 @@ print(f"pinyin: {final_text_list}")
 
 # Duration
 ref_audio_len = 0
-duration = audio.shape[-1] // hop_length
+duration = voice.audio_len // hop_length
 
 # Inference
 with torch.inference_mode():
@@ -12,6 +12,7 @@ hop_length = 256
 tokenizer = "pinyin" # 'pinyin', 'char', or 'custom'
 tokenizer_path = None # if tokenizer = 'custom', define the path to the tokenizer you want to use (should be vocab.txt)
 dataset_name = "Emilia_ZH_EN"
+tokenize = False  # token ids from dataloader workers (pre-tokenized column if present), opt-in for new runs
 
 # -------------------------- Training Settings -------------------------- #
 
@@ -22,6 +23,8 @@ learning_rate = 7.5e-5
 batch_size_per_gpu = 38400  # 8 GPUs, 8 * 38400 = 307200
 batch_size_type = "frame"  # "frame" or "sample"
 max_samples = 64  # max sequences per batch if use frame-wise batch_size. we set 32 for small models, 64 for base models
+rank_balanced_batches = False  # multi-gpu frame-wise batch_size, steps with near-equal padded frames on every gpu (changes batch order, opt-in for new runs)
+mask_padding = False  # mask padding out of attention, more memory, may scale down batch_size_per_gpu
 grad_accumulation_steps = 1  # note: updates = steps / grad_accumulation_steps
 max_grad_norm = 1.
 
@@ -76,6 +79,8 @@ def main():
         batch_size = batch_size_per_gpu, 
         batch_size_type = batch_size_type,
         max_samples = max_samples,
+        rank_balanced_batches = rank_balanced_batches,
+        mask_padding = mask_padding,
         grad_accumulation_steps = grad_accumulation_steps,
         max_grad_norm = max_grad_norm,
         wandb_project = "CFM-TTS",
@@ -84,7 +89,8 @@ def main():
         last_per_steps = last_per_steps,
     )
 
-    train_dataset = load_dataset(dataset_name, tokenizer, mel_spec_kwargs=mel_spec_kwargs)
+    train_dataset = load_dataset(dataset_name, tokenizer, mel_spec_kwargs=mel_spec_kwargs,
+                                 tokenize=tokenize, vocab_char_map=vocab_char_map)
     trainer.train(train_dataset, 
                   resumable_with_seed = 666 # seed for shuffling dataset
                   )